@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
  
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
  
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
  
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.InstrumentacaoSQLMiddleware',
+    'core.replicas.ReplicaLeituraMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,7 +85,7 @@ WSGI_APPLICATION = 'config.wsgi.application'
  
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.banco',  # django.db.backends.postgresql + core.conexoes
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
@@ -90,8 +93,130 @@ DATABASES = {
         'PORT': config('DB_PORT'),
     }
 }
- 
- 
+
+# Reuso de conexões (core.conexoes). DB_CONN_MAX_AGE: segundos que uma conexão é reaproveitada entre
+# requisições (0 abre uma por requisição, como antes). DB_CONN_HEALTH_CHECKS testa a conexão reaproveitada
+# no seu primeiro uso em cada requisição e a troca se o servidor a derrubou.
+# DB_POOL_MODE=transacao é para um pooler em modo transação (PgBouncer pool_mode=transaction): sem cursores
+# no servidor, que não sobrevivem à troca de conexão entre transações. Nesse modo deixe o fuso do banco em
+# UTC, para que o Django não precise de SET TIME ZONE na sessão.
+DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+DB_POOL_MODE = config('DB_POOL_MODE', default='')
+if DB_POOL_MODE == 'transacao':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+elif DB_POOL_MODE:
+    raise ImproperlyConfigured(f"DB_POOL_MODE inválido: {DB_POOL_MODE!r} (use 'transacao' ou deixe vazio)")
+
+# Réplicas de leitura (core.replicas): DB_REPLICAS=host1,host2:5433 cria os aliases replica_1, replica_2...
+# com o mesmo banco e usuário do primário. Nos testes elas espelham o 'default' (TEST MIRROR).
+REPLICAS_LEITURA = []
+for indice, endereco in enumerate(config('DB_REPLICAS', default='', cast=Csv()), start=1):
+    host, _, porta = endereco.partition(':')
+    DATABASES[f'replica_{indice}'] = {**DATABASES['default'], 'HOST': host, 'PORT': porta or DATABASES['default']['PORT'], 'TEST': {'MIRROR': 'default'}}
+    REPLICAS_LEITURA.append(f'replica_{indice}')
+
+DATABASE_ROUTERS = ['core.replicas.RoteadorReplicas']
+
+# Depois de uma escrita, o usuário lê do primário por este tempo (segundos), cobrindo o atraso da replicação
+REPLICA_FIXACAO_SEGUNDOS = config('REPLICA_FIXACAO_SEGUNDOS', default=5, cast=int)
+ 
+ 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Em produção aponte CACHE_BACKEND para um backend compartilhado (Memcached/Redis)
+# para que os workers dividam o cache e a invalidação.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='nutrione'),
+    }
+}
+
+# Tempo (segundos) que os horários livres de um dia ficam no cache de disponibilidade
+DISPONIBILIDADE_CACHE_TIMEOUT = config('DISPONIBILIDADE_CACHE_TIMEOUT', default=600, cast=int)
+
+# Tempo (segundos) que o payload do dashboard de cada cliente fica em cache (invalidado por sinais)
+DASHBOARD_CACHE_TIMEOUT = config('DASHBOARD_CACHE_TIMEOUT', default=600, cast=int)
+
+# Tempo (segundos) que os totais de nutrientes de cada plano ficam em cache (a chave muda com a versão do plano)
+NUTRIENTES_CACHE_TIMEOUT = config('NUTRIENTES_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Por quanto tempo (segundos) um horário escolhido fica reservado para o cliente antes de expirar
+RESERVA_HORARIO_TTL = config('RESERVA_HORARIO_TTL', default=300, cast=int)
+
+
+# Endpoints JSON assíncronos (core.views_async), para o deploy ASGI (deploy/gunicorn_asgi.py)
+# VIEWS_ASYNC troca as rotas principais pelas versões async; ASYNC_DB_WORKERS limita o pool de threads do ORM.
+
+VIEWS_ASYNC = config('VIEWS_ASYNC', default=False, cast=bool)
+ASYNC_DB_WORKERS = config('ASYNC_DB_WORKERS', default=8, cast=int)
+
+
+# Eventos de agenda em tempo real (core.eventos), entregues por long-poll em core.views_async.api_eventos_agenda
+# EVENTOS_LONG_POLL liga a rota e o script da página de agendamento; só vale com VIEWS_ASYNC. O BarramentoLocal
+# só alcança requisições do mesmo processo: com vários workers e ele, deploy/gunicorn_asgi.py desliga o long-poll
+# (a página continua funcionando, só sem atualizar a grade sozinha); para tê-lo, use um backend compartilhado.
+
+EVENTOS_LONG_POLL = VIEWS_ASYNC and config('EVENTOS_LONG_POLL', default=True, cast=bool)
+EVENTOS_BACKEND = config('EVENTOS_BACKEND', default='core.eventos.BarramentoLocal')
+EVENTOS_LONG_POLL_TIMEOUT = config('EVENTOS_LONG_POLL_TIMEOUT', default=25, cast=int)
+EVENTOS_HISTORICO = config('EVENTOS_HISTORICO', default=50, cast=int)
+
+
+# E-mail. Por padrão os e-mails viram arquivos em EMAIL_FILE_PATH (um servidor SMTP local de testes
+# também serve: EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend, EMAIL_HOST=localhost, EMAIL_PORT=1025).
+
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.filebased.EmailBackend')
+EMAIL_FILE_PATH = config('EMAIL_FILE_PATH', default=str(BASE_DIR / 'emails_enviados'))
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='NutriOne <nao-responda@nutrione.com.br>')
+
+
+# Jobs periódicos (core.jobs, comando executar_jobs)
+# Lembretes saem LEMBRETE_ANTECEDENCIA_HORAS antes da consulta; a fila de notificações é enviada
+# por NOTIFICACOES_WORKERS threads e cada notificação é tentada até NOTIFICACOES_MAX_TENTATIVAS vezes.
+
+LEMBRETE_ANTECEDENCIA_HORAS = config('LEMBRETE_ANTECEDENCIA_HORAS', default=24, cast=int)
+NOTIFICACOES_WORKERS = config('NOTIFICACOES_WORKERS', default=4, cast=int)
+NOTIFICACOES_MAX_TENTATIVAS = config('NOTIFICACOES_MAX_TENTATIVAS', default=5, cast=int)
+
+# Feeds iCalendar (core.calendario): consultas a partir de CALENDARIO_DIAS_PASSADOS dias atrás
+
+CALENDARIO_DIAS_PASSADOS = config('CALENDARIO_DIAS_PASSADOS', default=90, cast=int)
+
+
+# Instrumentação de SQL por requisição (core.middleware.InstrumentacaoSQLMiddleware)
+# Desligada por padrão. A amostragem (0 a 1) limita o custo quando ligada em produção.
+
+SQL_INSTRUMENTACAO = config('SQL_INSTRUMENTACAO', default=False, cast=bool)
+SQL_INSTRUMENTACAO_AMOSTRAGEM = config('SQL_INSTRUMENTACAO_AMOSTRAGEM', default=1.0, cast=float)
+SQL_INSTRUMENTACAO_LIMITE_N1 = config('SQL_INSTRUMENTACAO_LIMITE_N1', default=5, cast=int)
+
+
+# Logging
+# https://docs.djangoproject.com/en/3.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console'],
+            'level': config('CORE_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
  
@@ -137,6 +262,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
  
 # Aponta para o nosso modelo de usuário customizado
 AUTH_USER_MODEL = 'core.User'
+
+# O PerfilModelBackend carrega o usuário com os perfis num só JOIN e o guarda em cache (core.backends).
+# O ModelBackend continua na lista só para que sessões abertas antes da troca sigam válidas.
+AUTHENTICATION_BACKENDS = [
+    'core.backends.PerfilModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
  
 # Configuração do Crispy Forms para usar Bootstrap 5
 # settings.py
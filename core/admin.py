@@ -1,7 +1,20 @@
-from django.contrib import admin
+import codecs
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from . import transferencia_planos
+from .gerador_planos import GeradorPlanos
+from .modelos_plano import aplicar_modelo, personalizar_planos
 from .models import (
     User, Especialidade, Nutricionista, Cliente, 
-    Consulta, PlanoAlimentar, Refeicao
+    Consulta, PlanoAlimentar, Refeicao, JanelaAtendimento, ExcecaoAgenda,
+    Alimento, ItemRefeicao, ModeloPlano, Notificacao
 )
 
 class RefeicaoInline(admin.StackedInline):
@@ -18,20 +31,187 @@ class RefeicaoInline(admin.StackedInline):
     )
 
 
+class RefeicaoModeloInline(RefeicaoInline):
+    fk_name = 'modelo'
+    extra = 4
+
+
 class PlanoAlimentarAdmin(admin.ModelAdmin):
-    list_display = ('cliente', 'nutricionista', 'data_criacao')
-    list_filter = ('nutricionista', 'data_criacao')
+    list_display = ('cliente', 'nutricionista', 'data_criacao', 'rascunho', 'modelo')
+    list_filter = ('rascunho', 'nutricionista', 'data_criacao')
+    list_select_related = ('cliente__usuario', 'nutricionista__usuario', 'modelo')
     search_fields = ('cliente__usuario__first_name', 'cliente__usuario__last_name')
-    
+    change_list_template = 'admin/core/planoalimentar/change_list.html'
+    actions = ['exportar_csv', 'exportar_jsonl', 'personalizar']
 
     inlines = [RefeicaoInline]
 
+    def get_inlines(self, request, obj):
+        # Plano que usa um modelo não tem refeições próprias; edita-se o modelo ou personaliza-se o plano
+        if obj is not None and obj.modelo_id:
+            return []
+        return super().get_inlines(request, obj)
+
+    @admin.action(description='Personalizar (copiar as refeições do modelo para o plano)')
+    def personalizar(self, request, queryset):
+        quantidade = personalizar_planos(queryset)
+        self.message_user(request, f'{quantidade} planos personalizados; os demais já tinham refeições próprias.')
+
+    def get_urls(self):
+        return [
+            path('importar/', self.admin_site.admin_view(self.importar_view), name='core_planoalimentar_importar'),
+        ] + super().get_urls()
+
+    def importar_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        if request.method == 'POST' and request.FILES.get('arquivo'):
+            arquivo = request.FILES['arquivo']
+            importador = transferencia_planos.ImportadorPlanos()
+            try:
+                formato = transferencia_planos.formato_do_arquivo(arquivo.name, request.POST.get('formato'))
+                # O upload é lido linha a linha, decodificado em fluxo; não vai inteiro para a memória
+                linhas = codecs.iterdecode(arquivo, 'utf-8-sig')
+                resultado = importador.importar(transferencia_planos.ler_planos(linhas, formato))
+            except (transferencia_planos.ArquivoInvalido, UnicodeDecodeError) as erro:
+                self.message_user(request, f'Arquivo inválido: {erro}', messages.ERROR)
+            else:
+                self.message_user(
+                    request, f"{resultado['planos']} planos e {resultado['refeicoes']} refeições importados; {resultado['erros']} planos com erro.",
+                    messages.WARNING if resultado['erros'] else messages.SUCCESS,
+                )
+                for erro in importador.erros[:20]:
+                    self.message_user(request, erro, messages.WARNING)
+                return redirect('admin:core_planoalimentar_changelist')
+        contexto = {
+            **self.admin_site.each_context(request), 'opts': self.model._meta, 'title': 'Importar planos alimentares',
+            'colunas': transferencia_planos.COLUNAS,
+        }
+        return TemplateResponse(request, 'admin/core/planoalimentar/importar.html', contexto)
+
+    def _exportar(self, queryset, formato):
+        resposta = StreamingHttpResponse(
+            transferencia_planos.exportar(queryset, formato),
+            content_type='text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson; charset=utf-8',
+        )
+        resposta['Content-Disposition'] = f'attachment; filename="planos-{timezone.localdate():%Y%m%d}.{formato}"'
+        return resposta
+
+    @admin.action(description='Exportar planos selecionados (CSV)')
+    def exportar_csv(self, request, queryset):
+        return self._exportar(queryset, 'csv')
+
+    @admin.action(description='Exportar planos selecionados (JSONL)')
+    def exportar_jsonl(self, request, queryset):
+        return self._exportar(queryset, 'jsonl')
+
+
+class JanelaAtendimentoInline(admin.TabularInline):
+    model = JanelaAtendimento
+    extra = 0
+
+
+class ExcecaoAgendaInline(admin.TabularInline):
+    model = ExcecaoAgenda
+    extra = 0
+
+
+class NutricionistaAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'preco_consulta', 'duracao_consulta', 'is_approved')
+    list_filter = ('is_approved',)
+    list_select_related = ('usuario',)
+    inlines = [JanelaAtendimentoInline, ExcecaoAgendaInline]
+
+
+class ClienteAdmin(admin.ModelAdmin):
+    list_select_related = ('usuario',)
+    actions = ['gerar_rascunho_plano', 'aplicar_modelo_plano']
+
+    @admin.action(description='Aplicar modelo de plano alimentar')
+    def aplicar_modelo_plano(self, request, queryset):
+        modelos = ModeloPlano.objects.select_related('nutricionista__usuario')
+        nutricionista = getattr(request.user, 'perfil_nutricionista', None)
+        if nutricionista is not None:
+            modelos = modelos.filter(nutricionista=nutricionista)
+        modelo_id = request.POST.get('modelo', '')
+        if 'aplicar' in request.POST:
+            modelo = modelos.filter(pk=modelo_id).first() if modelo_id.isdigit() else None
+            if modelo is None:
+                self.message_user(request, 'Escolha um modelo de plano.', messages.ERROR)
+                return None
+            planos = aplicar_modelo(modelo, queryset, rascunho=bool(request.POST.get('rascunho')))
+            self.message_user(request, f'Modelo "{modelo.nome}" aplicado a {len(planos)} clientes.')
+            return None
+        contexto = {
+            **self.admin_site.each_context(request), 'opts': self.model._meta, 'title': 'Aplicar modelo de plano alimentar',
+            'clientes': queryset, 'modelos': modelos, 'acao': 'aplicar_modelo_plano',
+            'selecionados': request.POST.getlist(admin.helpers.ACTION_CHECKBOX_NAME),
+        }
+        return TemplateResponse(request, 'admin/core/cliente/aplicar_modelo.html', contexto)
+
+    @admin.action(description='Gerar rascunho de plano alimentar')
+    def gerar_rascunho_plano(self, request, queryset):
+        nutricionista = getattr(request.user, 'perfil_nutricionista', None)
+        if nutricionista is None:
+            self.message_user(request, 'Só um nutricionista pode gerar rascunhos (eles ficam em nome dele).', messages.ERROR)
+            return
+        try:
+            resultado = GeradorPlanos(nutricionista=nutricionista).gerar(queryset)
+        except ValueError as erro:
+            self.message_user(request, str(erro), messages.ERROR)
+            return
+        self.message_user(request, f"{resultado['planos']} rascunhos gerados; {resultado['ignorados']} clientes sem peso, altura ou idade.")
+
+
+class AlimentoAdmin(admin.ModelAdmin):
+    list_display = ('codigo', 'nome', 'grupo', 'energia_kcal', 'proteina_g', 'carboidrato_g', 'lipideos_g', 'fonte')
+    list_filter = ('fonte', 'grupo')
+    search_fields = ('nome', 'codigo')
+
+
+class ItemRefeicaoInline(admin.TabularInline):
+    model = ItemRefeicao
+    extra = 3
+    autocomplete_fields = ('alimento',)
+
+
+class ModeloPlanoAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'nutricionista', 'criado_em')
+    list_filter = ('nutricionista',)
+    list_select_related = ('nutricionista__usuario',)
+    search_fields = ('nome',)
+    inlines = [RefeicaoModeloInline]
+
+
+class RefeicaoAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'plano_alimentar', 'modelo')
+    list_select_related = ('plano_alimentar__cliente__usuario', 'modelo__nutricionista__usuario')
+    inlines = [ItemRefeicaoInline]
+
+
+class NotificacaoAdmin(admin.ModelAdmin):
+    list_display = ('destinatario', 'tipo', 'status', 'tentativas', 'proxima_tentativa', 'enviada_em')
+    list_filter = ('status', 'tipo')
+    search_fields = ('destinatario',)
+    raw_id_fields = ('consulta',)
+    actions = ['reenviar']
+
+    @admin.action(description='Reenviar (volta para a fila)')
+    def reenviar(self, request, queryset):
+        atualizadas = queryset.exclude(status=Notificacao.StatusChoices.ENVIADA).update(
+            status=Notificacao.StatusChoices.PENDENTE, tentativas=0, proxima_tentativa=timezone.now(), erro='',
+        )
+        self.message_user(request, f'{atualizadas} notificações voltaram para a fila.')
+
 
 admin.site.register(User)
 admin.site.register(Especialidade)
-admin.site.register(Nutricionista)
-admin.site.register(Cliente)
+admin.site.register(Nutricionista, NutricionistaAdmin)
+admin.site.register(Cliente, ClienteAdmin)
 admin.site.register(Consulta)
+admin.site.register(Alimento, AlimentoAdmin)
+admin.site.register(ModeloPlano, ModeloPlanoAdmin)
+admin.site.register(Notificacao, NotificacaoAdmin)
 
 
 try:
@@ -43,4 +223,4 @@ except admin.sites.NotRegistered:
 admin.site.register(PlanoAlimentar, PlanoAlimentarAdmin)
 
 
-admin.site.register(Refeicao)
\ No newline at end of file
+admin.site.register(Refeicao, RefeicaoAdmin)
\ No newline at end of file
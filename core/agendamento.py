@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F
+from django.utils import timezone
+
+from .disponibilidade import excecoes_por_dia, janelas_por_dia_semana, slots_do_dia
+from .models import Consulta, Nutricionista, ReservaHorario
+
+
+class ResultadoAgendamento:
+    HORARIO_PASSADO = 'horario_passado'
+    FORA_DA_AGENDA = 'fora_da_agenda'
+    HORARIO_OCUPADO = 'horario_ocupado'
+    HORARIO_RESERVADO = 'horario_reservado'
+
+    MENSAGENS = {
+        HORARIO_PASSADO: "Este horário já passou. Por favor, escolha outro.",
+        FORA_DA_AGENDA: "Este horário não está na agenda do nutricionista. Por favor, escolha outro.",
+        HORARIO_OCUPADO: "Desculpe, este horário acabou de ser agendado. Por favor, escolha outro.",
+        HORARIO_RESERVADO: "Outro cliente está finalizando o agendamento deste horário. Por favor, escolha outro.",
+    }
+
+    def __init__(self, consulta=None, erro=None, reserva=None):
+        self.consulta = consulta
+        self.erro = erro
+        self.reserva = reserva
+
+    @property
+    def sucesso(self):
+        return self.erro is None
+
+    @property
+    def mensagem(self):
+        return self.MENSAGENS.get(self.erro)
+
+
+def _em_minutos(duracao):
+    """Expressão DurationField para `duracao` minutos que também funciona em bancos sem tipo nativo de intervalo."""
+    if connection.features.has_native_duration_field:
+        return ExpressionWrapper(duracao * timedelta(minutes=1), output_field=DurationField())
+    # Sem intervalo nativo (SQLite, MySQL) a duração é guardada em microssegundos e somada por connection.ops
+    return ExpressionWrapper(duracao * 60_000_000, output_field=DurationField())
+
+
+def _sobrepostos(queryset, inicio, fim):
+    """Filtra os registros (data_horario + duracao em minutos) cujo intervalo se sobrepõe a [inicio, fim)."""
+    termino = ExpressionWrapper(F('data_horario') + _em_minutos(F('duracao')), output_field=DateTimeField())
+    # O limite inferior de um dia mantém a busca no índice (nutricionista, data_horario)
+    return queryset.filter(data_horario__lt=fim, data_horario__gt=inicio - timedelta(days=1)).annotate(termino=termino).filter(termino__gt=inicio)
+
+
+def consultas_sobrepostas(nutri, inicio, fim):
+    """Consultas confirmadas do nutricionista que se sobrepõem a [inicio, fim), cada uma com a própria duração."""
+    return _sobrepostos(Consulta.objects.filter(nutricionista=nutri, status=Consulta.StatusChoices.CONFIRMADO), inicio, fim)
+
+
+def _validar_horario(nutri, data_horario):
+    """Com o lock do nutricionista já obtido, confere agenda e sobreposição; retorna o código de erro ou None."""
+    horario_local = timezone.localtime(data_horario, timezone.get_default_timezone()).replace(tzinfo=None)
+    data = horario_local.date()
+    slots = slots_do_dia(data, janelas_por_dia_semana(nutri).get(data.weekday(), ()), excecoes_por_dia(nutri, data, data).get(data, ()), (), nutri.duracao_consulta)
+    if horario_local not in slots:
+        return ResultadoAgendamento.FORA_DA_AGENDA
+    if consultas_sobrepostas(nutri, data_horario, data_horario + timedelta(minutes=nutri.duracao_consulta)).exists():
+        return ResultadoAgendamento.HORARIO_OCUPADO
+    return None
+
+
+def reserva_de_outro_cliente(nutri, cliente, data_horario):
+    """Se outro cliente segura um horário que se sobrepõe à consulta que começaria em data_horario."""
+    reservas = ReservaHorario.objects.filter(nutricionista=nutri, expira_em__gt=timezone.now()).exclude(cliente=cliente)
+    return _sobrepostos(reservas, data_horario, data_horario + timedelta(minutes=nutri.duracao_consulta)).exists()
+
+
+def segurar_horario(cliente, nutricionista, data_horario):
+    """Segura o horário para o cliente por RESERVA_HORARIO_TTL segundos e retorna um ResultadoAgendamento.
+
+    A reserva esconde o horário dos outros clientes na API de horários e é
+    convertida em consulta por reservar_consulta(). Cada cliente segura no máximo
+    um horário por nutricionista: escolher outro libera o anterior.
+    """
+    agora = timezone.now()
+    if data_horario <= agora:
+        return ResultadoAgendamento(erro=ResultadoAgendamento.HORARIO_PASSADO)
+    with transaction.atomic():
+        nutri = Nutricionista.objects.select_for_update().get(pk=nutricionista.pk)
+        erro = _validar_horario(nutri, data_horario)
+        if erro is None and reserva_de_outro_cliente(nutri, cliente, data_horario):
+            erro = ResultadoAgendamento.HORARIO_RESERVADO
+        if erro:
+            return ResultadoAgendamento(erro=erro)
+        # Limpeza oportunista das reservas vencidas deste nutricionista e da reserva anterior do cliente
+        ReservaHorario.objects.filter(nutricionista=nutri, expira_em__lte=agora).delete()
+        ReservaHorario.objects.filter(nutricionista=nutri, cliente=cliente).exclude(data_horario=data_horario).delete()
+        reserva, _ = ReservaHorario.objects.update_or_create(
+            nutricionista=nutri, data_horario=data_horario,
+            defaults={'cliente': cliente, 'duracao': nutri.duracao_consulta, 'expira_em': agora + timedelta(seconds=settings.RESERVA_HORARIO_TTL)},
+        )
+    return ResultadoAgendamento(reserva=reserva)
+
+
+def limpar_reservas_expiradas(agora=None):
+    """Apaga em lote as reservas vencidas (um único DELETE pelo índice de expira_em); retorna quantas foram removidas."""
+    removidas, _ = ReservaHorario.objects.filter(expira_em__lte=agora or timezone.now()).delete()
+    return removidas
+
+
+def reservar_consulta(cliente, nutricionista, data_horario, modalidade):
+    """Agenda uma consulta de forma segura sob concorrência e retorna um ResultadoAgendamento.
+
+    As reservas de um mesmo nutricionista são serializadas por um lock na linha do
+    nutricionista (SELECT ... FOR UPDATE). Com o lock, o horário é validado de novo
+    contra a agenda (janelas e exceções, sem cache), contra sobreposição com as
+    consultas já confirmadas, inclusive as marcadas com outra duração, e contra
+    reservas temporárias de outros clientes. A reserva do próprio cliente é consumida.
+    """
+    if data_horario <= timezone.now():
+        return ResultadoAgendamento(erro=ResultadoAgendamento.HORARIO_PASSADO)
+    try:
+        with transaction.atomic():
+            nutri = Nutricionista.objects.select_for_update().get(pk=nutricionista.pk)
+            erro = _validar_horario(nutri, data_horario)
+            if erro is None and reserva_de_outro_cliente(nutri, cliente, data_horario):
+                erro = ResultadoAgendamento.HORARIO_RESERVADO
+            if erro:
+                return ResultadoAgendamento(erro=erro)
+            consulta = Consulta.objects.create(
+                cliente=cliente, nutricionista=nutri, data_horario=data_horario, duracao=nutri.duracao_consulta, valor=nutri.preco_consulta,
+                modalidade=modalidade, status=Consulta.StatusChoices.CONFIRMADO,
+            )
+            ReservaHorario.objects.filter(nutricionista=nutri, cliente=cliente).delete()
+    except IntegrityError:
+        # Última barreira: a restrição única de (nutricionista, data_horario) confirmados
+        return ResultadoAgendamento(erro=ResultadoAgendamento.HORARIO_OCUPADO)
+    return ResultadoAgendamento(consulta=consulta)
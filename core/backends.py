@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.db import transaction
+
+from .replicas import ler_do_primario
+
+
+PERFIS = ('perfil_cliente', 'perfil_nutricionista')
+# Também sem consulta: o link do feed .ics (core.calendario) aparece nas páginas de consultas e no dashboard
+RELACOES = PERFIS + ('token_calendario',)
+
+
+def _chave_usuario(usuario_id):
+    return f'auth:usuario:{usuario_id}'
+
+
+def invalidar_usuario(usuario_id):
+    chave = _chave_usuario(usuario_id)
+    cache.delete(chave)
+    # Apaga de novo após o commit: uma requisição concorrente pode ter recarregado o usuário antigo
+    transaction.on_commit(lambda: cache.delete(chave))
+
+
+def _campos(objeto, excluir=()):
+    return {campo.attname: getattr(objeto, campo.attname) for campo in objeto._meta.concrete_fields if campo.attname not in excluir}
+
+
+def _para_cache(usuario):
+    """Só as colunas do usuário e das relações, sem a senha: o hash nunca vai para o cache compartilhado.
+
+    No lugar dela vai o hash da sessão (um HMAC da senha com a SECRET_KEY), que o
+    django.contrib.auth confere a cada requisição.
+    """
+    relacoes = {}
+    for relacao in RELACOES:
+        try:
+            relacoes[relacao] = _campos(getattr(usuario, relacao))
+        except ObjectDoesNotExist:
+            relacoes[relacao] = None
+    return {
+        'banco': usuario._state.db, 'usuario': _campos(usuario, excluir=('password',)),
+        'hash_sessao': usuario.get_session_auth_hash(), 'relacoes': relacoes,
+    }
+
+
+def _do_cache(dados):
+    """Reconstrói o usuário (com a senha adiada: um save() não a sobrescreve) e as relações já carregadas."""
+    UserModel = get_user_model()
+    usuario = UserModel.from_db(dados['banco'], list(dados['usuario']), list(dados['usuario'].values()))
+    usuario.hash_sessao_em_cache = dados['hash_sessao']
+    for relacao, campos in dados['relacoes'].items():
+        campo = UserModel._meta.get_field(relacao)
+        relacionado = None
+        if campos is not None:
+            relacionado = campo.related_model.from_db(dados['banco'], list(campos), list(campos.values()))
+            campo.remote_field.set_cached_value(relacionado, usuario)
+        campo.set_cached_value(usuario, relacionado)
+    return usuario
+
+
+class PerfilModelBackend(ModelBackend):
+    """ModelBackend que carrega o usuário junto com os dois perfis (cliente e nutricionista).
+
+    Com select_related nas relações reversas, `user.perfil_cliente` e
+    `hasattr(user, 'perfil_nutricionista')` não fazem mais consultas, nem quando o
+    perfil não existe. Em get_user() (chamado em toda requisição autenticada) o
+    resultado fica em cache pelo tempo de vida da sessão, só com as colunas (sem a
+    senha); os sinais apagam a entrada quando o usuário ou um dos perfis é salvo
+    ou removido.
+    """
+
+    def _usuarios(self):
+        return get_user_model()._default_manager.select_related(*RELACOES)
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            usuario = self._usuarios().get(**{UserModel.USERNAME_FIELD: username})
+        except UserModel.DoesNotExist:
+            UserModel().set_password(password)  # mesmo custo de hash de um usuário existente
+        else:
+            if usuario.check_password(password) and self.user_can_authenticate(usuario):
+                return usuario
+        # Encerra a autenticação aqui: o ModelBackend que segue na lista (só para sessões
+        # antigas) repetiria a busca e o hash da senha a cada login inválido
+        raise PermissionDenied
+
+    def get_user(self, user_id):
+        chave = _chave_usuario(user_id)
+        dados = cache.get(chave)
+        if dados is None:
+            try:
+                with ler_do_primario():
+                    usuario = self._usuarios().get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(chave, _para_cache(usuario), settings.SESSION_COOKIE_AGE)
+        else:
+            usuario = _do_cache(dados)
+        return usuario if self.user_can_authenticate(usuario) else None
@@ -0,0 +1,8 @@
+"""Backend do Postgres do projeto (ENGINE 'core.banco'): o do Django com a verificação de saúde de core.conexoes."""
+from django.db.backends.postgresql import base
+
+from ..conexoes import VerificacaoNoPrimeiroUso
+
+
+class DatabaseWrapper(VerificacaoNoPrimeiroUso, base.DatabaseWrapper):
+    pass
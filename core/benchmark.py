@@ -0,0 +1,443 @@
+"""Benchmark repetível das views mais usadas.
+
+Cada cenário dispara requisições reais pelo django.test.Client (pilha completa:
+middlewares, views, templates e banco) e mede a latência e o número de queries de
+cada uma. O resultado é um dicionário serializável em JSON, comparável entre
+commits com comparar_com_baseline(). BenchmarkConcorrencia compara a vazão sob
+requisições simultâneas entre os handlers WSGI e ASGI do próprio Django, e
+BenchmarkConexoes mede o custo de abrir conexões com e sem reuso.
+"""
+import asyncio
+import io
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from .conexoes import contar_conexoes
+from .dados_sinteticos import GeradorDadosSinteticos
+from .disponibilidade import horarios_livres
+from .models import Cliente, Nutricionista
+
+
+CENARIOS = (
+    'login_usuario', 'dashboard_cliente', 'consultas_cliente',
+    'encontrar_nutricionista', 'api_horarios_disponiveis', 'agendar_consulta',
+)
+STATUS_ESPERADO = {'login_usuario': 302, 'agendar_consulta': 302}
+
+
+def percentil(ordenados, fracao):
+    """Percentil por interpolação linear sobre uma lista já ordenada."""
+    if len(ordenados) == 1:
+        return ordenados[0]
+    posicao = (len(ordenados) - 1) * fracao
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior)
+
+
+def resumir(duracoes, queries, erros, tempo_total):
+    ordenadas = sorted(duracoes)
+    return {
+        'requisicoes': len(duracoes), 'erros': erros,
+        'p50_ms': round(percentil(ordenadas, 0.50) * 1000, 3),
+        'p95_ms': round(percentil(ordenadas, 0.95) * 1000, 3),
+        'p99_ms': round(percentil(ordenadas, 0.99) * 1000, 3),
+        'media_ms': round(statistics.fmean(duracoes) * 1000, 3),
+        'queries_mediana': statistics.median(queries), 'queries_max': max(queries),
+        'throughput_rps': round(len(duracoes) / tempo_total, 2) if tempo_total else None,
+    }
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def banco_de_benchmark(saida=None, **escala):
+    """Cria um banco de teste descartável, popula com GeradorDadosSinteticos(**escala) e o remove no fim.
+
+    O benchmark nunca toca nos dados do banco configurado.
+    """
+    setup_test_environment()
+    nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        GeradorDadosSinteticos(saida=saida, **escala).gerar()
+        yield
+    finally:
+        if connection.vendor == 'postgresql':
+            # Com CONN_MAX_AGE as threads dos benchmarks (pool async, WSGI) mantêm conexões abertas, que impediriam o DROP
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()')
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+        teardown_test_environment()
+
+
+class Benchmark:
+    """Executa os cenários sobre um banco já populado (ver core.dados_sinteticos).
+
+    As requisições autenticadas se revezam entre `usuarios` clientes já logados, e
+    as de nutricionista entre os primeiros aprovados, para não medir sempre o mesmo
+    registro (nem só acertos de cache). O login usa a senha real dos usuários
+    gerados, então inclui o custo do hash de senha.
+    """
+
+    def __init__(self, iteracoes=100, aquecimento=10, senha='nutrione123', usuarios=20, cenarios=CENARIOS):
+        self.iteracoes = iteracoes
+        self.aquecimento = aquecimento
+        self.senha = senha
+        self.usuarios = usuarios
+        self.cenarios = [cenario for cenario in CENARIOS if cenario in cenarios]
+
+    def preparar(self):
+        self.clientes = list(Cliente.objects.select_related('usuario').order_by('id')[:self.usuarios])
+        self.nutricionistas = list(Nutricionista.objects.filter(is_approved=True).order_by('id')[:self.usuarios])
+        if not self.clientes or not self.nutricionistas:
+            raise ValueError('O banco precisa de clientes e nutricionistas aprovados (rode gerar_dados antes).')
+        self.navegadores = []
+        for cliente in self.clientes:
+            navegador = Client()
+            navegador.force_login(cliente.usuario)
+            self.navegadores.append(navegador)
+        self.inicio_agenda = timezone.localdate() + timedelta(days=1)
+        if 'agendar_consulta' in self.cenarios:
+            self.horarios_para_agendar = self._horarios_livres(self.aquecimento + self.iteracoes)
+
+    def _horarios_livres(self, quantidade):
+        """Horários livres distintos, um por requisição, para que cada POST agende de fato."""
+        horarios = []
+        fim = self.inicio_agenda + timedelta(days=29)
+        for nutri in Nutricionista.objects.filter(is_approved=True).order_by('id').iterator():
+            for dia in horarios_livres(nutri, self.inicio_agenda, fim).values():
+                horarios.extend((nutri.id, horario) for horario in dia)
+            if len(horarios) >= quantidade:
+                return horarios[:quantidade]
+        raise ValueError(f'Só há {len(horarios)} horários livres para o cenário agendar_consulta; reduza as iterações.')
+
+    # --- Cenários: cada um recebe o número da requisição e devolve a resposta ---
+
+    def login_usuario(self, indice):
+        cliente = self.clientes[indice % len(self.clientes)]
+        return Client().post(reverse('login'), {'username': cliente.usuario.username, 'password': self.senha})
+
+    def dashboard_cliente(self, indice):
+        return self.navegadores[indice % len(self.navegadores)].get(reverse('dashboard_cliente'))
+
+    def consultas_cliente(self, indice):
+        return self.navegadores[indice % len(self.navegadores)].get(reverse('consultas_cliente'))
+
+    def encontrar_nutricionista(self, indice):
+        parametros = {'ordenar': 'proximo_horario'} if indice % 2 else {}
+        return self.navegadores[indice % len(self.navegadores)].get(reverse('encontrar_nutricionista'), parametros)
+
+    def api_horarios_disponiveis(self, indice):
+        nutri = self.nutricionistas[indice % len(self.nutricionistas)]
+        parametros = {'nutri_id': nutri.id, 'inicio': self.inicio_agenda.isoformat(), 'fim': (self.inicio_agenda + timedelta(days=29)).isoformat()}
+        return self.navegadores[indice % len(self.navegadores)].get(reverse('api_horarios_disponiveis'), parametros)
+
+    def agendar_consulta(self, indice):
+        nutri_id, horario = self.horarios_para_agendar[indice]
+        dados = {'modalidade': 'ONLINE', 'data_horario_selecionado': horario.strftime('%Y-%m-%d %H:%M:%S')}
+        return self.navegadores[indice % len(self.navegadores)].post(reverse('agendar_consulta', args=[nutri_id]), dados)
+
+    def medir(self, nome):
+        requisicao = getattr(self, nome)
+        esperado = STATUS_ESPERADO.get(nome, 200)
+        for indice in range(self.aquecimento):
+            requisicao(indice)
+        duracoes = []; queries = []; erros = 0
+        inicio_total = time.perf_counter()
+        for indice in range(self.aquecimento, self.aquecimento + self.iteracoes):
+            with CaptureQueriesContext(connection) as capturadas:
+                inicio = time.perf_counter()
+                resposta = requisicao(indice)
+                duracoes.append(time.perf_counter() - inicio)
+            queries.append(len(capturadas.captured_queries))
+            erros += resposta.status_code != esperado
+        return resumir(duracoes, queries, erros, time.perf_counter() - inicio_total)
+
+    def executar(self):
+        self.preparar()
+        return {
+            'gerado_em': timezone.now().isoformat(), 'commit': commit_atual(),
+            'python': platform.python_version(), 'django': django.get_version(), 'banco': connection.vendor,
+            'iteracoes': self.iteracoes, 'aquecimento': self.aquecimento,
+            'cenarios': {nome: self.medir(nome) for nome in self.cenarios},
+        }
+
+
+def comparar_com_baseline(resultado, baseline, tolerancia=0.25, folga_ms=2.0):
+    """Retorna a lista de regressões em relação ao baseline (vazia se nada piorou).
+
+    Queries por requisição são determinísticas e não têm tolerância. A latência
+    (p95) pode passar do baseline em `tolerancia` (fração) mais `folga_ms`, para
+    absorver o ruído de medições de poucos milissegundos.
+    """
+    regressoes = []
+    for nome, atual in resultado['cenarios'].items():
+        anterior = baseline.get('cenarios', {}).get(nome)
+        if anterior is None:
+            continue
+        if atual['queries_max'] > anterior['queries_max']:
+            regressoes.append(f"{nome}: {atual['queries_max']} queries por requisição (baseline: {anterior['queries_max']})")
+        limite = anterior['p95_ms'] * (1 + tolerancia) + folga_ms
+        if atual['p95_ms'] > limite:
+            regressoes.append(f"{nome}: p95 de {atual['p95_ms']:.1f} ms (baseline: {anterior['p95_ms']:.1f} ms, limite: {limite:.1f} ms)")
+        if atual['erros'] > anterior.get('erros', 0):
+            regressoes.append(f"{nome}: {atual['erros']} respostas com status inesperado")
+    return regressoes
+
+
+class LatenciaBanco:
+    """execute_wrapper que soma um atraso fixo a cada query, como a ida e volta até um Postgres remoto."""
+
+    def __init__(self, ms):
+        self.segundos = ms / 1000
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.segundos)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def latencia_simulada(ms):
+    """Aplica LatenciaBanco a todas as conexões abertas durante o bloco, em qualquer thread."""
+    if not ms:
+        yield
+        return
+    atraso = LatenciaBanco(ms)
+
+    def instalar(sender, connection, **kwargs):
+        if atraso not in connection.execute_wrappers:
+            connection.execute_wrappers.append(atraso)
+
+    connection_created.connect(instalar, weak=False)
+    connection.execute_wrappers.append(atraso)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(instalar)
+        connection.execute_wrappers.remove(atraso)
+
+
+def chamar_wsgi(handler, caminho, query, sessao):
+    """Executa uma requisição GET completa no WSGIHandler (sinais de início e fim inclusos) e devolve o status."""
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': caminho, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_COOKIE': f'{settings.SESSION_COOKIE_NAME}={sessao}', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    resposta = handler(environ, lambda linha, cabecalhos, exc_info=None: status.append(linha))
+    b''.join(resposta); resposta.close()
+    return int(status[0].split()[0])
+
+
+class BenchmarkConcorrencia:
+    """Vazão de requisições simultâneas nos handlers reais do Django, sem servidor HTTP.
+
+    Modos comparados sobre o mesmo banco e as mesmas requisições:
+      - wsgi: WSGIHandler com `concorrencia` threads (como gunicorn gthread);
+      - asgi_sync: ASGIHandler num event loop, com as views síncronas;
+      - asgi_async: ASGIHandler com as views de core.views_async.
+    No Django 3.2 o ASGIHandler executa views síncronas numa única thread
+    compartilhada, por isso asgi_sync serve de referência do que as views async evitam.
+    """
+    MODOS = ('wsgi', 'asgi_sync', 'asgi_async')
+    ENDPOINTS = {
+        'api_horarios_disponiveis': {'sync': 'api_horarios_disponiveis', 'async': 'api_horarios_disponiveis_async'},
+        'perfil_cliente': {'sync': 'perfil_cliente', 'async': 'perfil_cliente_async'},
+    }
+
+    def __init__(self, requisicoes=400, concorrencia=32, usuarios=20, latencia_db_ms=1.0):
+        self.requisicoes = requisicoes
+        self.concorrencia = concorrencia
+        self.usuarios = usuarios
+        self.latencia_db_ms = latencia_db_ms
+
+    def preparar(self):
+        self.sessoes = []
+        for cliente in Cliente.objects.select_related('usuario').order_by('id')[:self.usuarios]:
+            navegador = Client()
+            navegador.force_login(cliente.usuario)
+            self.sessoes.append(navegador.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.nutricionistas = list(Nutricionista.objects.filter(is_approved=True).order_by('id').values_list('id', flat=True)[:self.usuarios])
+        if not self.sessoes or not self.nutricionistas:
+            raise ValueError('O banco precisa de clientes e nutricionistas aprovados (rode gerar_dados antes).')
+        inicio = timezone.localdate() + timedelta(days=1)
+        self.intervalo = {'inicio': inicio.isoformat(), 'fim': (inicio + timedelta(days=29)).isoformat()}
+
+    def requisicao(self, endpoint, variante, indice):
+        """(caminho, query string, cookie de sessão) da requisição de número `indice`."""
+        caminho = reverse(self.ENDPOINTS[endpoint][variante])
+        parametros = {'nutri_id': self.nutricionistas[indice % len(self.nutricionistas)], **self.intervalo} if endpoint == 'api_horarios_disponiveis' else {}
+        return caminho, urlencode(parametros), self.sessoes[indice % len(self.sessoes)]
+
+    def _wsgi(self, endpoint):
+        handler = WSGIHandler()
+        duracoes = []; erros = [0]
+        trava = threading.Lock()
+
+        def trabalhar(primeira):
+            locais = []; falhas = 0
+            for indice in range(primeira, self.requisicoes, self.concorrencia):
+                inicio = time.perf_counter()
+                status = chamar_wsgi(handler, *self.requisicao(endpoint, 'sync', indice))
+                locais.append(time.perf_counter() - inicio)
+                falhas += status != 200
+            connection.close()
+            with trava:
+                duracoes.extend(locais); erros[0] += falhas
+
+        threads = [threading.Thread(target=trabalhar, args=(primeira,)) for primeira in range(self.concorrencia)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return duracoes, erros[0], time.perf_counter() - inicio
+
+    async def _asgi(self, endpoint, variante):
+        handler = ASGIHandler()
+        limite = asyncio.Semaphore(self.concorrencia)
+        duracoes = []; erros = 0
+
+        async def chamar(indice):
+            nonlocal erros
+            caminho, query, sessao = self.requisicao(endpoint, variante, indice)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': caminho, 'raw_path': caminho.encode(), 'query_string': query.encode(), 'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', f'{settings.SESSION_COOKIE_NAME}={sessao}'.encode()), (b'x-requested-with', b'XMLHttpRequest')],
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            }
+            status = []
+
+            async def receber():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def enviar(mensagem):
+                if mensagem['type'] == 'http.response.start':
+                    status.append(mensagem['status'])
+
+            async with limite:
+                inicio = time.perf_counter()
+                await handler(scope, receber, enviar)
+                duracoes.append(time.perf_counter() - inicio)
+            erros += status[0] != 200
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(chamar(indice) for indice in range(self.requisicoes)))
+        return duracoes, erros, time.perf_counter() - inicio
+
+    def medir(self, endpoint, modo):
+        if modo == 'wsgi':
+            duracoes, erros, tempo_total = self._wsgi(endpoint)
+        else:
+            duracoes, erros, tempo_total = asyncio.run(self._asgi(endpoint, 'sync' if modo == 'asgi_sync' else 'async'))
+        ordenadas = sorted(duracoes)
+        return {
+            'requisicoes': len(duracoes), 'erros': erros, 'throughput_rps': round(len(duracoes) / tempo_total, 2),
+            'p50_ms': round(percentil(ordenadas, 0.50) * 1000, 3), 'p95_ms': round(percentil(ordenadas, 0.95) * 1000, 3),
+            'p99_ms': round(percentil(ordenadas, 0.99) * 1000, 3),
+        }
+
+    def executar(self):
+        self.preparar()
+        with latencia_simulada(self.latencia_db_ms):
+            endpoints = {endpoint: {modo: self.medir(endpoint, modo) for modo in self.MODOS} for endpoint in self.ENDPOINTS}
+        return {
+            'gerado_em': timezone.now().isoformat(), 'commit': commit_atual(),
+            'python': platform.python_version(), 'django': django.get_version(), 'banco': connection.vendor,
+            'requisicoes': self.requisicoes, 'concorrencia': self.concorrencia, 'latencia_db_ms': self.latencia_db_ms,
+            'async_db_workers': getattr(settings, 'ASYNC_DB_WORKERS', 8), 'endpoints': endpoints,
+        }
+
+
+class BenchmarkConexoes(BenchmarkConcorrencia):
+    """Custo por requisição de abrir conexões, com e sem reuso (CONN_MAX_AGE).
+
+    As requisições passam pelo WSGIHandler real, em sequência, numa thread: é ele
+    que dispara request_started/request_finished, onde o Django fecha ou mantém a
+    conexão. Modos:
+      - nova_por_requisicao: CONN_MAX_AGE=0 (cada requisição abre e fecha a sua);
+      - persistente: CONN_MAX_AGE=`max_age`, sem verificação;
+      - persistente_verificada: idem, com DB_CONN_HEALTH_CHECKS (um SELECT 1 no primeiro uso da conexão na requisição).
+    `latencia_conexao_ms` soma um atraso a cada conexão aberta, como o handshake
+    TCP/TLS com um Postgres em outra máquina (a conexão local não tem esse custo).
+    """
+    MODOS = {
+        'nova_por_requisicao': {'max_age': 0, 'verificar': False},
+        'persistente': {'max_age': None, 'verificar': False},
+        'persistente_verificada': {'max_age': None, 'verificar': True},
+    }
+
+    def __init__(self, requisicoes=300, usuarios=20, max_age=60, latencia_conexao_ms=0.0):
+        super().__init__(requisicoes=requisicoes, concorrencia=1, usuarios=usuarios, latencia_db_ms=0)
+        self.max_age = max_age
+        self.latencia_conexao_ms = latencia_conexao_ms
+
+    def medir(self, endpoint, modo):
+        configuracao = self.MODOS[modo]
+        handler = WSGIHandler()
+        original = connection.settings_dict['CONN_MAX_AGE']
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = self.max_age if configuracao['max_age'] is None else configuracao['max_age']
+        duracoes = []; erros = 0
+        try:
+            with override_settings(DB_CONN_HEALTH_CHECKS=configuracao['verificar']), contar_conexoes() as abertas:
+                for indice in range(self.requisicoes):
+                    inicio = time.perf_counter()
+                    erros += chamar_wsgi(handler, *self.requisicao(endpoint, 'sync', indice)) != 200
+                    duracoes.append(time.perf_counter() - inicio)
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original
+        ordenadas = sorted(duracoes)
+        return {
+            'requisicoes': len(duracoes), 'erros': erros, 'conexoes_abertas': abertas[0],
+            'conexoes_por_requisicao': round(abertas[0] / len(duracoes), 3),
+            'p50_ms': round(percentil(ordenadas, 0.50) * 1000, 3), 'p95_ms': round(percentil(ordenadas, 0.95) * 1000, 3),
+            'media_ms': round(statistics.fmean(duracoes) * 1000, 3),
+        }
+
+    def executar(self):
+        self.preparar()
+
+        def atrasar(sender, connection, **kwargs):
+            time.sleep(self.latencia_conexao_ms / 1000)
+
+        if self.latencia_conexao_ms:
+            connection_created.connect(atrasar, weak=False)
+        try:
+            endpoints = {endpoint: {modo: self.medir(endpoint, modo) for modo in self.MODOS} for endpoint in self.ENDPOINTS}
+        finally:
+            connection_created.disconnect(atrasar)
+        return {
+            'gerado_em': timezone.now().isoformat(), 'commit': commit_atual(),
+            'python': platform.python_version(), 'django': django.get_version(), 'banco': connection.vendor,
+            'requisicoes': self.requisicoes, 'max_age': self.max_age, 'latencia_conexao_ms': self.latencia_conexao_ms,
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,159 @@
+"""Feeds iCalendar (.ics) das consultas, autenticados por token (TokenCalendario).
+
+Apps de calendário buscam o feed a cada poucos minutos. Antes de gerar qualquer
+coisa, uma agregação pelos índices das consultas do usuário (quantidade e maior
+`atualizado_em`) vira o ETag e o Last-Modified: se nada mudou, a view responde
+304. O que não passa por `atualizado_em` também move a versão: consultas
+apagadas e nomes alterados marcam TokenCalendario.feed_alterado_em (sinais em
+core.signals), e a janela do feed, que anda à meia-noite, entra pela meia-noite
+de hoje. Se mudou, o corpo sai evento por evento de um `.iterator()` (cursor no
+servidor, no Postgres) e vai num StreamingHttpResponse, sem carregar a agenda na
+memória.
+
+O feed cobre as consultas a partir de CALENDARIO_DIAS_PASSADOS dias atrás, de
+um usuário como cliente e/ou como nutricionista. As canceladas continuam no
+feed com STATUS:CANCELLED para o app tirá-las do calendário.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import Consulta, TokenCalendario, gerar_token_calendario
+
+
+TAMANHO_LOTE = 500
+LARGURA_LINHA = 75  # octetos, RFC 5545 3.1
+STATUS_ICS = {
+    Consulta.StatusChoices.CONFIRMADO: 'CONFIRMED',
+    Consulta.StatusChoices.CONCLUIDO: 'CONFIRMED',
+    Consulta.StatusChoices.CANCELADO: 'CANCELLED',
+}
+CAMPOS = (
+    'id', 'data_horario', 'duracao', 'modalidade', 'status', 'atualizado_em', 'cliente__usuario_id',
+    'cliente__usuario__first_name', 'cliente__usuario__last_name', 'cliente__usuario__username',
+    'nutricionista__usuario__first_name', 'nutricionista__usuario__last_name', 'nutricionista__usuario__username',
+)
+
+
+def token_do_usuario(usuario):
+    """O token do usuário (o PerfilModelBackend já o traz carregado); cria se faltar, ex.: usuários inseridos em lote."""
+    try:
+        return usuario.token_calendario
+    except TokenCalendario.DoesNotExist:
+        token, _ = TokenCalendario.objects.get_or_create(usuario=usuario)
+        return token
+
+
+def regenerar_token(usuario):
+    """Troca o token do usuário: o link antigo do feed para de funcionar."""
+    token, _ = TokenCalendario.objects.update_or_create(usuario=usuario, defaults={'token': gerar_token_calendario()})
+    return token
+
+
+def marcar_feeds_alterados(usuarios):
+    """Move a versão dos feeds destes usuários (filtro de User) por uma mudança que as consultas não registram."""
+    TokenCalendario.objects.filter(usuario__in=usuarios).update(feed_alterado_em=timezone.now())
+
+
+def _meia_noite(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min), timezone.get_default_timezone())
+
+
+def _hoje(agora=None):
+    return timezone.localdate(agora or timezone.now(), timezone.get_default_timezone())
+
+
+def inicio_do_feed(agora=None):
+    return _meia_noite(_hoje(agora) - timedelta(days=getattr(settings, 'CALENDARIO_DIAS_PASSADOS', 90)))
+
+
+def _perfil(usuario, relacao):
+    try:
+        return getattr(usuario, relacao)
+    except ObjectDoesNotExist:
+        return None
+
+
+def consultas_do_feed(usuario, agora=None):
+    """Consultas do feed; filtra pelos ids dos perfis (não por join com o usuário) para usar os índices por cliente/nutricionista."""
+    perfis = Q()
+    cliente = _perfil(usuario, 'perfil_cliente')
+    nutricionista = _perfil(usuario, 'perfil_nutricionista')
+    if cliente:
+        perfis |= Q(cliente_id=cliente.id)
+    if nutricionista:
+        perfis |= Q(nutricionista_id=nutricionista.id)
+    if not perfis:
+        return Consulta.objects.none()
+    return Consulta.objects.filter(perfis, data_horario__gte=inicio_do_feed(agora))
+
+
+def versao_do_feed(consultas, token, agora=None):
+    """(ETag, Last-Modified em segundos) do feed.
+
+    A última mudança é a maior entre as consultas, a marcação do token e a meia-noite
+    de hoje (quando a janela andou pela última vez); a quantidade entra no ETag.
+    """
+    resumo = consultas.aggregate(total=Count('id'), ultima=Max('atualizado_em'))
+    ultima = max(filter(None, (resumo['ultima'], token.feed_alterado_em, _meia_noite(_hoje(agora)))))
+    return f'"{resumo["total"]}-{int(ultima.timestamp() * 1_000_000)}"', int(ultima.timestamp())
+
+
+def _texto(valor):
+    return valor.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _utc(momento):
+    return momento.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _linha(conteudo):
+    """Uma linha do conteúdo, dobrada em LARGURA_LINHA octetos (as continuações começam com espaço)."""
+    partes = []; atual = ''; tamanho = 0
+    for caractere in conteudo:
+        octetos = len(caractere.encode())
+        if tamanho + octetos > LARGURA_LINHA:
+            partes.append(atual); atual = ' '; tamanho = 1
+        atual += caractere; tamanho += octetos
+    partes.append(atual)
+    return '\r\n'.join(partes) + '\r\n'
+
+
+def _nome(primeiro, ultimo, username):
+    return f'{primeiro} {ultimo}'.strip() or username
+
+
+def _evento(linha, usuario_id):
+    (consulta_id, inicio, duracao, modalidade, status, atualizado_em, cliente_usuario_id,
+     cliente_nome, cliente_sobrenome, cliente_username, nutri_nome, nutri_sobrenome, nutri_username) = linha
+    if cliente_usuario_id == usuario_id:
+        resumo = f'Consulta com {_nome(nutri_nome, nutri_sobrenome, nutri_username)}'
+    else:
+        resumo = f'Consulta: {_nome(cliente_nome, cliente_sobrenome, cliente_username)}'
+    descricao = f'Modalidade: {Consulta.ModalidadeChoices(modalidade).label}\nStatus: {Consulta.StatusChoices(status).label}'
+    return ''.join((
+        'BEGIN:VEVENT\r\n',
+        _linha(f'UID:consulta-{consulta_id}@nutrione'),
+        _linha(f'DTSTAMP:{_utc(atualizado_em)}'),
+        _linha(f'LAST-MODIFIED:{_utc(atualizado_em)}'),
+        _linha(f'DTSTART:{_utc(inicio)}'),
+        _linha(f'DTEND:{_utc(inicio + timedelta(minutes=duracao))}'),
+        _linha(f'SUMMARY:{_texto(resumo)}'),
+        _linha(f'DESCRIPTION:{_texto(descricao)}'),
+        _linha(f'STATUS:{STATUS_ICS[status]}'),
+        'END:VEVENT\r\n',
+    ))
+
+
+def gerar_ics(consultas, usuario, tamanho_lote=TAMANHO_LOTE):
+    """Gera o .ics em pedaços (cabeçalho, um evento por vez, rodapé) para o StreamingHttpResponse."""
+    yield ''.join(map(_linha, (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//NutriOne//Consultas//PT-BR', 'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH', 'X-WR-CALNAME:NutriOne - Consultas', 'REFRESH-INTERVAL;VALUE=DURATION:PT15M',
+    )))
+    for linha in consultas.order_by('data_horario', 'id').values_list(*CAMPOS).iterator(chunk_size=tamanho_lote):
+        yield _evento(linha, usuario.id)
+    yield 'END:VCALENDAR\r\n'
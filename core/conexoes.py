@@ -0,0 +1,71 @@
+"""Reuso de conexões com o Postgres: verificação de saúde e contagem de conexões abertas.
+
+Com DB_CONN_MAX_AGE > 0 o Django mantém a conexão da thread entre requisições
+em vez de abrir uma nova (TCP + autenticação + inicialização da sessão) a cada
+uma. O Django 3.2 não tem CONN_HEALTH_CHECKS: uma conexão derrubada pelo
+servidor (restart, timeout de ociosidade, failover) só seria descoberta na
+primeira query, com erro para o usuário. Com DB_CONN_HEALTH_CHECKS, como no
+CONN_HEALTH_CHECKS do Django 4.1, cada conexão reaproveitada é testada no seu
+primeiro uso dentro da requisição (e trocada se estiver quebrada): requisições
+que não tocam numa conexão, ex.: servidas pelo cache, não pagam o SELECT 1.
+O teste fica no ensure_connection do backend core.banco.
+"""
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+_total = itertools.count(1)
+_ultimo_total = 0
+_contador = ContextVar('contador_conexoes', default=None)
+
+
+def registrar_conexao(sender, connection, **kwargs):
+    """Receptor de connection_created: conta a conexão no processo e na requisição em andamento."""
+    global _ultimo_total
+    _ultimo_total = next(_total)
+    contador = _contador.get()
+    if contador is not None:
+        contador[0] += 1
+
+
+def conexoes_abertas():
+    """Quantas conexões o processo abriu desde que subiu."""
+    return _ultimo_total
+
+
+@contextmanager
+def contar_conexoes():
+    """Conta as conexões abertas durante o bloco (no contexto atual); o total fica em contador[0]."""
+    contador = [0]
+    token = _contador.set(contador)
+    try:
+        yield contador
+    finally:
+        _contador.reset(token)
+
+
+class VerificacaoNoPrimeiroUso:
+    """Mixin do DatabaseWrapper: testa a conexão marcada por verificar_conexoes_persistentes ao usá-la pela primeira vez."""
+    verificar_no_proximo_uso = False
+
+    def ensure_connection(self):
+        if self.verificar_no_proximo_uso:
+            self.verificar_no_proximo_uso = False
+            # Dentro de uma transação não se mexe: trocar a conexão perderia o que já foi feito nela
+            if self.connection is not None and not self.in_atomic_block and not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+
+def verificar_conexoes_persistentes(sender, **kwargs):
+    """Receptor de request_started: marca as conexões reaproveitadas para serem testadas no primeiro uso."""
+    if not getattr(settings, 'DB_CONN_HEALTH_CHECKS', False):
+        return
+    for conexao in connections.all():
+        # Só as conexões abertas numa requisição anterior; sem query nenhuma aqui
+        if conexao.connection is not None:
+            conexao.verificar_no_proximo_uso = True
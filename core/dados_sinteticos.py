@@ -0,0 +1,301 @@
+"""Gerador determinístico de dados sintéticos para testes de carga.
+
+Toda a aleatoriedade vem de um único random.Random(seed) e as datas são relativas a
+`data_base`; com a mesma semente, a mesma escala e a mesma data base, o banco
+gerado é o mesmo. A inserção é feita em lotes com bulk_create e a memória fica
+limitada aos ids (array de inteiros) e ao lote corrente, não ao volume total.
+"""
+import random
+import time as relogio
+from array import array
+from bisect import bisect
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .metricas import reconciliar
+from .models import (
+    User, Especialidade, Nutricionista, Cliente, Consulta,
+    PlanoAlimentar, Refeicao, JanelaAtendimento, TokenCalendario
+)
+
+
+ESPECIALIDADES = [
+    'Emagrecimento', 'Nutrição Esportiva', 'Nutrição Clínica', 'Nutrição Materno-Infantil',
+    'Vegetarianismo e Veganismo', 'Diabetes', 'Doenças Cardiovasculares', 'Nutrição Funcional',
+    'Transtornos Alimentares', 'Gerontologia', 'Intolerâncias Alimentares', 'Comportamento Alimentar',
+]
+OBJETIVOS = ['EMAGRECIMENTO', 'GANHO_MASSA', 'REEDUCACAO_ALIMENTAR', 'NUTRICAO_ESPORTIVA', 'MELHORAR_SAUDE', 'OUTRO']
+OBJETIVOS_PESOS = [40, 20, 20, 10, 8, 2]
+NOMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João', 'Larissa', 'Marcos', 'Natália', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Thiago', 'Valéria', 'Yuri']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida']
+
+# Modelos de agenda semanal: (peso, [(dia_semana, inicio, fim), ...])
+MODELOS_AGENDA = [
+    (35, [(dia, time(8), time(12)) for dia in range(5)] + [(dia, time(14), time(18)) for dia in range(5)]),
+    (20, [(dia, time(8), time(12)) for dia in range(6)]),
+    (20, [(dia, time(13), time(19)) for dia in range(5)]),
+    (15, [(dia, time(17), time(21)) for dia in (0, 1, 2, 3)] + [(5, time(8), time(12))]),
+    (10, [(dia, time(9), time(16)) for dia in (1, 3)]),
+]
+DURACOES = [30, 45, 60, 60, 60, 90]
+
+REFEICOES = [
+    ('Café da Manhã', ['Pão integral', 'Ovos mexidos', 'Mamão', 'Iogurte natural', 'Aveia', 'Café sem açúcar', 'Queijo branco', 'Banana'], (250, 450)),
+    ('Lanche da Manhã', ['Maçã', 'Castanhas', 'Iogurte grego', 'Pera', 'Mix de sementes'], (100, 200)),
+    ('Almoço', ['Arroz integral', 'Feijão', 'Frango grelhado', 'Salada verde', 'Legumes no vapor', 'Patinho moído', 'Batata-doce', 'Peixe assado'], (450, 750)),
+    ('Lanche da Tarde', ['Tapioca', 'Frutas vermelhas', 'Whey protein', 'Pasta de amendoim', 'Pão de queijo'], (150, 300)),
+    ('Jantar', ['Omelete', 'Sopa de legumes', 'Salada completa', 'Carne magra', 'Quinoa', 'Abobrinha refogada'], (350, 600)),
+    ('Ceia', ['Chá', 'Leite morno', 'Kiwi', 'Castanhas'], (80, 180)),
+]
+
+
+def inserir_em_lote(model, objetos, tamanho_lote):
+    """bulk_create que garante o pk em cada objeto.
+
+    O PostgreSQL devolve os ids do INSERT; nos demais bancos os ids novos são lidos
+    em ordem logo depois (o gerador é o único escritor durante a carga).
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objetos, batch_size=tamanho_lote)
+    ultimo = model.objects.aggregate(maximo=Max('id'))['maximo'] or 0
+    model.objects.bulk_create(objetos, batch_size=tamanho_lote)
+    for objeto, pk in zip(objetos, model.objects.filter(id__gt=ultimo).order_by('id').values_list('id', flat=True)):
+        objeto.pk = pk
+    return objetos
+
+
+class GeradorDadosSinteticos:
+    def __init__(self, seed=42, clientes=1000, nutricionistas=50, consultas=10000, planos=None,
+                 dias_passado=365, dias_futuro=60, tamanho_lote=5000, senha='nutrione123',
+                 dominio='sintetico.nutrione', data_base=None, saida=None):
+        self.rng = random.Random(seed)
+        self.total_clientes = clientes
+        self.total_nutricionistas = nutricionistas
+        self.total_consultas = consultas
+        self.total_planos = clientes // 2 if planos is None else planos
+        self.dias_passado = dias_passado
+        self.dias_futuro = dias_futuro
+        self.tamanho_lote = tamanho_lote
+        self.senha = senha
+        self.dominio = dominio
+        self.data_base = data_base or timezone.localdate()
+        self.saida = saida
+        self.tz = timezone.get_default_timezone()
+        self.nutricionista_ids = array('q')
+        self.cliente_ids = array('q')
+        self.agenda_nutri = []  # índice do modelo de agenda por nutricionista
+        self.duracao_nutri = array('h')
+        self.preco_nutri = []
+        self.modalidades_nutri = []
+        self.popularidade_nutri = []
+        self.pesos_acumulados_cliente = []
+        self._cache_slots = {}
+        self._cache_horarios = {}
+
+    def log(self, mensagem):
+        if self.saida:
+            self.saida(mensagem)
+
+    def gerar(self):
+        if User.objects.filter(email__endswith='@' + self.dominio).exists():
+            raise ValueError(f'Já existem usuários @{self.dominio}; use um banco novo ou outro domínio.')
+        self.senha_hash = make_password(self.senha)  # um hash só: PBKDF2 por usuário dominaria o tempo de carga
+        etapas = [
+            ('especialidades', self.gerar_especialidades),
+            ('nutricionistas', self.gerar_nutricionistas),
+            ('clientes', self.gerar_clientes),
+            ('consultas', self.gerar_consultas),
+            ('planos alimentares', self.gerar_planos),
+            ('métricas dos nutricionistas', self.gerar_metricas),
+        ]
+        for nome, etapa in etapas:
+            inicio = relogio.perf_counter()
+            quantidade = etapa()
+            duracao = relogio.perf_counter() - inicio
+            self.log(f'{nome}: {quantidade} em {duracao:.1f}s ({quantidade / duracao if duracao else 0:.0f}/s)')
+
+    # --- Usuários e perfis ---
+
+    def _nome(self):
+        return self.rng.choice(NOMES), self.rng.choice(SOBRENOMES)
+
+    def _usuarios(self, prefixo, inicio, fim, tipo):
+        usuarios = []
+        for indice in range(inicio, fim):
+            primeiro, ultimo = self._nome()
+            email = f'{prefixo}{indice}@{self.dominio}'
+            usuarios.append(User(
+                username=email, email=email, password=self.senha_hash, first_name=primeiro, last_name=ultimo,
+                telefone=f'119{self.rng.randrange(10**7, 10**8)}', user_type=tipo,
+            ))
+        usuarios = inserir_em_lote(User, usuarios, self.tamanho_lote)
+        # O token do feed de calendário já nasce com o usuário, como no cadastro (senão a primeira página faz get_or_create)
+        TokenCalendario.objects.bulk_create((TokenCalendario(usuario_id=usuario.pk) for usuario in usuarios), batch_size=self.tamanho_lote)
+        return usuarios
+
+    def gerar_especialidades(self):
+        self.especialidade_ids = [Especialidade.objects.get_or_create(nome=nome)[0].id for nome in ESPECIALIDADES]
+        return len(self.especialidade_ids)
+
+    def gerar_nutricionistas(self):
+        pesos_agenda = list(accumulate(peso for peso, _ in MODELOS_AGENDA))
+        Especialidades = Nutricionista.especialidades.through
+        for inicio in range(0, self.total_nutricionistas, self.tamanho_lote):
+            fim = min(inicio + self.tamanho_lote, self.total_nutricionistas)
+            with transaction.atomic():
+                usuarios = self._usuarios('nutri', inicio, fim, User.UserType.NUTRICIONISTA)
+                nutris = []
+                for usuario in usuarios:
+                    presencial = self.rng.random() < 0.8
+                    nutris.append(Nutricionista(
+                        usuario_id=usuario.pk, preco_consulta=max(80, min(450, round(self.rng.gauss(180, 60) / 10) * 10)),
+                        duracao_consulta=self.rng.choice(DURACOES), is_approved=self.rng.random() < 0.9,
+                        atende_presencial=presencial, atende_online=not presencial or self.rng.random() < 0.6,
+                    ))
+                inserir_em_lote(Nutricionista, nutris, self.tamanho_lote)
+                janelas = []; especialidades = []
+                for nutri in nutris:
+                    modelo = bisect(pesos_agenda, self.rng.randrange(pesos_agenda[-1]))
+                    self.nutricionista_ids.append(nutri.pk); self.agenda_nutri.append(modelo); self.duracao_nutri.append(nutri.duracao_consulta); self.preco_nutri.append(nutri.preco_consulta)
+                    self.modalidades_nutri.append([m for m, ativo in (('PRESENCIAL', nutri.atende_presencial), ('ONLINE', nutri.atende_online)) if ativo])
+                    janelas += [JanelaAtendimento(nutricionista_id=nutri.pk, dia_semana=dia, hora_inicio=h_inicio, hora_fim=h_fim) for dia, h_inicio, h_fim in MODELOS_AGENDA[modelo][1]]
+                    especialidades += [Especialidades(nutricionista_id=nutri.pk, especialidade_id=esp) for esp in self.rng.sample(self.especialidade_ids, self.rng.randint(1, 3))]
+                JanelaAtendimento.objects.bulk_create(janelas, batch_size=self.tamanho_lote)
+                Especialidades.objects.bulk_create(especialidades, batch_size=self.tamanho_lote)
+        # Popularidade com cauda longa (Pareto): poucos nutricionistas concentram a demanda
+        self.popularidade_nutri = [self.rng.paretovariate(1.2) for _ in self.nutricionista_ids]
+        return self.total_nutricionistas
+
+    def gerar_clientes(self):
+        for inicio in range(0, self.total_clientes, self.tamanho_lote):
+            fim = min(inicio + self.tamanho_lote, self.total_clientes)
+            with transaction.atomic():
+                usuarios = self._usuarios('cliente', inicio, fim, User.UserType.CLIENTE)
+                clientes = []
+                for usuario in usuarios:
+                    altura = round(self.rng.gauss(1.68, 0.09), 2)
+                    clientes.append(Cliente(
+                        usuario_id=usuario.pk, altura=altura, idade=self.rng.randint(16, 80),
+                        peso=round(max(40, self.rng.gauss(24.5, 4.5) * altura * altura), 1),
+                        objetivos=self.rng.choices(OBJETIVOS, OBJETIVOS_PESOS)[0],
+                    ))
+                inserir_em_lote(Cliente, clientes, self.tamanho_lote)
+                self.cliente_ids.extend(cliente.pk for cliente in clientes)
+        self.pesos_acumulados_cliente = list(accumulate(self.rng.paretovariate(1.5) for _ in self.cliente_ids))
+        return self.total_clientes
+
+    # --- Consultas ---
+
+    def _slots_semana(self, modelo, duracao):
+        if (modelo, duracao) in self._cache_slots:
+            return self._cache_slots[modelo, duracao]
+        slots = self._cache_slots[modelo, duracao] = []
+        for dia, h_inicio, h_fim in MODELOS_AGENDA[modelo][1]:
+            atual = datetime.combine(self.data_base, h_inicio); limite = datetime.combine(self.data_base, h_fim)
+            while atual + timedelta(minutes=duracao) <= limite:
+                slots.append((dia, atual.time()))
+                atual += timedelta(minutes=duracao)
+        return slots
+
+    def _horario(self, data, hora):
+        # As mesmas (data, hora) se repetem entre nutricionistas; localizar no fuso custa caro por linha
+        if (data, hora) not in self._cache_horarios:
+            self._cache_horarios[data, hora] = timezone.make_aware(datetime.combine(data, hora), self.tz)
+        return self._cache_horarios[data, hora]
+
+    def _distribuir(self, total, pesos, capacidades):
+        """Sorteia quantas consultas cada nutricionista recebe, proporcional ao peso e limitado à capacidade.
+
+        O excedente dos nutricionistas lotados é sorteado de novo entre os que ainda têm
+        horários; retorna (quantidade por nutricionista, consultas que não couberam).
+        """
+        por_nutri = [0] * len(pesos)
+        candidatos = list(range(len(pesos)))
+        restantes = total
+        while restantes and candidatos:
+            acumulados = list(accumulate(pesos[indice] for indice in candidatos))
+            for _ in range(restantes):
+                por_nutri[candidatos[bisect(acumulados, self.rng.random() * acumulados[-1])]] += 1
+            restantes = sum(max(0, quantidade - capacidade) for quantidade, capacidade in zip(por_nutri, capacidades))
+            por_nutri = [min(quantidade, capacidade) for quantidade, capacidade in zip(por_nutri, capacidades)]
+            candidatos = [indice for indice in candidatos if por_nutri[indice] < capacidades[indice]]
+        return por_nutri, restantes
+
+    def gerar_consultas(self):
+        if not self.nutricionista_ids or not self.cliente_ids:
+            return 0
+        inicio = self.data_base - timedelta(days=self.dias_passado)
+        primeira_segunda = inicio - timedelta(days=inicio.weekday())
+        semanas = (self.dias_passado + self.dias_futuro) // 7 + 1
+        capacidades = [len(self._slots_semana(modelo, duracao)) * semanas for modelo, duracao in zip(self.agenda_nutri, self.duracao_nutri)]
+        por_nutri, sem_horario = self._distribuir(self.total_consultas, self.popularidade_nutri, capacidades)
+        if sem_horario:
+            self.log(f'{sem_horario} consulta(s) não couberam nas agendas; aumente --dias-passado ou --nutricionistas.')
+
+        # O "agora" que separa passadas de futuras é o início da data base, não o relógio: senão o status (e a
+        # sequência do rng dali em diante) dependeria da hora em que o comando roda
+        agora = self._horario(self.data_base, time(0))
+        total_clientes = self.pesos_acumulados_cliente[-1]
+        criadas = 0; lote = []
+        for indice, quantidade in enumerate(por_nutri):
+            if not quantidade:
+                continue
+            slots = self._slots_semana(self.agenda_nutri[indice], self.duracao_nutri[indice])
+            for posicao in sorted(self.rng.sample(range(capacidades[indice]), quantidade)):
+                semana, slot = divmod(posicao, len(slots))
+                dia, hora = slots[slot]
+                data = primeira_segunda + timedelta(days=semana * 7 + dia)
+                data_horario = self._horario(data, hora)
+                if data_horario < agora:
+                    status = self.rng.choices(['CONCLUIDO', 'CANCELADO', 'CONFIRMADO'], [70, 15, 15])[0]
+                else:
+                    status = self.rng.choices(['CONFIRMADO', 'CANCELADO'], [92, 8])[0]
+                lote.append(Consulta(
+                    cliente_id=self.cliente_ids[bisect(self.pesos_acumulados_cliente, self.rng.random() * total_clientes)],
+                    nutricionista_id=self.nutricionista_ids[indice], data_horario=data_horario,
+                    duracao=self.duracao_nutri[indice], valor=self.preco_nutri[indice], modalidade=self.rng.choice(self.modalidades_nutri[indice]), status=status,
+                ))
+                if len(lote) >= self.tamanho_lote:
+                    Consulta.objects.bulk_create(lote); criadas += len(lote); lote = []
+        Consulta.objects.bulk_create(lote)
+        return criadas + len(lote)
+
+    # --- Rollup do dashboard do nutricionista ---
+
+    def gerar_metricas(self):
+        # As consultas entraram com bulk_create, sem os sinais que mantêm o rollup
+        reconciliar(Nutricionista.objects.filter(usuario__email__endswith='@' + self.dominio))
+        return len(self.nutricionista_ids)
+
+    # --- Planos alimentares ---
+
+    def gerar_planos(self):
+        if not self.nutricionista_ids or not self.cliente_ids:
+            return 0
+        clientes = self.rng.sample(range(len(self.cliente_ids)), min(self.total_planos, len(self.cliente_ids)))
+        tamanho_lote = max(1, self.tamanho_lote // len(REFEICOES))
+        for inicio in range(0, len(clientes), tamanho_lote):
+            with transaction.atomic():
+                planos = [
+                    PlanoAlimentar(cliente_id=self.cliente_ids[posicao], nutricionista_id=self.rng.choice(self.nutricionista_ids), observacoes=self.rng.choice(['', 'Beber 2L de água por dia.', 'Evitar frituras.', 'Reduzir açúcar.']))
+                    for posicao in clientes[inicio:inicio + tamanho_lote]
+                ]
+                inserir_em_lote(PlanoAlimentar, planos, self.tamanho_lote)
+                refeicoes = []
+                for plano in planos:
+                    for nome, alimentos, (kcal_min, kcal_max) in REFEICOES:
+                        if nome in ('Lanche da Manhã', 'Ceia') and self.rng.random() < 0.4:
+                            continue
+                        escolhidos = self.rng.sample(alimentos, min(len(alimentos), self.rng.randint(2, 4)))
+                        refeicoes.append(Refeicao(
+                            plano_alimentar_id=plano.pk, nome=nome, alimentos=', '.join(escolhidos),
+                            quantidades=', '.join(f'{self.rng.choice([50, 80, 100, 120, 150, 200])}g' for _ in escolhidos),
+                            calorias=self.rng.randint(kcal_min, kcal_max),
+                        ))
+                Refeicao.objects.bulk_create(refeicoes, batch_size=self.tamanho_lote)
+        return len(clientes)
@@ -0,0 +1,108 @@
+import time as relogio
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Consulta, PlanoAlimentar
+from .replicas import ler_do_primario
+
+
+# --- CACHE DO DASHBOARD DO CLIENTE ---
+# O payload (próxima consulta, plano atual e refeições) fica em cache por cliente,
+# numa chave com a versão do cliente. Os sinais trocam a versão quando consultas,
+# planos, refeições ou o próprio cliente mudam, então uma entrada antiga nunca é
+# lida de novo. O nome e o preço do nutricionista da próxima consulta também
+# aparecem na página: o payload guarda a versão do nutricionista com que foi
+# calculado e é refeito se ela mudou.
+
+def normalizar_nome_refeicao(nome):
+    if not nome:
+        return ""
+
+    nfkd_form = unicodedata.normalize('NFKD', nome)
+    nome_sem_acentos = "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+
+    return nome_sem_acentos.lower().replace(" ", "_").replace("-", "_")
+
+
+def _chave_versao_cliente(cliente_id):
+    return f'dashboard:versao:cliente:{cliente_id}'
+
+
+def _chave_versao_nutricionista(usuario_id):
+    return f'dashboard:versao:nutricionista:{usuario_id}'
+
+
+def _chave_dashboard(cliente_id, versao):
+    return f'dashboard:cliente:{cliente_id}:v{versao}'
+
+
+def _versao(chave):
+    versao = cache.get(chave)
+    if versao is None:
+        # Versão inicial do relógio: se a chave for despejada, não volta a um número já usado
+        cache.add(chave, relogio.time_ns() // 1000, None)
+        versao = cache.get(chave)
+    return versao
+
+
+def _trocar_versao(chave):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        cache.set(chave, relogio.time_ns() // 1000, None)
+
+
+def _trocar_versao_apos_commit(chave):
+    _trocar_versao(chave)
+    # De novo após o commit: uma leitura concorrente pode ter recalculado o
+    # dashboard com os dados anteriores à transação enquanto ela estava aberta.
+    transaction.on_commit(lambda: _trocar_versao(chave))
+
+
+def invalidar_dashboard_cliente(cliente_id):
+    _trocar_versao_apos_commit(_chave_versao_cliente(cliente_id))
+
+
+def invalidar_dashboard_nutricionista(usuario_id):
+    """Descarta os dashboards que mostram este nutricionista (nome, preço) na próxima consulta."""
+    _trocar_versao_apos_commit(_chave_versao_nutricionista(usuario_id))
+
+
+def calcular_dashboard_cliente(cliente, agora=None):
+    proxima_consulta = Consulta.objects.filter(
+        cliente=cliente, data_horario__gte=agora or timezone.now(), status=Consulta.StatusChoices.CONFIRMADO
+    ).select_related('nutricionista__usuario').only(
+        # Só o que a página mostra: o payload vai para o cache compartilhado, e o usuário inteiro levaria o hash da senha
+        'data_horario', 'modalidade', 'status', 'nutricionista__preco_consulta',
+        'nutricionista__usuario__first_name', 'nutricionista__usuario__last_name',
+    ).order_by('data_horario').first()
+    plano_atual = PlanoAlimentar.objects.filter(cliente=cliente, rascunho=False).select_related('modelo').order_by('-data_criacao').first()
+    refeicoes = {}
+    if plano_atual:
+        for refeicao in plano_atual.refeicoes_do_plano():
+            refeicoes[normalizar_nome_refeicao(refeicao.nome)] = refeicao
+    return {'proxima_consulta': proxima_consulta, 'plano_atual': plano_atual, 'refeicoes': refeicoes}
+
+
+def dados_dashboard_cliente(cliente, agora=None):
+    """Payload do dashboard do cliente, do cache quando ainda válido."""
+    agora = agora or timezone.now()
+    chave = _chave_dashboard(cliente.id, _versao(_chave_versao_cliente(cliente.id)))
+    dados = cache.get(chave)
+    if dados is not None:
+        consulta = dados['proxima_consulta']
+        if consulta is None:
+            return dados
+        # A próxima consulta em cache pode já ter passado, ou o nutricionista ter mudado desde o cálculo
+        if consulta.data_horario >= agora and dados['versao_nutricionista'] == _versao(_chave_versao_nutricionista(consulta.nutricionista.usuario_id)):
+            return dados
+    with ler_do_primario():
+        dados = calcular_dashboard_cliente(cliente, agora)
+    consulta = dados['proxima_consulta']
+    dados['versao_nutricionista'] = _versao(_chave_versao_nutricionista(consulta.nutricionista.usuario_id)) if consulta else None
+    cache.set(chave, dados, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 10 * 60))
+    return dados
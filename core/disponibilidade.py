@@ -0,0 +1,280 @@
+import time as relogio
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Consulta, ExcecaoAgenda, JanelaAtendimento, ReservaHorario
+from .replicas import ler_do_primario
+
+
+DIAS_SEMANA = ['segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo']
+MAX_DIAS_INTERVALO = 60
+CHAVE_ACERTOS = 'disponibilidade:estatisticas:acertos'
+CHAVE_FALHAS = 'disponibilidade:estatisticas:falhas'
+
+
+def limites_do_intervalo(inicio, fim):
+    """Converte as datas locais [inicio, fim] num intervalo semiaberto de datetimes com fuso."""
+    tz = timezone.get_default_timezone()
+    return (
+        timezone.make_aware(datetime.combine(inicio, time.min), tz),
+        timezone.make_aware(datetime.combine(fim + timedelta(days=1), time.min), tz),
+    )
+
+
+def janelas_por_dia_semana(nutri):
+    # Usa nutri.janelas.all() para aproveitar um prefetch_related('janelas'), se houver
+    janelas = {}
+    for janela in nutri.janelas.all():
+        janelas.setdefault(janela.dia_semana, []).append((janela.hora_inicio, janela.hora_fim))
+    return janelas
+
+
+def excecoes_por_dia(nutri, inicio, fim):
+    excecoes = {}
+    for excecao in ExcecaoAgenda.objects.filter(nutricionista=nutri, data__gte=inicio, data__lte=fim):
+        excecoes.setdefault(excecao.data, []).append(excecao)
+    return excecoes
+
+
+def intervalo_ocupado(horario_local, duracao):
+    """(início, fim) de uma consulta como horários do dia; o fim é limitado à meia-noite."""
+    fim = horario_local + timedelta(minutes=duracao)
+    return horario_local.time(), fim.time() if fim.date() == horario_local.date() else time.max
+
+
+def slots_do_dia(data, janelas_semana, excecoes_dia, ocupados_dia, duracao):
+    """Horários de início livres num dia, já aplicando exceções e consultas marcadas.
+
+    Cada consulta precisa caber inteira numa janela aberta e não pode se sobrepor a
+    um bloqueio nem a uma consulta marcada (`ocupados_dia` traz intervalos (início, fim)),
+    mesmo que esta tenha sido marcada com outra duração.
+    """
+    abertas = list(janelas_semana); bloqueios = list(ocupados_dia)
+    for excecao in excecoes_dia:
+        if excecao.disponivel:
+            abertas.append((excecao.hora_inicio, excecao.hora_fim))
+        elif excecao.hora_inicio is None:
+            return []
+        else:
+            bloqueios.append((excecao.hora_inicio, excecao.hora_fim))
+    passo = timedelta(minutes=duracao)
+    livres = set()
+    for hora_inicio, hora_fim in abertas:
+        hora_atual = datetime.combine(data, hora_inicio); limite = datetime.combine(data, hora_fim)
+        while hora_atual + passo <= limite:
+            inicio_slot = hora_atual.time(); fim_slot = (hora_atual + passo).time()
+            if not any(inicio_slot < b_fim and fim_slot > b_inicio for b_inicio, b_fim in bloqueios):
+                livres.add(hora_atual)
+            hora_atual += passo
+    return sorted(livres)
+
+
+def definir_janelas_semanais(nutri, janelas):
+    """Substitui as janelas semanais do nutricionista por [(dia_semana, hora_inicio, hora_fim), ...]."""
+    with transaction.atomic():
+        JanelaAtendimento.objects.filter(nutricionista=nutri).delete()
+        JanelaAtendimento.objects.bulk_create(
+            JanelaAtendimento(nutricionista=nutri, dia_semana=dia, hora_inicio=inicio, hora_fim=fim) for dia, inicio, fim in janelas
+        )
+    # bulk_create não dispara sinais
+    invalidar_agenda(nutri.id)
+
+
+def horarios_ocupados(nutri, inicio, fim):
+    """Intervalos (início, fim) das consultas confirmadas entre as datas inicio e fim (inclusive), por dia local.
+
+    Usa uma única consulta por intervalo sobre (nutricionista, data_horario), sem o
+    cast de ``__date`` que impediria o uso do índice.
+    """
+    tz = timezone.get_default_timezone()
+    limite_inicio, limite_fim = limites_do_intervalo(inicio, fim)
+    marcadas = Consulta.objects.filter(
+        nutricionista=nutri, status=Consulta.StatusChoices.CONFIRMADO,
+        data_horario__gte=limite_inicio, data_horario__lt=limite_fim,
+    ).values_list('data_horario', 'duracao')
+    ocupados = {}
+    for data_horario, duracao in marcadas:
+        local = timezone.localtime(data_horario, tz).replace(tzinfo=None)
+        ocupados.setdefault(local.date(), []).append(intervalo_ocupado(local, duracao))
+    return ocupados
+
+
+def horarios_reservados(nutricionistas_ids, inicio, fim, exceto_cliente=None, agora=None):
+    """{(nutri_id, datetime local sem fuso)} dos horários segurados por reservas ainda válidas.
+
+    As reservas de `exceto_cliente` não entram: o próprio cliente continua vendo o horário que segurou.
+    """
+    tz = timezone.get_default_timezone()
+    limite_inicio, limite_fim = limites_do_intervalo(inicio, fim)
+    reservas = ReservaHorario.objects.filter(
+        nutricionista_id__in=nutricionistas_ids, data_horario__gte=limite_inicio, data_horario__lt=limite_fim,
+        expira_em__gt=agora or timezone.now(),
+    )
+    if exceto_cliente is not None:
+        reservas = reservas.exclude(cliente=exceto_cliente)
+    return {(nutri_id, timezone.localtime(data_horario, tz).replace(tzinfo=None)) for nutri_id, data_horario in reservas.values_list('nutricionista_id', 'data_horario')}
+
+
+def calcular_horarios_livres(nutri, inicio, fim):
+    """Calcula, sem cache, {data: [datetime local sem fuso, ...]} com os horários não ocupados de cada dia."""
+    janelas = janelas_por_dia_semana(nutri)
+    excecoes = excecoes_por_dia(nutri, inicio, fim)
+    ocupados = horarios_ocupados(nutri, inicio, fim) if janelas or excecoes else {}
+    dias = {}
+    data = inicio
+    while data <= fim:
+        dias[data] = slots_do_dia(data, janelas.get(data.weekday(), ()), excecoes.get(data, ()), ocupados.get(data, ()), nutri.duracao_consulta)
+        data += timedelta(days=1)
+    return dias
+
+
+def proximos_horarios(nutricionistas, inicio, fim, agora=None, cliente=None):
+    """Retorna {nutri_id: datetime local sem fuso} com o primeiro horário livre de cada nutricionista.
+
+    Trabalha sobre o conjunto inteiro de candidatos: janelas, exceções, consultas
+    marcadas e reservas vêm em quatro consultas, qualquer que seja o número de nutricionistas.
+    """
+    nutricionistas = list(nutricionistas)
+    ids = [nutri.id for nutri in nutricionistas]
+    if not ids:
+        return {}
+    tz = timezone.get_default_timezone()
+    agora_local = timezone.localtime(agora or timezone.now(), tz).replace(tzinfo=None)
+    inicio = max(inicio, agora_local.date())
+
+    janelas = {}
+    for nutri_id, dia_semana, hora_inicio, hora_fim in JanelaAtendimento.objects.filter(nutricionista_id__in=ids).order_by().values_list('nutricionista_id', 'dia_semana', 'hora_inicio', 'hora_fim'):
+        janelas.setdefault((nutri_id, dia_semana), []).append((hora_inicio, hora_fim))
+    excecoes = {}
+    for excecao in ExcecaoAgenda.objects.filter(nutricionista_id__in=ids, data__gte=inicio, data__lte=fim).order_by():
+        excecoes.setdefault((excecao.nutricionista_id, excecao.data), []).append(excecao)
+    limite_inicio, limite_fim = limites_do_intervalo(inicio, fim)
+    ocupados = {}
+    for nutri_id, data_horario, duracao in Consulta.objects.filter(
+        nutricionista_id__in=ids, status=Consulta.StatusChoices.CONFIRMADO,
+        data_horario__gte=limite_inicio, data_horario__lt=limite_fim,
+    ).values_list('nutricionista_id', 'data_horario', 'duracao'):
+        horario = timezone.localtime(data_horario, tz).replace(tzinfo=None)
+        ocupados.setdefault((nutri_id, horario.date()), []).append(intervalo_ocupado(horario, duracao))
+    reservados = horarios_reservados(ids, inicio, fim, exceto_cliente=cliente, agora=agora)
+
+    proximos = {}
+    for nutri in nutricionistas:
+        data = inicio
+        while data <= fim and nutri.id not in proximos:
+            janelas_dia = janelas.get((nutri.id, data.weekday()), ()); excecoes_dia = excecoes.get((nutri.id, data), ())
+            if janelas_dia or excecoes_dia:
+                for horario in slots_do_dia(data, janelas_dia, excecoes_dia, ocupados.get((nutri.id, data), ()), nutri.duracao_consulta):
+                    if horario > agora_local and (nutri.id, horario) not in reservados:
+                        proximos[nutri.id] = horario
+                        break
+            data += timedelta(days=1)
+    return proximos
+
+
+# --- CACHE DE DISPONIBILIDADE (por nutricionista e dia) ---
+# As chaves carregam a versão da agenda do nutricionista: alterar janelas, exceções
+# ou a duração da consulta troca a versão e descarta todos os dias de uma vez.
+# A versão inicial vem do relógio para que, se a chave de versão for despejada do
+# cache, a nova versão nunca coincida com a de entradas antigas.
+
+def _chave_versao(nutri_id):
+    return f'disponibilidade:versao:{nutri_id}'
+
+
+def _chave_dia(nutri_id, versao, data):
+    return f'disponibilidade:{nutri_id}:v{versao}:{data.isoformat()}'
+
+
+def versao_agenda(nutri_id):
+    chave = _chave_versao(nutri_id)
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, relogio.time_ns() // 1000, None)
+        versao = cache.get(chave)
+    return versao
+
+
+def invalidar_agenda(nutri_id):
+    try:
+        cache.incr(_chave_versao(nutri_id))
+    except ValueError:
+        cache.set(_chave_versao(nutri_id), relogio.time_ns() // 1000, None)
+
+
+def invalidar_dia(nutri_id, data):
+    chave = _chave_dia(nutri_id, versao_agenda(nutri_id), data)
+    cache.delete(chave)
+    # Apaga de novo após o commit: uma leitura concorrente pode ter recalculado o
+    # dia com os dados anteriores à transação enquanto ela ainda estava aberta.
+    transaction.on_commit(lambda: cache.delete(chave))
+
+
+def _incrementar(chave, valor):
+    if not valor:
+        return
+    cache.add(chave, 0, None)
+    try:
+        cache.incr(chave, valor)
+    except ValueError:
+        cache.set(chave, valor, None)
+
+
+def estatisticas_cache():
+    valores = cache.get_many([CHAVE_ACERTOS, CHAVE_FALHAS])
+    acertos = valores.get(CHAVE_ACERTOS, 0); falhas = valores.get(CHAVE_FALHAS, 0)
+    total = acertos + falhas
+    return {'acertos': acertos, 'falhas': falhas, 'taxa_acerto': acertos / total if total else None}
+
+
+def zerar_estatisticas_cache():
+    cache.delete_many([CHAVE_ACERTOS, CHAVE_FALHAS])
+
+
+def horarios_livres(nutri, inicio, fim, agora=None, cliente=None):
+    """Retorna {data: [datetime local sem fuso, ...]} com os horários livres e futuros de cada dia do intervalo.
+
+    Os dias presentes no cache são reaproveitados; os que faltam são calculados
+    juntos, com uma única consulta ao banco, e gravados no cache. Horários
+    segurados por outros clientes (ReservaHorario) são retirados na leitura, já
+    que expiram sozinhos e não invalidam o cache.
+    """
+    versao = versao_agenda(nutri.id)
+    chaves = {}
+    data = inicio
+    while data <= fim:
+        chaves[data] = _chave_dia(nutri.id, versao, data)
+        data += timedelta(days=1)
+    em_cache = cache.get_many(list(chaves.values()))
+    faltando = [data for data, chave in chaves.items() if chave not in em_cache]
+    _incrementar(CHAVE_ACERTOS, len(chaves) - len(faltando)); _incrementar(CHAVE_FALHAS, len(faltando))
+
+    dias = {data: [datetime.combine(data, hora) for hora in em_cache[chave]] for data, chave in chaves.items() if chave in em_cache}
+    if faltando:
+        # Vai para o cache: lido do primário, nunca de uma réplica atrasada
+        with ler_do_primario():
+            calculados = calcular_horarios_livres(nutri, faltando[0], faltando[-1])
+        cache.set_many(
+            {chaves[data]: [horario.time() for horario in calculados[data]] for data in faltando},
+            getattr(settings, 'DISPONIBILIDADE_CACHE_TIMEOUT', 10 * 60),
+        )
+        dias.update((data, calculados[data]) for data in faltando)
+
+    # O filtro de horários passados é feito na leitura: o cache guarda o dia inteiro
+    tz = timezone.get_default_timezone()
+    agora_local = timezone.localtime(agora or timezone.now(), tz).replace(tzinfo=None)
+    reservados = horarios_reservados([nutri.id], inicio, fim, exceto_cliente=cliente, agora=agora)
+    return {data: [horario for horario in dias[data] if horario > agora_local and (nutri.id, horario) not in reservados] for data in chaves}
+
+
+def serializar_horarios(horarios):
+    return [{'display': horario.strftime('%H:%M'), 'valor_iso': horario.isoformat()} for horario in horarios]
+
+
+def serializar_intervalo(dias):
+    # Formato compacto para o calendário: {'AAAA-MM-DD': ['HH:MM', ...]}
+    return {data.isoformat(): [horario.strftime('%H:%M') for horario in horarios] for data, horarios in dias.items()}
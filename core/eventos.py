@@ -0,0 +1,106 @@
+"""Pub/sub de eventos da agenda, para avisar as páginas abertas quando um horário é ocupado ou liberado.
+
+O backend é configurável (EVENTOS_BACKEND). Qualquer implementação precisa oferecer:
+  - publicar(canal, evento) -> seq: chamado de código síncrono, em qualquer thread;
+  - ultimo(canal) -> seq do evento mais recente do canal (0 se nenhum);
+  - async aguardar(canal, depois_de, timeout) -> (eventos ou None, ultimo): espera até
+    haver eventos com seq > depois_de ou o timeout; None indica que o histórico
+    não cobre mais depois_de e o cliente precisa recarregar o estado.
+
+BarramentoLocal guarda tudo na memória do processo: uma publicação alcança as
+requisições em espera no mesmo processo. Com vários workers, cada um tem o seu
+barramento; para distribuir entre processos, aponte EVENTOS_BACKEND para uma
+implementação com transporte compartilhado (Redis, LISTEN/NOTIFY do Postgres).
+"""
+import asyncio
+import threading
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+OCUPADO = 'ocupado'
+LIBERADO = 'liberado'
+
+
+class BarramentoLocal:
+    def __init__(self, tamanho_historico=None):
+        self.tamanho_historico = tamanho_historico or getattr(settings, 'EVENTOS_HISTORICO', 50)
+        self._trava = threading.Lock()
+        self._ultimo = {}
+        self._historico = {}
+        self._esperando = {}
+
+    def publicar(self, canal, evento):
+        with self._trava:
+            seq = self._ultimo[canal] = self._ultimo.get(canal, 0) + 1
+            self._historico.setdefault(canal, deque(maxlen=self.tamanho_historico)).append({**evento, 'seq': seq})
+            esperando = list(self._esperando.get(canal, ()))
+        # Cada requisição em espera pertence a um event loop; o aviso é agendado nele de forma thread-safe
+        for loop, sinal in esperando:
+            try:
+                loop.call_soon_threadsafe(sinal.set)
+            except RuntimeError:
+                pass  # loop já encerrado
+        return seq
+
+    def ultimo(self, canal):
+        with self._trava:
+            return self._ultimo.get(canal, 0)
+
+    def _depois_de(self, canal, seq):
+        ultimo = self._ultimo.get(canal, 0)
+        historico = self._historico.get(canal, ())
+        # seq maior que o último: o processo reiniciou; menor que o histórico: eventos descartados
+        if seq > ultimo or (historico and seq < historico[0]['seq'] - 1):
+            return None, ultimo
+        return [evento for evento in historico if evento['seq'] > seq], ultimo
+
+    async def aguardar(self, canal, depois_de, timeout):
+        espera = (asyncio.get_running_loop(), asyncio.Event())
+        with self._trava:
+            eventos, ultimo = self._depois_de(canal, depois_de)
+            if eventos is None or eventos:
+                return eventos, ultimo
+            self._esperando.setdefault(canal, set()).add(espera)
+        try:
+            await asyncio.wait_for(espera[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._trava:
+                self._esperando[canal].discard(espera)
+                if not self._esperando[canal]:
+                    del self._esperando[canal]
+        with self._trava:
+            return self._depois_de(canal, depois_de)
+
+
+_barramento = None
+_trava_barramento = threading.Lock()
+
+
+def barramento():
+    global _barramento
+    with _trava_barramento:
+        if _barramento is None:
+            _barramento = import_string(getattr(settings, 'EVENTOS_BACKEND', 'core.eventos.BarramentoLocal'))()
+        return _barramento
+
+
+def canal_agenda(nutricionista_id):
+    return f'agenda:{nutricionista_id}'
+
+
+def publicar_agenda(nutricionista_id, tipo, data_horario, duracao):
+    """Publica, após o commit, que o intervalo [data_horario, +duracao) do nutricionista foi ocupado ou liberado."""
+    inicio = timezone.localtime(data_horario, timezone.get_default_timezone())
+    evento = {
+        'tipo': tipo, 'data': inicio.date().isoformat(),
+        'inicio': inicio.strftime('%H:%M'), 'fim': (inicio + timedelta(minutes=duracao)).strftime('%H:%M'),
+    }
+    transaction.on_commit(lambda: barramento().publicar(canal_agenda(nutricionista_id), evento))
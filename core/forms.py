@@ -48,6 +48,14 @@ class NutricionistaProfileForm(forms.ModelForm):
             self.fields[f'{dia_key}_inicio'] = forms.TimeField( required=False, widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control form-control-sm', 'value': '08:00'}) )
             self.fields[f'{dia_key}_fim'] = forms.TimeField( required=False, widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control form-control-sm', 'value': '18:00'}) )
 
+    def clean(self):
+        cleaned_data = super().clean()
+        for dia_key, dia_label in self.dias_semana:
+            inicio = cleaned_data.get(f'{dia_key}_inicio'); fim = cleaned_data.get(f'{dia_key}_fim')
+            if cleaned_data.get(f'{dia_key}_ativo') and inicio and fim and fim <= inicio:
+                self.add_error(f'{dia_key}_fim', f"{dia_label}: o horário final deve ser depois do inicial.")
+        return cleaned_data
+
 class ClienteProfileForm(forms.ModelForm):
     
     OBJETIVO_CHOICES = [ ('', 'Selecione seu principal objetivo'), ('EMAGRECIMENTO', 'Emagrecimento'), ('GANHO_MASSA', 'Ganho de Massa Muscular'), ('REEDUCACAO_ALIMENTAR', 'Reeducação Alimentar'), ('NUTRICAO_ESPORTIVA', 'Nutrição Esportiva'), ('MELHORAR_SAUDE', 'Melhorar a Saúde/Disposição'), ('OUTRO', 'Outro'), ]
@@ -0,0 +1,253 @@
+"""Geração de rascunhos de plano alimentar a partir do perfil do cliente e do catálogo de alimentos.
+
+Metas do dia: gasto energético pela equação de Mifflin-St Jeor (o cadastro não
+tem sexo, então usa a média das constantes masculina e feminina) x fator de
+atividade, ajustado pelo objetivo; proteína em g/kg, lipídeos como fração da
+energia e o restante em carboidratos. As metas são divididas entre as refeições.
+
+Em cada refeição entram um alimento de cada papel (fonte de proteína, de
+carboidrato, de gordura e um vegetal/fruta), sorteados do catálogo de forma
+determinística por semente e cliente. As quantidades saem de um problema de mínimos quadrados com limites
+(0 a MAX_GRAMAS por alimento) sobre o erro relativo de energia e macros,
+resolvido por gradiente projetado acelerado (FISTA) para todas as refeições de
+todos os clientes do lote de uma só vez, em arrays NumPy. Os rascunhos ficam
+com `rascunho=True` e não aparecem para o cliente até o nutricionista publicá-los.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import OuterRef, Subquery
+
+from .dados_sinteticos import inserir_em_lote
+from .models import Alimento, Cliente, Consulta, ItemRefeicao, PlanoAlimentar, Refeicao
+
+
+FATOR_ATIVIDADE = 1.4
+AJUSTE_ENERGIA = {'EMAGRECIMENTO': 0.80, 'GANHO_MASSA': 1.10, 'NUTRICAO_ESPORTIVA': 1.10}
+PROTEINA_G_POR_KG = {'EMAGRECIMENTO': 1.6, 'GANHO_MASSA': 1.8, 'NUTRICAO_ESPORTIVA': 1.6}
+PROTEINA_G_POR_KG_PADRAO = 1.2
+FRACAO_LIPIDEOS = 0.28
+ENERGIA_MINIMA = 1200
+# (nome, fração das metas do dia); os nomes casam com os cartões do dashboard do cliente
+REFEICOES = (('Café da Manhã', 0.25), ('Almoço', 0.35), ('Lanche da Tarde', 0.10), ('Jantar', 0.30))
+PAPEIS = ('proteina', 'carboidrato', 'gordura', 'vegetal')
+# Colunas otimizadas: energia, proteína, carboidrato, lipídeos
+METAS = ('energia_kcal', 'proteina_g', 'carboidrato_g', 'lipideos_g')
+MAX_GRAMAS = 300.0
+ARREDONDAMENTO_GRAMAS = 5
+ITERACOES = 200
+
+
+def metas_diarias(peso, altura, idade, objetivos):
+    """Metas do dia [energia kcal, proteína g, carboidrato g, lipídeos g] para arrays de clientes.
+
+    `altura` em metros, como em Cliente; `objetivos` é um array de strings.
+    """
+    peso = np.asarray(peso, dtype=np.float64); altura = np.asarray(altura, dtype=np.float64)
+    idade = np.asarray(idade, dtype=np.float64); objetivos = np.asarray(objetivos, dtype=object)
+    basal = 10 * peso + 625 * altura - 5 * idade - 78  # 6,25 x altura em cm; (+5 - 161) / 2 = -78
+    ajuste = np.array([AJUSTE_ENERGIA.get(objetivo, 1.0) for objetivo in objetivos])
+    energia = np.maximum(basal * FATOR_ATIVIDADE * ajuste, ENERGIA_MINIMA)
+    proteina = peso * np.array([PROTEINA_G_POR_KG.get(objetivo, PROTEINA_G_POR_KG_PADRAO) for objetivo in objetivos])
+    proteina = np.minimum(proteina, energia * 0.35 / 4)
+    lipideos = energia * FRACAO_LIPIDEOS / 9
+    carboidrato = (energia - proteina * 4 - lipideos * 9) / 4
+    return np.stack([energia, proteina, carboidrato, lipideos], axis=1)
+
+
+def classificar_alimentos(nutrientes):
+    """Índices dos alimentos de cada papel, pela fração da energia que vem de cada macro.
+
+    `nutrientes` é a matriz (alimentos x METAS) por 100 g.
+    """
+    energia = nutrientes[:, 0]
+    kcal_macros = nutrientes[:, 1:] * np.array([4.0, 4.0, 9.0])
+    fracoes = kcal_macros / np.maximum(kcal_macros.sum(axis=1, keepdims=True), 1e-9)
+    calorico = energia >= 60
+    papeis = {
+        'proteina': np.flatnonzero(calorico & (fracoes[:, 0] >= 0.35)),
+        'carboidrato': np.flatnonzero(calorico & (fracoes[:, 1] >= 0.60)),
+        'gordura': np.flatnonzero(calorico & (fracoes[:, 2] >= 0.60)),
+        'vegetal': np.flatnonzero((energia > 0) & ~calorico),
+    }
+    todos = np.flatnonzero(energia > 0)
+    # Catálogo sem alimentos de um papel: o papel sorteia do catálogo inteiro
+    return {papel: indices if len(indices) else todos for papel, indices in papeis.items()}
+
+
+def resolver_quantidades(matrizes, metas, iteracoes=ITERACOES):
+    """Gramas (problemas x alimentos) que minimizam o erro relativo de cada meta, com 0 <= g <= MAX_GRAMAS.
+
+    `matrizes` (problemas x metas x alimentos) tem os nutrientes por grama; `metas`
+    (problemas x metas). Todos os problemas andam juntos em cada iteração.
+    """
+    # Erro relativo: cada linha dividida pela sua meta, o alvo passa a ser 1
+    normalizadas = matrizes / metas[:, :, np.newaxis]
+    # Passo 1/L com L = ||M||²_F, limite superior do maior autovalor de MᵀM
+    passo = 1.0 / np.maximum(np.einsum('bij,bij->b', normalizadas, normalizadas), 1e-12)[:, np.newaxis]
+    gramas = np.full((normalizadas.shape[0], normalizadas.shape[2]), 100.0)
+    anterior = gramas; momento = gramas; t = 1.0
+    for _ in range(iteracoes):
+        residuo = np.einsum('bij,bj->bi', normalizadas, momento) - 1.0
+        gradiente = np.einsum('bij,bi->bj', normalizadas, residuo)
+        gramas = np.clip(momento - passo * gradiente, 0.0, MAX_GRAMAS)
+        t_novo = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        momento = gramas + ((t - 1) / t_novo) * (gramas - anterior)
+        anterior = gramas; t = t_novo
+    return gramas
+
+
+def _misturar(valores, seed):
+    """Hash splitmix64 elemento a elemento (uint64): números pseudoaleatórios sem estado."""
+    with np.errstate(over='ignore'):
+        z = valores + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def otimizar_lote(clientes, catalogo, seed=42):
+    """Rascunhos de um lote de clientes (sem acesso ao banco: roda em qualquer processo).
+
+    `clientes`: dict de arrays 'id', 'peso', 'altura', 'idade', 'objetivos'.
+    `catalogo`: matriz (alimentos x METAS) por 100 g.
+    Devolve (metas do dia, índices dos alimentos e gramas por cliente x refeição x papel).
+    """
+    metas = metas_diarias(clientes['peso'], clientes['altura'], clientes['idade'], clientes['objetivos'])
+    papeis = classificar_alimentos(catalogo)
+    total = len(clientes['id']); formato = (total, len(REFEICOES), len(PAPEIS))
+    # Sorteio determinístico por (seed, cliente, refeição, papel): o mesmo cliente recebe os mesmos
+    # alimentos em qualquer lote ou processo
+    posicoes = np.arange(len(REFEICOES) * len(PAPEIS), dtype=np.uint64).reshape(1, len(REFEICOES), len(PAPEIS))
+    sorteios = _misturar(np.asarray(clientes['id'], dtype=np.uint64).reshape(-1, 1, 1) * np.uint64(1 << 8) + posicoes, seed)
+    escolhidos = np.empty(formato, dtype=np.int64)
+    for coluna, papel in enumerate(PAPEIS):
+        candidatos = papeis[papel]
+        escolhidos[:, :, coluna] = candidatos[(sorteios[:, :, coluna] % np.uint64(len(candidatos))).astype(np.int64)]
+
+    fracoes = np.array([fracao for _, fracao in REFEICOES])
+    metas_refeicoes = (metas[:, np.newaxis, :] * fracoes[np.newaxis, :, np.newaxis]).reshape(-1, len(METAS))
+    # (problemas x metas x alimentos): nutrientes por grama dos alimentos de cada refeição
+    matrizes = np.transpose(catalogo[escolhidos.reshape(-1, len(PAPEIS))] / 100.0, (0, 2, 1))
+    gramas = resolver_quantidades(matrizes, metas_refeicoes).reshape(formato)
+    gramas = np.round(gramas / ARREDONDAMENTO_GRAMAS) * ARREDONDAMENTO_GRAMAS
+    return metas, escolhidos, gramas
+
+
+_catalogo_do_processo = None
+
+
+def _iniciar_processo(catalogo):
+    global _catalogo_do_processo
+    _catalogo_do_processo = catalogo
+
+
+def _otimizar_no_processo(argumentos):
+    clientes, seed = argumentos
+    return otimizar_lote(clientes, _catalogo_do_processo, seed)
+
+
+class GeradorPlanos:
+    """Gera e grava rascunhos de plano para muitos clientes.
+
+    A otimização (NumPy puro) é dividida em lotes de `tamanho_lote` clientes e
+    distribuída num pool de `processos`; o processo principal grava cada lote
+    com bulk_create assim que ele fica pronto.
+    """
+
+    def __init__(self, processos=1, tamanho_lote=500, seed=42, nutricionista=None):
+        self.processos = processos
+        self.tamanho_lote = tamanho_lote
+        self.seed = seed
+        self.nutricionista = nutricionista
+
+    def carregar_catalogo(self):
+        linhas = list(Alimento.objects.order_by('id').values_list('id', 'nome', *METAS))
+        if not linhas:
+            raise ValueError('O catálogo de alimentos está vazio (rode importar_alimentos antes).')
+        self.alimentos_ids = np.array([linha[0] for linha in linhas], dtype=np.int64)
+        self.alimentos_nomes = [linha[1] for linha in linhas]
+        self.catalogo = np.array([linha[2:] for linha in linhas], dtype=np.float64)
+
+    def clientes_elegiveis(self, clientes):
+        """Clientes com peso, altura e idade, e o nutricionista de cada um (o fixo ou o da última consulta)."""
+        clientes = clientes.filter(peso__gt=0, altura__gt=0, idade__gt=0)
+        campos = ['id', 'peso', 'altura', 'idade', 'objetivos']
+        if self.nutricionista is None:
+            ultima = Consulta.objects.filter(cliente=OuterRef('pk')).order_by('-data_horario').values('nutricionista_id')[:1]
+            clientes = clientes.annotate(nutricionista_id=Subquery(ultima)).filter(nutricionista_id__isnull=False)
+            campos.append('nutricionista_id')
+        return list(clientes.order_by('id').values_list(*campos))
+
+    def lotes(self, linhas):
+        for inicio in range(0, len(linhas), self.tamanho_lote):
+            fatia = linhas[inicio:inicio + self.tamanho_lote]
+            yield fatia, {
+                'id': np.array([linha[0] for linha in fatia], dtype=np.int64),
+                'peso': np.array([linha[1] for linha in fatia]), 'altura': np.array([linha[2] for linha in fatia]),
+                'idade': np.array([linha[3] for linha in fatia]), 'objetivos': np.array([linha[4] or '' for linha in fatia], dtype=object),
+            }
+
+    def gravar(self, fatia, metas, escolhidos, gramas):
+        planos = []
+        for linha, meta in zip(fatia, metas):
+            nutricionista_id = self.nutricionista.id if self.nutricionista is not None else linha[5]
+            planos.append(PlanoAlimentar(
+                cliente_id=linha[0], nutricionista_id=nutricionista_id, rascunho=True,
+                observacoes=f'Rascunho gerado automaticamente. Metas do dia: {meta[0]:.0f} kcal, proteína {meta[1]:.0f} g, carboidrato {meta[2]:.0f} g, lipídeos {meta[3]:.0f} g.',
+            ))
+        with transaction.atomic():
+            inserir_em_lote(PlanoAlimentar, planos, self.tamanho_lote * 2)
+            refeicoes = []; itens_por_refeicao = []
+            for plano, alimentos_cliente, gramas_cliente in zip(planos, escolhidos, gramas):
+                for (nome, _), alimentos, quantidades in zip(REFEICOES, alimentos_cliente, gramas_cliente):
+                    itens = [(indice, quantidade) for indice, quantidade in zip(alimentos.tolist(), quantidades.tolist()) if quantidade > 0]
+                    if not itens:
+                        continue
+                    energia = sum(self.catalogo[indice, 0] * quantidade / 100 for indice, quantidade in itens)
+                    refeicoes.append(Refeicao(
+                        plano_alimentar_id=plano.id, nome=nome, calorias=round(energia),
+                        alimentos='\n'.join(self.alimentos_nomes[indice] for indice, _ in itens),
+                        quantidades=', '.join(f'{quantidade:g} g' for _, quantidade in itens)[:255],
+                    ))
+                    itens_por_refeicao.append(itens)
+            inserir_em_lote(Refeicao, refeicoes, self.tamanho_lote * 4)
+            ItemRefeicao.objects.bulk_create((
+                ItemRefeicao(refeicao_id=refeicao.id, alimento_id=int(self.alimentos_ids[indice]), quantidade_g=quantidade)
+                for refeicao, itens in zip(refeicoes, itens_por_refeicao) for indice, quantidade in itens
+            ), batch_size=self.tamanho_lote * 16)
+        return planos
+
+    def gerar(self, clientes=None):
+        """Gera os rascunhos; devolve estatísticas (planos, segundos, planos por segundo, ignorados)."""
+        inicio = time.perf_counter()
+        self.carregar_catalogo()
+        consulta = Cliente.objects.all() if clientes is None else clientes
+        linhas = self.clientes_elegiveis(consulta)
+        ignorados = consulta.count() - len(linhas)
+        gerados = 0
+        if self.processos > 1:
+            # Os processos só fazem contas; a conexão do pai não deve ser herdada aberta
+            connections.close_all()
+            with ProcessPoolExecutor(self.processos, initializer=_iniciar_processo, initargs=(self.catalogo,)) as pool:
+                fatias = list(self.lotes(linhas))
+                resultados = pool.map(_otimizar_no_processo, ((dados, self.seed) for _, dados in fatias))
+                for (fatia, _), resultado in zip(fatias, resultados):
+                    gerados += len(self.gravar(fatia, *resultado))
+        else:
+            for fatia, dados in self.lotes(linhas):
+                gerados += len(self.gravar(fatia, *otimizar_lote(dados, self.catalogo, self.seed)))
+        segundos = time.perf_counter() - inicio
+        return {'planos': gerados, 'ignorados': ignorados, 'segundos': round(segundos, 3), 'planos_por_segundo': round(gerados / segundos, 1) if segundos else None}
+
+
+def gerar_rascunho(cliente, nutricionista, seed=42):
+    """Gera e grava o rascunho de um único cliente; None se faltar peso, altura ou idade."""
+    planos = []
+    gerador = GeradorPlanos(nutricionista=nutricionista, seed=seed)
+    gerador.carregar_catalogo()
+    for fatia, dados in gerador.lotes(gerador.clientes_elegiveis(Cliente.objects.filter(pk=cliente.pk))):
+        planos = gerador.gravar(fatia, *otimizar_lote(dados, gerador.catalogo, seed))
+    return planos[0] if planos else None
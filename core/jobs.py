@@ -0,0 +1,197 @@
+"""Jobs periódicos, rodados pelo comando executar_jobs (uma vez ou em laço).
+
+- encerrar_consultas: marca como CONCLUIDO as consultas confirmadas que já
+  terminaram, em lotes percorridos pelo índice parcial das confirmadas por
+  horário (que encolhe à medida que elas são concluídas).
+- lembretes: enfileira na caixa de saída (Notificacao) um lembrete para cada
+  consulta confirmada das próximas LEMBRETE_ANTECEDENCIA_HORAS horas.
+- enviar_notificacoes: drena a caixa de saída em lotes travados com SKIP LOCKED
+  (vários processos podem rodar ao mesmo tempo), enviando cada lote por um pool
+  de NOTIFICACOES_WORKERS threads; falhas voltam para a fila com espera crescente.
+- limpar_reservas: apaga as reservas temporárias de horário vencidas.
+
+Cada job devolve {'linhas', 'segundos', 'linhas_por_segundo'}. As alterações em
+lote não disparam os sinais de Consulta: o rollup de métricas, os dashboards e
+o cache de disponibilidade são atualizados aqui.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import dashboard, disponibilidade, metricas
+from .agendamento import limpar_reservas_expiradas
+from .models import Consulta, Notificacao
+from .paginacao import filtro_apos_cursor
+
+
+TAMANHO_LOTE = 500
+ORDEM = ('data_horario', 'id')
+ESPERA_RETENTATIVA = timedelta(minutes=5)
+
+CONFIRMADO = Consulta.StatusChoices.CONFIRMADO
+CONCLUIDO = Consulta.StatusChoices.CONCLUIDO
+
+
+def _resultado(linhas, inicio):
+    segundos = time.perf_counter() - inicio
+    return {'linhas': linhas, 'segundos': round(segundos, 3), 'linhas_por_segundo': round(linhas / segundos, 1) if segundos else None}
+
+
+# --- Consultas passadas ---
+
+def encerrar_consultas_passadas(agora=None, tamanho_lote=TAMANHO_LOTE):
+    """Conclui as consultas confirmadas cujo horário (mais a duração) já passou."""
+    inicio = time.perf_counter(); agora = agora or timezone.now()
+    hoje = timezone.localdate(agora, timezone.get_default_timezone())
+    confirmadas = Consulta.objects.filter(status=CONFIRMADO, data_horario__lt=agora)
+    cursor = None; encerradas = 0
+    while True:
+        pagina = confirmadas if cursor is None else confirmadas.filter(filtro_apos_cursor(ORDEM, cursor))
+        with transaction.atomic():
+            # SKIP LOCKED: uma consulta sendo alterada agora (ex.: cancelamento) fica para a próxima rodada
+            linhas = list(
+                pagina.order_by(*ORDEM).select_for_update(skip_locked=True)
+                .values_list('id', *metricas.CAMPOS_CONSULTA)[:tamanho_lote]
+            )
+            if not linhas:
+                break
+            terminadas = [linha for linha in linhas if linha[3] + timedelta(minutes=linha[5]) <= agora]
+            if terminadas:
+                Consulta.objects.filter(id__in=[linha[0] for linha in terminadas]).update(status=CONCLUIDO, atualizado_em=timezone.now())
+                metricas.registrar_mudancas((linha[1:], linha[1:4] + (CONCLUIDO,) + linha[5:]) for linha in terminadas)
+                for cliente_id in {linha[2] for linha in terminadas}:
+                    dashboard.invalidar_dashboard_cliente(cliente_id)
+                # Só o dia de hoje ainda aparece na agenda; dias passados não são oferecidos
+                for nutricionista_id in {linha[1] for linha in terminadas if metricas.dia_local(linha[3]) == hoje}:
+                    disponibilidade.invalidar_dia(nutricionista_id, hoje)
+            encerradas += len(terminadas)
+        cursor = (linhas[-1][3], linhas[-1][0])
+        if len(linhas) < tamanho_lote:
+            break
+    return _resultado(encerradas, inicio)
+
+
+# --- Lembretes ---
+
+def _lembrete(consulta, agora):
+    horario = timezone.localtime(consulta.data_horario, timezone.get_default_timezone())
+    nutricionista = consulta.nutricionista.usuario.get_full_name() or consulta.nutricionista.usuario.username
+    return Notificacao(
+        consulta=consulta, tipo=Notificacao.TipoChoices.LEMBRETE, destinatario=consulta.cliente.usuario.email,
+        assunto=f'Lembrete: consulta em {horario:%d/%m/%Y às %H:%M}',
+        corpo=(
+            f'Olá, {consulta.cliente.usuario.first_name or consulta.cliente.usuario.username}!\n\n'
+            f'Sua consulta {consulta.get_modalidade_display().lower()} com {nutricionista} é em {horario:%d/%m/%Y às %H:%M} '
+            f'({consulta.duracao} minutos).\n\nSe não puder comparecer, cancele pelo NutriOne para liberar o horário.'
+        ),
+        proxima_tentativa=agora,
+    )
+
+
+def enfileirar_lembretes(agora=None, tamanho_lote=TAMANHO_LOTE, antecedencia=None):
+    """Cria um lembrete pendente para cada consulta confirmada da janela de antecedência que ainda não tem um."""
+    inicio = time.perf_counter(); agora = agora or timezone.now()
+    antecedencia = antecedencia or timedelta(hours=getattr(settings, 'LEMBRETE_ANTECEDENCIA_HORAS', 24))
+    ja_avisadas = Notificacao.objects.filter(consulta=OuterRef('pk'), tipo=Notificacao.TipoChoices.LEMBRETE)
+    proximas = Consulta.objects.filter(status=CONFIRMADO, data_horario__gt=agora, data_horario__lte=agora + antecedencia).filter(~Exists(ja_avisadas))
+    cursor = None; enfileiradas = 0
+    while True:
+        pagina = proximas if cursor is None else proximas.filter(filtro_apos_cursor(ORDEM, cursor))
+        lote = list(pagina.select_related('cliente__usuario', 'nutricionista__usuario').order_by(*ORDEM)[:tamanho_lote])
+        if not lote:
+            break
+        # ignore_conflicts: outro processo pode ter enfileirado a mesma consulta (restrição única consulta + tipo)
+        Notificacao.objects.bulk_create((_lembrete(consulta, agora) for consulta in lote), ignore_conflicts=True)
+        enfileiradas += len(lote)
+        cursor = (lote[-1].data_horario, lote[-1].id)
+        if len(lote) < tamanho_lote:
+            break
+    return _resultado(enfileiradas, inicio)
+
+
+# --- Envio da caixa de saída ---
+
+def _enviar(mensagens):
+    """Roda numa thread do pool: uma conexão do backend de e-mail para a fatia toda; devolve o erro de cada mensagem (ou None)."""
+    erros = []
+    try:
+        with get_connection() as conexao:
+            for mensagem in mensagens:
+                mensagem.connection = conexao
+                try:
+                    mensagem.send()
+                    erros.append(None)
+                except Exception as erro:
+                    erros.append(f'{erro.__class__.__name__}: {erro}')
+    except Exception as erro:
+        # A conexão não abriu (ou caiu ao fechar): as mensagens sem resultado contam como falha
+        erros += [f'{erro.__class__.__name__}: {erro}'] * (len(mensagens) - len(erros))
+    return erros
+
+
+def enviar_notificacoes(agora=None, tamanho_lote=100, workers=None, max_tentativas=None):
+    """Envia as notificações pendentes vencidas; cada lote fica travado (SKIP LOCKED) até gravar o resultado."""
+    inicio = time.perf_counter(); agora = agora or timezone.now()
+    workers = workers or getattr(settings, 'NOTIFICACOES_WORKERS', 4)
+    max_tentativas = max_tentativas or getattr(settings, 'NOTIFICACOES_MAX_TENTATIVAS', 5)
+    processadas = 0
+    pendentes = Notificacao.objects.filter(status=Notificacao.StatusChoices.PENDENTE, proxima_tentativa__lte=agora)
+    with ThreadPoolExecutor(workers) as pool:
+        while True:
+            with transaction.atomic():
+                lote = list(
+                    pendentes.select_related('consulta').select_for_update(skip_locked=True, of=('self',))
+                    .order_by('proxima_tentativa', 'id')[:tamanho_lote]
+                )
+                if not lote:
+                    break
+                enviaveis = []
+                for notificacao in lote:
+                    # Consulta cancelada, concluída ou já começada: o lembrete perdeu o sentido
+                    if notificacao.consulta.status != CONFIRMADO or notificacao.consulta.data_horario <= agora:
+                        notificacao.status = Notificacao.StatusChoices.DESCARTADA
+                    else:
+                        enviaveis.append(notificacao)
+                mensagens = [EmailMessage(n.assunto, n.corpo, to=[n.destinatario]) for n in enviaveis]
+                fatias = [mensagens[indice::workers] for indice in range(workers)]
+                erros_por_fatia = list(pool.map(_enviar, fatias))
+                erros = [None] * len(mensagens)
+                for indice, erros_fatia in enumerate(erros_por_fatia):
+                    erros[indice::workers] = erros_fatia
+                for notificacao, erro in zip(enviaveis, erros):
+                    notificacao.tentativas += 1
+                    if erro is None:
+                        notificacao.status = Notificacao.StatusChoices.ENVIADA; notificacao.enviada_em = timezone.now(); notificacao.erro = ''
+                    else:
+                        notificacao.erro = erro
+                        if notificacao.tentativas >= max_tentativas:
+                            notificacao.status = Notificacao.StatusChoices.FALHOU
+                        else:
+                            notificacao.proxima_tentativa = agora + ESPERA_RETENTATIVA * 2 ** (notificacao.tentativas - 1)
+                Notificacao.objects.bulk_update(lote, ['status', 'tentativas', 'proxima_tentativa', 'enviada_em', 'erro'])
+            processadas += len(lote)
+            if len(lote) < tamanho_lote:
+                break
+    return _resultado(processadas, inicio)
+
+
+# --- Reservas vencidas ---
+
+def limpar_reservas(agora=None, tamanho_lote=None):
+    inicio = time.perf_counter()
+    return _resultado(limpar_reservas_expiradas(agora), inicio)
+
+
+# Ordem de execução de uma rodada: concluir antes de lembrar, enfileirar antes de enviar
+JOBS = {
+    'encerrar_consultas': encerrar_consultas_passadas,
+    'lembretes': enfileirar_lembretes,
+    'enviar_notificacoes': enviar_notificacoes,
+    'limpar_reservas': limpar_reservas,
+}
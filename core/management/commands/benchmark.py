@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import CENARIOS, Benchmark, banco_de_benchmark, comparar_com_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latência (p50/p95/p99), queries por requisição e throughput das views principais '
+        'num banco de teste populado com dados sintéticos, e compara com um baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteracoes', type=int, default=100, help='Requisições medidas por cenário.')
+        parser.add_argument('--aquecimento', type=int, default=10, help='Requisições descartadas antes da medição.')
+        parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=list(CENARIOS))
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clientes', type=int, default=2000)
+        parser.add_argument('--nutricionistas', type=int, default=100)
+        parser.add_argument('--consultas', type=int, default=20000)
+        parser.add_argument('--saida', help='Arquivo JSON para gravar o resultado (padrão: só imprime).')
+        parser.add_argument('--baseline', help='Baseline JSON: o comando falha se alguma view piorar em relação a ele.')
+        parser.add_argument('--atualizar-baseline', action='store_true', help='Grava o resultado no arquivo de --baseline em vez de comparar.')
+        parser.add_argument('--tolerancia', type=float, default=0.25, help='Piora de p95 aceita, em fração do baseline.')
+        parser.add_argument('--folga-ms', type=float, default=2.0, help='Folga absoluta de p95, em ms.')
+
+    def handle(self, *args, **options):
+        if options['atualizar_baseline'] and not options['baseline']:
+            raise CommandError('--atualizar-baseline exige --baseline.')
+        try:
+            with banco_de_benchmark(
+                seed=options['seed'], clientes=options['clientes'], nutricionistas=options['nutricionistas'],
+                consultas=options['consultas'], saida=self.stderr.write if options['verbosity'] > 1 else None,
+            ):
+                resultado = Benchmark(iteracoes=options['iteracoes'], aquecimento=options['aquecimento'], cenarios=options['cenarios']).executar()
+        except ValueError as erro:
+            raise CommandError(erro)
+        resultado['escala'] = {chave: options[chave] for chave in ('seed', 'clientes', 'nutricionistas', 'consultas')}
+
+        self.stdout.write(f"{'cenário':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'req/s':>9}")
+        for nome, metricas in resultado['cenarios'].items():
+            self.stdout.write(
+                f"{nome:<26}{metricas['p50_ms']:>9.1f}{metricas['p95_ms']:>9.1f}{metricas['p99_ms']:>9.1f}"
+                f"{metricas['queries_max']:>9}{metricas['throughput_rps']:>9.1f}"
+            )
+        conteudo = json.dumps(resultado, indent=2, ensure_ascii=False) + '\n'
+        if options['saida']:
+            Path(options['saida']).write_text(conteudo, encoding='utf-8')
+
+        if not options['baseline']:
+            return
+        caminho = Path(options['baseline'])
+        if options['atualizar_baseline']:
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            caminho.write_text(conteudo, encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f'Baseline gravado em {caminho}.'))
+            return
+        baseline = json.loads(caminho.read_text(encoding='utf-8'))
+        regressoes = comparar_com_baseline(resultado, baseline, options['tolerancia'], options['folga_ms'])
+        if regressoes:
+            raise CommandError('Regressões em relação ao baseline:\n' + '\n'.join(regressoes))
+        self.stdout.write(self.style.SUCCESS('Nenhuma regressão em relação ao baseline.'))
@@ -0,0 +1,43 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import BenchmarkConcorrencia, banco_de_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a vazão de requisições simultâneas aos endpoints JSON entre WSGI e ASGI '
+        '(views síncronas e core.views_async) num banco de teste com dados sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=400, help='Requisições por endpoint e modo.')
+        parser.add_argument('--concorrencia', type=int, default=32, help='Requisições simultâneas (threads no WSGI, tarefas no ASGI).')
+        parser.add_argument('--latencia-db-ms', type=float, default=1.0, help='Atraso somado a cada query, simulando um banco remoto (0 desliga).')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clientes', type=int, default=2000)
+        parser.add_argument('--nutricionistas', type=int, default=100)
+        parser.add_argument('--consultas', type=int, default=20000)
+        parser.add_argument('--saida', help='Arquivo JSON para gravar o resultado.')
+
+    def handle(self, *args, **options):
+        try:
+            with banco_de_benchmark(seed=options['seed'], clientes=options['clientes'], nutricionistas=options['nutricionistas'], consultas=options['consultas']):
+                resultado = BenchmarkConcorrencia(
+                    requisicoes=options['requisicoes'], concorrencia=options['concorrencia'], latencia_db_ms=options['latencia_db_ms'],
+                ).executar()
+        except ValueError as erro:
+            raise CommandError(erro)
+        resultado['escala'] = {chave: options[chave] for chave in ('seed', 'clientes', 'nutricionistas', 'consultas')}
+
+        self.stdout.write(f"{'endpoint':<26}{'modo':<12}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'erros':>7}")
+        for endpoint, modos in resultado['endpoints'].items():
+            for modo, metricas in modos.items():
+                self.stdout.write(
+                    f"{endpoint:<26}{modo:<12}{metricas['throughput_rps']:>9.1f}{metricas['p50_ms']:>9.1f}"
+                    f"{metricas['p95_ms']:>9.1f}{metricas['p99_ms']:>9.1f}{metricas['erros']:>7}"
+                )
+        if options['saida']:
+            Path(options['saida']).write_text(json.dumps(resultado, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
@@ -0,0 +1,43 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import BenchmarkConexoes, banco_de_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o custo por requisição de abrir conexões com o banco, com e sem reuso (CONN_MAX_AGE) '
+        'e com a verificação de saúde, num banco de teste com dados sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=300, help='Requisições por endpoint e modo.')
+        parser.add_argument('--max-age', type=int, default=60, help='CONN_MAX_AGE dos modos persistentes.')
+        parser.add_argument('--latencia-conexao-ms', type=float, default=0.0, help='Atraso somado a cada conexão aberta, simulando o handshake com um banco remoto.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clientes', type=int, default=2000)
+        parser.add_argument('--nutricionistas', type=int, default=100)
+        parser.add_argument('--consultas', type=int, default=20000)
+        parser.add_argument('--saida', help='Arquivo JSON para gravar o resultado.')
+
+    def handle(self, *args, **options):
+        try:
+            with banco_de_benchmark(seed=options['seed'], clientes=options['clientes'], nutricionistas=options['nutricionistas'], consultas=options['consultas']):
+                resultado = BenchmarkConexoes(
+                    requisicoes=options['requisicoes'], max_age=options['max_age'], latencia_conexao_ms=options['latencia_conexao_ms'],
+                ).executar()
+        except ValueError as erro:
+            raise CommandError(erro)
+        resultado['escala'] = {chave: options[chave] for chave in ('seed', 'clientes', 'nutricionistas', 'consultas')}
+
+        self.stdout.write(f"{'endpoint':<26}{'modo':<24}{'conexões/req':>13}{'p50 ms':>9}{'p95 ms':>9}{'média ms':>10}{'erros':>7}")
+        for endpoint, modos in resultado['endpoints'].items():
+            for modo, metricas in modos.items():
+                self.stdout.write(
+                    f"{endpoint:<26}{modo:<24}{metricas['conexoes_por_requisicao']:>13.2f}{metricas['p50_ms']:>9.1f}"
+                    f"{metricas['p95_ms']:>9.1f}{metricas['media_ms']:>10.1f}{metricas['erros']:>7}"
+                )
+        if options['saida']:
+            Path(options['saida']).write_text(json.dumps(resultado, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.disponibilidade import estatisticas_cache, zerar_estatisticas_cache
+
+
+class Command(BaseCommand):
+    help = 'Mostra os contadores de acerto/falha do cache de disponibilidade.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zerar', action='store_true', help='Zera os contadores após exibi-los.')
+
+    def handle(self, *args, **options):
+        estatisticas = estatisticas_cache()
+        taxa = estatisticas['taxa_acerto']
+        self.stdout.write(
+            f"Acertos: {estatisticas['acertos']}  Falhas: {estatisticas['falhas']}  "
+            f"Taxa de acerto: {'-' if taxa is None else f'{taxa:.1%}'}"
+        )
+        if options['zerar']:
+            zerar_estatisticas_cache()
+            self.stdout.write(self.style.SUCCESS('Contadores zerados.'))
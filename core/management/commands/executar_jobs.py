@@ -0,0 +1,53 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.jobs import JOBS
+
+
+class Command(BaseCommand):
+    help = (
+        'Roda os jobs periódicos (consultas passadas, lembretes, envio da caixa de saída, reservas vencidas) '
+        'uma vez ou, com --loop, a cada --intervalo segundos, informando as linhas processadas por segundo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', action='append', choices=list(JOBS), help='Só este job; pode repetir. Padrão: todos.')
+        parser.add_argument('--loop', action='store_true', help='Repete até receber SIGTERM/Ctrl+C.')
+        parser.add_argument('--intervalo', type=float, default=60, help='Segundos entre as rodadas com --loop.')
+        parser.add_argument('--lote', type=int, help='Linhas por lote (cada lote é uma transação).')
+
+    def handle(self, *args, **options):
+        if options['intervalo'] <= 0:
+            raise CommandError('--intervalo deve ser positivo.')
+        nomes = [nome for nome in JOBS if nome in (options['job'] or JOBS)]
+        extras = {'tamanho_lote': options['lote']} if options['lote'] else {}
+
+        parar = threading.Event()
+        if options['loop']:
+            signal.signal(signal.SIGTERM, lambda *_: parar.set())
+        try:
+            while True:
+                self.rodada(nomes, extras, continuar_apos_erro=options['loop'])
+                if not options['loop'] or parar.wait(options['intervalo']):
+                    break
+                # Processo longo: descarta conexões velhas ou quebradas antes da próxima rodada
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
+
+    def rodada(self, nomes, extras, continuar_apos_erro):
+        for nome in nomes:
+            try:
+                resultado = JOBS[nome](**extras)
+            except Exception as erro:
+                if not continuar_apos_erro:
+                    raise
+                self.stderr.write(f'{nome}: falhou ({erro.__class__.__name__}: {erro})')
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"{nome}: {resultado['linhas']} linhas em {resultado['segundos']:.2f}s "
+                f"({resultado['linhas_por_segundo'] or 0:.1f}/s)"
+            ))
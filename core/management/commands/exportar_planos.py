@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import PlanoAlimentar
+from core.transferencia_planos import ArquivoInvalido, exportar, formato_do_arquivo
+
+
+class Command(BaseCommand):
+    help = 'Exporta planos alimentares e refeições em CSV ou JSONL (o formato aceito por importar_planos), em fluxo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--saida', help='Arquivo de saída; sem ele, escreve na saída padrão.')
+        parser.add_argument('--formato', choices=('csv', 'jsonl'), help='Formato; pela extensão da saída quando omitido (padrão: jsonl).')
+        parser.add_argument('--nutricionista', type=int, help='Só os planos deste nutricionista (id).')
+        parser.add_argument('--sem-rascunhos', action='store_true', help='Deixa de fora os rascunhos.')
+        parser.add_argument('--lote', type=int, default=1000, help='Planos lidos por query.')
+
+    def handle(self, *args, **options):
+        try:
+            formato = formato_do_arquivo(options['saida'] or '', options['formato'] or (None if options['saida'] else 'jsonl'))
+            saida = open(options['saida'], 'w', newline='', encoding='utf-8') if options['saida'] else None
+        except (ArquivoInvalido, OSError) as erro:
+            raise CommandError(erro)
+        planos = PlanoAlimentar.objects.all()
+        if options['nutricionista'] is not None:
+            planos = planos.filter(nutricionista_id=options['nutricionista'])
+        if options['sem_rascunhos']:
+            planos = planos.filter(rascunho=False)
+        pedacos = exportar(planos, formato, options['lote'])
+        if saida is None:
+            for pedaco in pedacos:
+                self.stdout.write(pedaco, ending='')
+            return
+        with saida:
+            saida.writelines(pedacos)
@@ -0,0 +1,39 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.dados_sinteticos import GeradorDadosSinteticos
+
+
+class Command(BaseCommand):
+    help = (
+        'Popula o banco com dados sintéticos determinísticos (usuários, nutricionistas, agendas, '
+        'consultas e planos alimentares) para testes de carga. Ex.: '
+        'gerar_dados --clientes 1000000 --nutricionistas 5000 --consultas 20000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42, help='Semente do gerador aleatório.')
+        parser.add_argument('--clientes', type=int, default=1000)
+        parser.add_argument('--nutricionistas', type=int, default=50)
+        parser.add_argument('--consultas', type=int, default=10000)
+        parser.add_argument('--planos', type=int, default=None, help='Quantidade de planos alimentares (padrão: metade dos clientes).')
+        parser.add_argument('--dias-passado', type=int, default=365, help='Histórico de consultas, em dias antes da data base.')
+        parser.add_argument('--dias-futuro', type=int, default=60, help='Horizonte de consultas futuras, em dias.')
+        parser.add_argument('--lote', type=int, default=5000, help='Tamanho de cada bulk_create.')
+        parser.add_argument('--data-base', type=date.fromisoformat, default=None, help='Data de referência (AAAA-MM-DD); padrão: hoje.')
+        parser.add_argument('--dominio', default='sintetico.nutrione', help='Domínio dos e-mails gerados.')
+        parser.add_argument('--senha', default='nutrione123', help='Senha de todos os usuários gerados.')
+
+    def handle(self, *args, **options):
+        gerador = GeradorDadosSinteticos(
+            seed=options['seed'], clientes=options['clientes'], nutricionistas=options['nutricionistas'],
+            consultas=options['consultas'], planos=options['planos'], dias_passado=options['dias_passado'],
+            dias_futuro=options['dias_futuro'], tamanho_lote=options['lote'], senha=options['senha'],
+            dominio=options['dominio'], data_base=options['data_base'], saida=self.stdout.write,
+        )
+        try:
+            gerador.gerar()
+        except ValueError as erro:
+            raise CommandError(erro)
+        self.stdout.write(self.style.SUCCESS('Dados sintéticos gerados.'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.gerador_planos import GeradorPlanos
+from core.models import Cliente, Nutricionista
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera rascunhos de plano alimentar (metas de energia e macros a partir de peso, altura, idade e objetivo) '
+        'para muitos clientes, com a otimização distribuída num pool de processos e gravação em lote.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=1, help='Processos do pool de otimização (1 roda no próprio processo).')
+        parser.add_argument('--lote', type=int, default=500, help='Clientes por lote de otimização e gravação.')
+        parser.add_argument('--seed', type=int, default=42, help='Semente do sorteio dos alimentos (combinada com o id do cliente).')
+        parser.add_argument('--nutricionista', type=int, help='Id do nutricionista dos rascunhos; sem ele, usa o da última consulta de cada cliente.')
+        parser.add_argument('--sem-plano', action='store_true', help='Só clientes que ainda não têm nenhum plano.')
+        parser.add_argument('--limite', type=int, help='Número máximo de clientes.')
+
+    def handle(self, *args, **options):
+        nutricionista = None
+        if options['nutricionista'] is not None:
+            try:
+                nutricionista = Nutricionista.objects.get(pk=options['nutricionista'])
+            except Nutricionista.DoesNotExist:
+                raise CommandError(f"Nutricionista {options['nutricionista']} não existe.")
+        clientes = Cliente.objects.all()
+        if options['sem_plano']:
+            clientes = clientes.filter(planoalimentar__isnull=True)
+        if options['limite']:
+            clientes = clientes.filter(pk__in=list(clientes.order_by('id').values_list('id', flat=True)[:options['limite']]))
+        gerador = GeradorPlanos(processos=options['processos'], tamanho_lote=options['lote'], seed=options['seed'], nutricionista=nutricionista)
+        try:
+            resultado = gerador.gerar(clientes)
+        except ValueError as erro:
+            raise CommandError(erro)
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['planos']} rascunhos gerados em {resultado['segundos']:.2f}s ({resultado['planos_por_segundo']} planos/s); "
+            f"{resultado['ignorados']} clientes ignorados (sem peso, altura ou idade, ou sem nutricionista)."
+        ))
@@ -0,0 +1,116 @@
+import csv
+import unicodedata
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Alimento
+from core.nutrientes import CAMPOS_NUTRIENTES, invalidar_catalogo
+
+
+# Cabeçalhos aceitos (sem acento, minúsculos, só o começo do nome) -> campo de Alimento
+COLUNAS = {
+    'codigo': ('numero do alimento', 'numero', 'codigo', 'id'),
+    'nome': ('descricao dos alimentos', 'descricao', 'alimento', 'nome'),
+    'grupo': ('categoria', 'grupo'),
+    'energia_kcal': ('energia (kcal)', 'energia kcal', 'kcal', 'energia'),
+    'proteina_g': ('proteina',),
+    'carboidrato_g': ('carboidrato',),
+    'lipideos_g': ('lipideos', 'lipidios', 'gordura'),
+    'fibra_g': ('fibra',),
+    'calcio_mg': ('calcio',),
+    'ferro_mg': ('ferro',),
+    'sodio_mg': ('sodio',),
+    'vitamina_c_mg': ('vitamina c',),
+}
+# Na TACO: NA = não analisado, Tr = traço, * = não aplicável
+SEM_VALOR = {'', 'na', 'tr', '*', '-'}
+
+
+def _normalizar(texto):
+    sem_acento = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+    return ' '.join(sem_acento.lower().split())
+
+
+def mapear_colunas(cabecalho):
+    """{campo: índice da coluna}. O primeiro cabeçalho que casar com um prefixo do campo vence."""
+    normalizados = [_normalizar(coluna) for coluna in cabecalho]
+    mapa = {}
+    for campo, prefixos in COLUNAS.items():
+        for prefixo in prefixos:
+            indice = next((i for i, coluna in enumerate(normalizados) if coluna.startswith(prefixo) and i not in mapa.values()), None)
+            if indice is not None:
+                mapa[campo] = indice
+                break
+    faltando = {'codigo', 'nome', 'energia_kcal'} - set(mapa)
+    if faltando:
+        raise CommandError(f"Colunas obrigatórias não encontradas: {', '.join(sorted(faltando))}")
+    return mapa
+
+
+def numero(texto):
+    texto = texto.strip()
+    if texto.lower() in SEM_VALOR:
+        return 0.0
+    return float(texto.replace('.', '').replace(',', '.') if ',' in texto else texto)
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa (ou atualiza pelo código) o catálogo de alimentos a partir de um CSV no formato da TACO: '
+        'código, descrição, grupo e nutrientes por 100 g. Lê em lotes, sem carregar o arquivo inteiro.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV.')
+        parser.add_argument('--fonte', default='TACO', help='Tabela de origem gravada em Alimento.fonte.')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Codificação do arquivo (a TACO costuma vir em latin-1).')
+        parser.add_argument('--delimitador', help='Separador de colunas; detectado pelo cabeçalho quando omitido.')
+        parser.add_argument('--lote', type=int, default=1000, help='Linhas gravadas por transação.')
+
+    def handle(self, *args, **options):
+        try:
+            arquivo = open(options['arquivo'], newline='', encoding=options['encoding'])
+        except OSError as erro:
+            raise CommandError(erro)
+        with arquivo:
+            primeira = arquivo.readline(); arquivo.seek(0)
+            delimitador = options['delimitador'] or (';' if primeira.count(';') > primeira.count(',') else ',')
+            leitor = csv.reader(arquivo, delimiter=delimitador)
+            mapa = mapear_colunas(next(leitor, []))
+            criados = atualizados = 0; lote = []
+            for numero_linha, linha in enumerate(leitor, start=2):
+                if not any(celula.strip() for celula in linha):
+                    continue
+                try:
+                    lote.append(self.alimento(linha, mapa, options['fonte']))
+                except (ValueError, IndexError) as erro:
+                    raise CommandError(f'Linha {numero_linha}: {erro}')
+                if len(lote) >= options['lote']:
+                    novos, existentes = self.gravar(lote); criados += novos; atualizados += existentes; lote = []
+            if lote:
+                novos, existentes = self.gravar(lote); criados += novos; atualizados += existentes
+        # bulk_create/bulk_update não disparam sinais: os totais em cache dos planos são descartados aqui
+        invalidar_catalogo()
+        self.stdout.write(self.style.SUCCESS(f'{criados} alimentos criados e {atualizados} atualizados.'))
+
+    def alimento(self, linha, mapa, fonte):
+        dados = {campo: numero(linha[indice]) for campo, indice in mapa.items() if campo in CAMPOS_NUTRIENTES}
+        codigo = linha[mapa['codigo']].strip(); nome = linha[mapa['nome']].strip()
+        if not codigo or not nome:
+            raise ValueError('código e descrição são obrigatórios')
+        grupo = linha[mapa['grupo']].strip() if 'grupo' in mapa else ''
+        return Alimento(codigo=codigo, nome=nome, grupo=grupo, fonte=fonte, **dados)
+
+    @transaction.atomic
+    def gravar(self, lote):
+        unicos = {alimento.codigo: alimento for alimento in lote}  # código repetido no arquivo: vale a última linha
+        existentes = dict(Alimento.objects.filter(codigo__in=unicos).values_list('codigo', 'id'))
+        novos = [alimento for codigo, alimento in unicos.items() if codigo not in existentes]
+        atualizar = []
+        for codigo, alimento_id in existentes.items():
+            alimento = unicos[codigo]; alimento.id = alimento_id
+            atualizar.append(alimento)
+        Alimento.objects.bulk_create(novos)
+        Alimento.objects.bulk_update(atualizar, ['fonte', 'nome', 'grupo', *CAMPOS_NUTRIENTES])
+        return len(novos), len(atualizar)
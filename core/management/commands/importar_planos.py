@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.transferencia_planos import ArquivoInvalido, ImportadorPlanos, formato_do_arquivo, ler_planos
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa planos alimentares e refeições de um CSV (uma linha por refeição) ou JSONL (um plano por linha). '
+        'Lê o arquivo em fluxo, resolve cliente e nutricionista pelo e-mail e grava em lotes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do arquivo.')
+        parser.add_argument('--formato', choices=('csv', 'jsonl'), help='Formato do arquivo; pela extensão quando omitido.')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Codificação do arquivo.')
+        parser.add_argument('--delimitador', help='Separador de colunas do CSV; detectado pelo cabeçalho quando omitido.')
+        parser.add_argument('--lote', type=int, default=1000, help='Planos gravados por transação.')
+
+    def handle(self, *args, **options):
+        try:
+            formato = formato_do_arquivo(options['arquivo'], options['formato'])
+            arquivo = open(options['arquivo'], newline='', encoding=options['encoding'])
+        except (ArquivoInvalido, OSError) as erro:
+            raise CommandError(erro)
+        importador = ImportadorPlanos(tamanho_lote=options['lote'])
+        with arquivo:
+            try:
+                resultado = importador.importar(ler_planos(arquivo, formato, options['delimitador']))
+            except (ArquivoInvalido, UnicodeDecodeError) as erro:
+                raise CommandError(erro)
+        for erro in importador.erros:
+            self.stderr.write(erro)
+        if resultado['erros'] > len(importador.erros):
+            self.stderr.write(f"... e mais {resultado['erros'] - len(importador.erros)} erros.")
+        estilo = self.style.WARNING if resultado['erros'] else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f"{resultado['planos']} planos e {resultado['refeicoes']} refeições importados em {resultado['segundos']:.2f}s "
+            f"({resultado['planos_por_segundo']} planos/s); {resultado['erros']} planos com erro."
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.agendamento import limpar_reservas_expiradas
+
+
+class Command(BaseCommand):
+    help = 'Remove em lote as reservas temporárias de horário que já expiraram.'
+
+    def handle(self, *args, **options):
+        removidas = limpar_reservas_expiradas()
+        self.stdout.write(self.style.SUCCESS(f'{removidas} reserva(s) expirada(s) removida(s).'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.metricas import reconciliar
+from core.models import Nutricionista
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstrói as métricas diárias do dashboard do nutricionista a partir das consultas, em lotes de '
+        'nutricionistas (uma transação por lote). Corrige desvios do rollup incremental, ex.: depois de '
+        'alterações em lote nas consultas ou na primeira carga.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nutricionista', type=int, action='append', help='Só este nutricionista (id); pode repetir.')
+        parser.add_argument('--lote', type=int, default=100, help='Nutricionistas por transação.')
+
+    def handle(self, *args, **options):
+        nutricionistas = Nutricionista.objects.all()
+        if options['nutricionista']:
+            nutricionistas = nutricionistas.filter(id__in=options['nutricionista'])
+        inicio = time.perf_counter()
+        corrigidas = reconciliar(nutricionistas, tamanho_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{corrigidas} linhas de métricas corrigidas em {time.perf_counter() - inicio:.2f}s.'
+        ))
@@ -0,0 +1,259 @@
+"""Métricas do dashboard do nutricionista, mantidas de forma incremental.
+
+MetricaDiariaNutricionista guarda, por nutricionista e dia local, as consultas
+confirmadas, concluídas e canceladas, os minutos agendados (confirmadas e
+concluídas) e a receita (valor das concluídas). MetricaClienteNutricionista
+conta as consultas não canceladas de cada cliente com cada nutricionista.
+
+Os sinais de Consulta aplicam só a diferença entre o estado anterior e o novo
+da consulta (um INSERT ... ON CONFLICT DO UPDATE SET campo = campo + delta por
+tabela), então o dashboard lê umas poucas linhas prontas em vez de agregar anos
+de histórico a cada visita.
+Escritas em lote (update(), bulk_create) não disparam sinais: quem as faz chama
+registrar_mudanca() por conta própria ou roda o comando reconciliar_metricas,
+que reconstrói o rollup a partir das consultas e corrige qualquer desvio.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .disponibilidade import excecoes_por_dia, janelas_por_dia_semana
+from .models import Consulta, MetricaClienteNutricionista, MetricaDiariaNutricionista, Nutricionista
+
+
+CAMPOS_CONSULTA = ('nutricionista_id', 'cliente_id', 'data_horario', 'status', 'duracao', 'valor')
+CAMPOS_DIA = ('confirmadas', 'concluidas', 'canceladas', 'minutos_agendados', 'receita')
+# Marca um campo adiado (.only/.defer) que não está carregado na instância
+ADIADO = object()
+DIAS_PERIODO = 30
+DIAS_AGENDA = 7
+
+CONFIRMADO = Consulta.StatusChoices.CONFIRMADO
+CONCLUIDO = Consulta.StatusChoices.CONCLUIDO
+CANCELADO = Consulta.StatusChoices.CANCELADO
+CONTADOR_STATUS = {CONFIRMADO: 'confirmadas', CONCLUIDO: 'concluidas', CANCELADO: 'canceladas'}
+
+
+def dia_local(data_horario):
+    return timezone.localtime(data_horario, timezone.get_default_timezone()).date()
+
+
+def estado_consulta(consulta):
+    """Os campos que entram nas métricas; lê de __dict__ para não disparar queries em campos adiados."""
+    campos = consulta.__dict__
+    return tuple(campos.get(campo, ADIADO) for campo in CAMPOS_CONSULTA)
+
+
+def estado_completo(estado):
+    return ADIADO not in estado
+
+
+def _contribuicao(estado, sinal, dias, clientes):
+    nutricionista_id, cliente_id, data_horario, status, duracao, valor = estado
+    if nutricionista_id is None or data_horario is None:
+        return
+    dia = dias[nutricionista_id, dia_local(data_horario)]
+    if status in CONTADOR_STATUS:
+        dia[CONTADOR_STATUS[status]] += sinal
+    if status in (CONFIRMADO, CONCLUIDO):
+        dia['minutos_agendados'] += sinal * (duracao or 0)
+    if status == CONCLUIDO:
+        dia['receita'] += sinal * (valor or Decimal(0))
+    if status != CANCELADO and cliente_id is not None:
+        clientes[nutricionista_id, cliente_id] += sinal
+
+
+def diferenca(anterior, atual):
+    """Deltas ({(nutricionista, dia): {campo: delta}}, {(nutricionista, cliente): delta}) entre dois estados; None = não existe."""
+    dias = defaultdict(lambda: defaultdict(int)); clientes = defaultdict(int)
+    if anterior is not None:
+        _contribuicao(anterior, -1, dias, clientes)
+    if atual is not None:
+        _contribuicao(atual, 1, dias, clientes)
+    dias = {chave: {campo: valor for campo, valor in deltas.items() if valor} for chave, deltas in dias.items()}
+    return {chave: deltas for chave, deltas in dias.items() if deltas}, {chave: delta for chave, delta in clientes.items() if delta}
+
+
+def _somar(model, chaves, campos, linhas):
+    """Soma os deltas de `linhas` ({(chave...): {campo: delta}}) nas linhas de `model`, uma instrução por tabela.
+
+    Linhas com algum delta positivo vão num único INSERT ... ON CONFLICT DO UPDATE SET campo = campo + EXCLUDED.campo
+    (cria a linha ou soma, sem corrida entre UPDATE e INSERT). Sem a linha, um delta só negativo vem de uma consulta
+    que o rollup não contava ou de um nutricionista/cliente sendo removido (o CASCADE pode já ter apagado a linha):
+    essas só recebem UPDATE, para nunca criar uma linha negativa ou apontando para um registro apagado.
+    """
+    somar = {chave: deltas for chave, deltas in linhas.items() if any(valor > 0 for valor in deltas.values())}
+    subtrair = {chave: deltas for chave, deltas in linhas.items() if chave not in somar}
+    conexao = connections[router.db_for_write(model)]
+    coluna = lambda campo: conexao.ops.quote_name(model._meta.get_field(campo).column)
+    tabela = conexao.ops.quote_name(model._meta.db_table)
+    if somar:
+        colunas = (*chaves, *campos)
+        valores = ', '.join(['(' + ', '.join(['%s'] * len(colunas)) + ')'] * len(somar))
+        parametros = [valor for chave, deltas in somar.items() for valor in (*chave, *(deltas.get(campo, 0) for campo in campos))]
+        with conexao.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {tabela} ({", ".join(map(coluna, colunas))}) VALUES {valores} '
+                f'ON CONFLICT ({", ".join(map(coluna, chaves))}) DO UPDATE SET '
+                + ', '.join(f'{coluna(campo)} = {tabela}.{coluna(campo)} + EXCLUDED.{coluna(campo)}' for campo in campos),
+                parametros,
+            )
+    for chave, deltas in subtrair.items():
+        model.objects.filter(**dict(zip(chaves, chave))).update(**{campo: F(campo) + valor for campo, valor in deltas.items()})
+
+
+def aplicar(dias, clientes):
+    if dias:
+        _somar(MetricaDiariaNutricionista, ('nutricionista_id', 'data'), CAMPOS_DIA, dias)
+    if clientes:
+        _somar(MetricaClienteNutricionista, ('nutricionista_id', 'cliente_id'), ('consultas',), {chave: {'consultas': delta} for chave, delta in clientes.items()})
+
+
+def registrar_mudanca(anterior, atual):
+    """Aplica ao rollup a mudança de uma consulta (estados de estado_consulta; None para criada/removida)."""
+    registrar_mudancas([(anterior, atual)])
+
+
+def registrar_mudancas(mudancas):
+    """Como registrar_mudanca para várias consultas, somando os deltas antes de gravar: uma instrução por tabela."""
+    dias = defaultdict(lambda: defaultdict(int)); clientes = defaultdict(int)
+    for anterior, atual in mudancas:
+        dias_consulta, clientes_consulta = diferenca(anterior, atual)
+        for chave, deltas in dias_consulta.items():
+            for campo, valor in deltas.items():
+                dias[chave][campo] += valor
+        for chave, delta in clientes_consulta.items():
+            clientes[chave] += delta
+    dias = {chave: {campo: valor for campo, valor in deltas.items() if valor} for chave, deltas in dias.items()}
+    aplicar({chave: deltas for chave, deltas in dias.items() if deltas}, {chave: delta for chave, delta in clientes.items() if delta})
+
+
+# --- Reconciliação ---
+
+def _calcular(nutricionistas_ids):
+    tz = timezone.get_default_timezone()
+    consultas = Consulta.objects.filter(nutricionista_id__in=nutricionistas_ids).order_by()
+    dias = {}
+    for linha in (
+        consultas.annotate(data=TruncDate('data_horario', tzinfo=tz)).values('nutricionista_id', 'data').annotate(
+            confirmadas=Count('id', filter=Q(status=CONFIRMADO)), concluidas=Count('id', filter=Q(status=CONCLUIDO)),
+            canceladas=Count('id', filter=Q(status=CANCELADO)),
+            minutos_agendados=Sum('duracao', filter=Q(status__in=(CONFIRMADO, CONCLUIDO))), receita=Sum('valor', filter=Q(status=CONCLUIDO)),
+        )
+    ):
+        dias[linha['nutricionista_id'], linha['data']] = tuple(linha[campo] or 0 for campo in CAMPOS_DIA)
+    clientes = dict(
+        ((linha['nutricionista_id'], linha['cliente_id']), linha['consultas'])
+        for linha in consultas.exclude(status=CANCELADO).values('nutricionista_id', 'cliente_id').annotate(consultas=Count('id'))
+    )
+    return dias, clientes
+
+
+def reconciliar(nutricionistas=None, tamanho_lote=100):
+    """Reconstrói o rollup a partir das consultas, `tamanho_lote` nutricionistas por transação.
+
+    Só regrava os lotes que divergem; devolve quantas linhas estavam erradas ou faltando.
+    """
+    ids = list((nutricionistas if nutricionistas is not None else Nutricionista.objects.all()).order_by('id').values_list('id', flat=True))
+    corrigidas = 0
+    for inicio in range(0, len(ids), tamanho_lote):
+        lote = ids[inicio:inicio + tamanho_lote]
+        with transaction.atomic():
+            # Trava os nutricionistas do lote: uma reserva concorrente não muda as consultas no meio da conta
+            list(Nutricionista.objects.filter(id__in=lote).select_for_update().values_list('id', flat=True))
+            dias, clientes = _calcular(lote)
+            dias_atuais = {
+                (linha[0], linha[1]): tuple(linha[2:]) for linha in
+                MetricaDiariaNutricionista.objects.filter(nutricionista_id__in=lote).values_list('nutricionista_id', 'data', *CAMPOS_DIA)
+                if any(linha[2:])
+            }
+            clientes_atuais = {
+                (linha[0], linha[1]): linha[2] for linha in
+                MetricaClienteNutricionista.objects.filter(nutricionista_id__in=lote).values_list('nutricionista_id', 'cliente_id', 'consultas')
+                if linha[2]
+            }
+            erradas = sum(dias.get(chave) != dias_atuais.get(chave) for chave in dias.keys() | dias_atuais.keys())
+            erradas += sum(clientes.get(chave) != clientes_atuais.get(chave) for chave in clientes.keys() | clientes_atuais.keys())
+            if not erradas:
+                continue
+            corrigidas += erradas
+            MetricaDiariaNutricionista.objects.filter(nutricionista_id__in=lote).delete()
+            MetricaClienteNutricionista.objects.filter(nutricionista_id__in=lote).delete()
+            MetricaDiariaNutricionista.objects.bulk_create((
+                MetricaDiariaNutricionista(nutricionista_id=nutricionista_id, data=data, **dict(zip(CAMPOS_DIA, valores)))
+                for (nutricionista_id, data), valores in dias.items()
+            ), batch_size=1000)
+            MetricaClienteNutricionista.objects.bulk_create((
+                MetricaClienteNutricionista(nutricionista_id=nutricionista_id, cliente_id=cliente_id, consultas=consultas)
+                for (nutricionista_id, cliente_id), consultas in clientes.items()
+            ), batch_size=1000)
+    return corrigidas
+
+
+# --- Leitura para o dashboard ---
+
+def _minutos(inicio, fim):
+    return (datetime.combine(datetime.min, fim) - datetime.combine(datetime.min, inicio)).total_seconds() / 60
+
+
+def minutos_disponiveis(nutri, inicio, fim):
+    """Minutos de atendimento entre as datas [inicio, fim], pelas janelas semanais e exceções da agenda."""
+    janelas = janelas_por_dia_semana(nutri); excecoes = excecoes_por_dia(nutri, inicio, fim)
+    total = 0; data = inicio
+    while data <= fim:
+        abertas = list(janelas.get(data.weekday(), [])); bloqueios = []
+        for excecao in excecoes.get(data, []):
+            if excecao.disponivel and excecao.hora_inicio is not None:
+                abertas.append((excecao.hora_inicio, excecao.hora_fim))
+            elif excecao.hora_inicio is None:
+                abertas = []
+                break
+            else:
+                bloqueios.append((excecao.hora_inicio, excecao.hora_fim))
+        for hora_inicio, hora_fim in abertas:
+            bloqueado = sum(max(0, _minutos(max(hora_inicio, b_inicio), min(hora_fim, b_fim))) for b_inicio, b_fim in bloqueios)
+            total += max(0, _minutos(hora_inicio, hora_fim) - bloqueado)
+        data += timedelta(days=1)
+    return total
+
+
+def resumo_nutricionista(nutri, hoje=None):
+    """Números do dashboard lidos do rollup: últimos DIAS_PERIODO dias, mês atual e anterior e próximos DIAS_AGENDA dias."""
+    hoje = hoje or timezone.localdate()
+    inicio_periodo = hoje - timedelta(days=DIAS_PERIODO - 1)
+    inicio_mes = hoje.replace(day=1)
+    inicio_mes_anterior = (inicio_mes - timedelta(days=1)).replace(day=1)
+    fim_agenda = hoje + timedelta(days=DIAS_AGENDA - 1)
+    linhas = MetricaDiariaNutricionista.objects.filter(
+        nutricionista=nutri, data__gte=min(inicio_periodo, inicio_mes_anterior), data__lte=fim_agenda,
+    ).values_list('data', *CAMPOS_DIA)
+
+    periodo = dict.fromkeys(CAMPOS_DIA, 0); receita_mes = receita_mes_anterior = Decimal(0)
+    agenda = {hoje + timedelta(days=dia): {'confirmadas': 0, 'minutos_agendados': 0} for dia in range(DIAS_AGENDA)}
+    for data, *valores in linhas:
+        valores = dict(zip(CAMPOS_DIA, valores))
+        if inicio_periodo <= data <= hoje:
+            for campo in CAMPOS_DIA:
+                periodo[campo] += valores[campo]
+        if inicio_mes <= data <= hoje:
+            receita_mes += valores['receita']
+        elif inicio_mes_anterior <= data < inicio_mes:
+            receita_mes_anterior += valores['receita']
+        if data in agenda:
+            agenda[data] = {'confirmadas': valores['confirmadas'], 'minutos_agendados': valores['minutos_agendados']}
+
+    disponiveis = minutos_disponiveis(nutri, inicio_periodo, hoje)
+    encerradas = periodo['concluidas'] + periodo['canceladas']
+    return {
+        'periodo': periodo, 'dias_periodo': DIAS_PERIODO,
+        'ocupacao': round(100 * periodo['minutos_agendados'] / disponiveis, 1) if disponiveis else None,
+        'taxa_cancelamento': round(100 * periodo['canceladas'] / encerradas, 1) if encerradas else None,
+        'receita_mes': receita_mes, 'receita_mes_anterior': receita_mes_anterior,
+        'agenda': [{'data': data, **valores} for data, valores in agenda.items()],
+        'clientes_ativos': MetricaClienteNutricionista.objects.filter(nutricionista=nutri, consultas__gt=0).count(),
+    }
@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .conexoes import contar_conexoes
+
+
+logger = logging.getLogger('core.sql')
+_coletor = ContextVar('coletor_sql', default=None)
+
+
+class ColetorSQL:
+    """execute_wrapper que mede cada consulta da requisição.
+
+    As consultas são agrupadas pelo SQL com placeholders: o mesmo SQL repetido com
+    parâmetros diferentes é o padrão típico de N+1 (um SELECT por item de uma lista).
+    """
+    MAX_PARAMETROS_POR_SQL = 50
+
+    def __init__(self, limite_lentas=5):
+        self.limite_lentas = limite_lentas
+        self.total = 0
+        self.tempo = 0.0
+        self.lentas = []
+        self.por_sql = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.registrar(sql, params, time.perf_counter() - inicio)
+
+    def registrar(self, sql, params, duracao):
+        self.total += 1
+        self.tempo += duracao
+        item = (duracao, self.total, sql)
+        if len(self.lentas) < self.limite_lentas:
+            heapq.heappush(self.lentas, item)
+        else:
+            heapq.heappushpop(self.lentas, item)
+        grupo = self.por_sql.setdefault(sql, [0, set()])
+        grupo[0] += 1
+        if len(grupo[1]) < self.MAX_PARAMETROS_POR_SQL:
+            grupo[1].add(repr(params))
+
+    def suspeitas_n1(self, limite):
+        return [
+            {'sql': sql, 'vezes': vezes, 'parametros_distintos': len(parametros)}
+            for sql, (vezes, parametros) in self.por_sql.items()
+            if vezes >= limite and len(parametros) > 1
+        ]
+
+    def mais_lentas(self):
+        return [{'sql': sql, 'ms': round(duracao * 1000, 2)} for duracao, _, sql in sorted(self.lentas, reverse=True)]
+
+
+def _repassar_ao_coletor(execute, sql, params, many, context):
+    """execute_wrapper fixo das conexões: mede a consulta no ColetorSQL da requisição em andamento, se houver."""
+    coletor = _coletor.get()
+    if coletor is None:
+        return execute(sql, params, many, context)
+    return coletor(execute, sql, params, many, context)
+
+
+def instrumentar_conexao(sender, connection, **kwargs):
+    """Receptor de connection_created: instala o _repassar_ao_coletor na conexão (uma vez só)."""
+    if _repassar_ao_coletor not in connection.execute_wrappers:
+        # No início da lista: um `with execute_wrapper(...)` aberto agora desempilha o seu, não este
+        connection.execute_wrappers.insert(0, _repassar_ao_coletor)
+
+
+class InstrumentacaoSQLMiddleware:
+    """Conta consultas, tempo total de SQL, conexões abertas e as mais lentas de cada requisição (opcional).
+
+    Ativado por SQL_INSTRUMENTACAO. SQL_INSTRUMENTACAO_AMOSTRAGEM (0 a 1) define a
+    fração de requisições medidas, para que possa ficar ligado em produção; as não
+    amostradas passam direto, sem coletor nenhum.
+
+    Síncrono e assíncrono: sob ASGI as consultas saem das threads das views (a
+    compartilhada ou o pool de core.views_async), não da thread deste middleware.
+    Por isso o coletor da requisição fica numa ContextVar, que o sync_to_async
+    copia para essas threads, e cada conexão leva um execute_wrapper fixo que o
+    consulta (instalado ao conectar).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTACAO', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.amostragem = getattr(settings, 'SQL_INSTRUMENTACAO_AMOSTRAGEM', 1.0)
+        self.limite_n1 = getattr(settings, 'SQL_INSTRUMENTACAO_LIMITE_N1', 5)
+        self.limite_lentas = getattr(settings, 'SQL_INSTRUMENTACAO_LENTAS', 5)
+        self.cabecalhos = getattr(settings, 'SQL_INSTRUMENTACAO_CABECALHOS', True)
+        connection_created.connect(instrumentar_conexao, dispatch_uid='core.middleware.instrumentar_conexao')
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.amostrar():
+            return self.get_response(request)
+        # Conexões desta thread abertas antes do middleware existir
+        for conexao in connections.all():
+            instrumentar_conexao(None, conexao)
+        with self.medindo() as (coletor, conexoes_abertas):
+            response = self.get_response(request)
+        return self.registrar(request, response, coletor, conexoes_abertas)
+
+    async def __acall__(self, request):
+        if not self.amostrar():
+            return await self.get_response(request)
+        with self.medindo() as (coletor, conexoes_abertas):
+            response = await self.get_response(request)
+        return self.registrar(request, response, coletor, conexoes_abertas)
+
+    def amostrar(self):
+        return self.amostragem >= 1 or random.random() < self.amostragem
+
+    @contextmanager
+    def medindo(self):
+        coletor = ColetorSQL(self.limite_lentas)
+        token = _coletor.set(coletor)
+        try:
+            with contar_conexoes() as conexoes_abertas:
+                yield coletor, conexoes_abertas
+        finally:
+            _coletor.reset(token)
+
+    def registrar(self, request, response, coletor, conexoes_abertas):
+        suspeitas = coletor.suspeitas_n1(self.limite_n1)
+        if self.cabecalhos:
+            response['X-SQL-Queries'] = str(coletor.total)
+            response['X-SQL-Tempo-ms'] = f'{coletor.tempo * 1000:.2f}'
+            response['X-SQL-N1'] = str(len(suspeitas))
+            response['X-SQL-Conexoes'] = str(conexoes_abertas[0])
+        registro = {
+            'metodo': request.method, 'caminho': request.path, 'status': response.status_code,
+            'queries': coletor.total, 'tempo_sql_ms': round(coletor.tempo * 1000, 2), 'conexoes_abertas': conexoes_abertas[0],
+            'mais_lentas': coletor.mais_lentas(), 'suspeitas_n1': suspeitas,
+        }
+        logger.log(logging.WARNING if suspeitas else logging.INFO, json.dumps(registro, ensure_ascii=False), extra={'sql': registro})
+        return response
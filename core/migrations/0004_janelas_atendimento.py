@@ -0,0 +1,100 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:37
+
+from datetime import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+DIAS_SEMANA = ['segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo']
+
+
+def converter_json_em_janelas(apps, schema_editor):
+    Nutricionista = apps.get_model('core', 'Nutricionista')
+    JanelaAtendimento = apps.get_model('core', 'JanelaAtendimento')
+    janelas = []
+    for nutri_id, horarios in Nutricionista.objects.exclude(horarios_disponiveis=None).values_list('id', 'horarios_disponiveis').iterator():
+        for numero, dia in enumerate(DIAS_SEMANA):
+            horario_dia = (horarios or {}).get(dia) or {}
+            if not horario_dia.get('inicio') or not horario_dia.get('fim'):
+                continue
+            inicio = datetime.strptime(horario_dia['inicio'], '%H:%M').time()
+            fim = datetime.strptime(horario_dia['fim'], '%H:%M').time()
+            if fim > inicio:
+                janelas.append(JanelaAtendimento(nutricionista_id=nutri_id, dia_semana=numero, hora_inicio=inicio, hora_fim=fim))
+        if len(janelas) >= 1000:
+            JanelaAtendimento.objects.bulk_create(janelas); janelas = []
+    JanelaAtendimento.objects.bulk_create(janelas)
+
+
+def converter_janelas_em_json(apps, schema_editor):
+    # Reverso aproximado: o JSON só comporta uma janela por dia, então fica a mais ampla
+    Nutricionista = apps.get_model('core', 'Nutricionista')
+    JanelaAtendimento = apps.get_model('core', 'JanelaAtendimento')
+    horarios = {}
+    for janela in JanelaAtendimento.objects.order_by('nutricionista_id', 'dia_semana', 'hora_inicio').iterator():
+        dia = horarios.setdefault(janela.nutricionista_id, {}).setdefault(DIAS_SEMANA[janela.dia_semana], {})
+        dia['inicio'] = min(dia.get('inicio', '99:99'), janela.hora_inicio.strftime('%H:%M'))
+        dia['fim'] = max(dia.get('fim', '00:00'), janela.hora_fim.strftime('%H:%M'))
+    for nutri_id, horarios_nutri in horarios.items():
+        Nutricionista.objects.filter(id=nutri_id).update(horarios_disponiveis=horarios_nutri)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_nutricionista_is_approved_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JanelaAtendimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Segunda-feira'), (1, 'Terça-feira'), (2, 'Quarta-feira'), (3, 'Quinta-feira'), (4, 'Sexta-feira'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fim', models.TimeField()),
+                ('nutricionista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='janelas', to='core.nutricionista')),
+            ],
+            options={
+                'ordering': ['dia_semana', 'hora_inicio'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExcecaoAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('hora_inicio', models.TimeField(blank=True, null=True)),
+                ('hora_fim', models.TimeField(blank=True, null=True)),
+                ('disponivel', models.BooleanField(default=False, help_text='Marque para abrir um horário extra; desmarcado bloqueia (feriado, folga, pausa)')),
+                ('motivo', models.CharField(blank=True, max_length=100)),
+                ('nutricionista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='excecoes', to='core.nutricionista')),
+            ],
+            options={
+                'ordering': ['data', 'hora_inicio'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='janelaatendimento',
+            index=models.Index(fields=['dia_semana', 'hora_fim', 'hora_inicio'], name='janela_dia_horario_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='janelaatendimento',
+            constraint=models.CheckConstraint(check=models.Q(('hora_fim__gt', django.db.models.expressions.F('hora_inicio'))), name='janela_fim_apos_inicio'),
+        ),
+        migrations.AddIndex(
+            model_name='excecaoagenda',
+            index=models.Index(fields=['nutricionista', 'data'], name='excecao_nutri_data_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='excecaoagenda',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('disponivel', False), ('hora_fim__isnull', True), ('hora_inicio__isnull', True)), ('hora_fim__gt', django.db.models.expressions.F('hora_inicio')), _connector='OR'), name='excecao_horario_valido'),
+        ),
+        migrations.RunPython(converter_json_em_janelas, converter_janelas_em_json),
+        migrations.RemoveField(
+            model_name='nutricionista',
+            name='horarios_disponiveis',
+        ),
+    ]
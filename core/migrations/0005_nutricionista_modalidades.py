@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_janelas_atendimento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nutricionista',
+            name='atende_online',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='nutricionista',
+            name='atende_presencial',
+            field=models.BooleanField(default=True),
+        ),
+    ]
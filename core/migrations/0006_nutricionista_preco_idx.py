@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_nutricionista_modalidades'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='nutricionista',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['preco_consulta', 'id'], name='nutri_aprovado_preco_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+def copiar_duracao_do_nutricionista(apps, schema_editor):
+    Consulta = apps.get_model('core', 'Consulta')
+    Nutricionista = apps.get_model('core', 'Nutricionista')
+    Consulta.objects.update(duracao=models.Subquery(
+        Nutricionista.objects.filter(pk=models.OuterRef('nutricionista_id')).values('duracao_consulta')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_nutricionista_preco_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='consulta',
+            name='unique_appointment_time',
+        ),
+        migrations.AddField(
+            model_name='consulta',
+            name='duracao',
+            field=models.PositiveIntegerField(default=60, help_text='Duração em minutos, copiada do nutricionista no agendamento'),
+        ),
+        migrations.RunPython(copiar_duracao_do_nutricionista, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='consulta',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'CONFIRMADO')), fields=('nutricionista', 'data_horario'), name='unique_appointment_time'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_consulta_duracao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_horario', models.DateTimeField()),
+                ('expira_em', models.DateTimeField()),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='core.cliente')),
+                ('nutricionista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='core.nutricionista')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='reservahorario',
+            index=models.Index(fields=['expira_em'], name='reserva_expira_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reservahorario',
+            constraint=models.UniqueConstraint(fields=('nutricionista', 'data_horario'), name='reserva_horario_unica'),
+        ),
+    ]
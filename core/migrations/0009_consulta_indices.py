@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_reserva_horario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['cliente', 'data_horario'], name='consulta_cliente_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['nutricionista', 'data_horario'], name='consulta_nutri_data_idx'),
+        ),
+    ]
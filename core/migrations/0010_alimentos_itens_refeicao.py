@@ -0,0 +1,54 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_consulta_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo', models.CharField(help_text='Código do alimento na tabela de origem', max_length=20, unique=True)),
+                ('fonte', models.CharField(default='TACO', max_length=20)),
+                ('nome', models.CharField(max_length=255)),
+                ('grupo', models.CharField(blank=True, max_length=100)),
+                ('energia_kcal', models.FloatField(default=0)),
+                ('proteina_g', models.FloatField(default=0)),
+                ('carboidrato_g', models.FloatField(default=0)),
+                ('lipideos_g', models.FloatField(default=0)),
+                ('fibra_g', models.FloatField(default=0)),
+                ('calcio_mg', models.FloatField(default=0)),
+                ('ferro_mg', models.FloatField(default=0)),
+                ('sodio_mg', models.FloatField(default=0)),
+                ('vitamina_c_mg', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.AddField(
+            model_name='planoalimentar',
+            name='versao',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ItemRefeicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade_g', models.FloatField(help_text='Quantidade em gramas')),
+                ('alimento', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='itens', to='core.alimento')),
+                ('refeicao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='itens', to='core.refeicao')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='itemrefeicao',
+            constraint=models.CheckConstraint(check=models.Q(('quantidade_g__gt', 0)), name='item_refeicao_quantidade_positiva'),
+        ),
+    ]
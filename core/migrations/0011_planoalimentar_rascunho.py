@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alimentos_itens_refeicao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planoalimentar',
+            name='rascunho',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_planoalimentar_rascunho'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModeloPlano',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100)),
+                ('observacoes', models.TextField(blank=True, null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='refeicao',
+            name='plano_alimentar',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='refeicoes', to='core.planoalimentar'),
+        ),
+        migrations.AddField(
+            model_name='modeloplano',
+            name='nutricionista',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='modelos_plano', to='core.nutricionista'),
+        ),
+        migrations.AddField(
+            model_name='planoalimentar',
+            name='modelo',
+            field=models.ForeignKey(blank=True, help_text='Refeições vindas do modelo; ao personalizar o plano elas são copiadas e o vínculo some', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='planos', to='core.modeloplano'),
+        ),
+        migrations.AddField(
+            model_name='refeicao',
+            name='modelo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='refeicoes', to='core.modeloplano'),
+        ),
+        migrations.AddConstraint(
+            model_name='refeicao',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('modelo__isnull', True), ('plano_alimentar__isnull', False)), models.Q(('modelo__isnull', False), ('plano_alimentar__isnull', True)), _connector='OR'), name='refeicao_de_plano_ou_modelo'),
+        ),
+    ]
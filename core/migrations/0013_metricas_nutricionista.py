@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copiar_valor_do_nutricionista(apps, schema_editor):
+    # Sem histórico de preços: as consultas antigas recebem o preço atual. O rollup é preenchido por reconciliar_metricas
+    Consulta = apps.get_model('core', 'Consulta')
+    Nutricionista = apps.get_model('core', 'Nutricionista')
+    Consulta.objects.update(valor=models.Subquery(
+        Nutricionista.objects.filter(pk=models.OuterRef('nutricionista_id')).values('preco_consulta')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_modelos_plano'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='valor',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Preço da consulta, copiado do nutricionista no agendamento', max_digits=8, null=True),
+        ),
+        migrations.RunPython(copiar_valor_do_nutricionista, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='MetricaDiariaNutricionista',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(help_text='Dia local da consulta')),
+                ('confirmadas', models.IntegerField(default=0)),
+                ('concluidas', models.IntegerField(default=0)),
+                ('canceladas', models.IntegerField(default=0)),
+                ('minutos_agendados', models.IntegerField(default=0, help_text='Duração das consultas confirmadas e concluídas')),
+                ('receita', models.DecimalField(decimal_places=2, default=0, help_text='Valor das consultas concluídas', max_digits=12)),
+                ('nutricionista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_diarias', to='core.nutricionista')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MetricaClienteNutricionista',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consultas', models.IntegerField(default=0)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_nutricionistas', to='core.cliente')),
+                ('nutricionista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metricas_clientes', to='core.nutricionista')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricadiarianutricionista',
+            constraint=models.UniqueConstraint(fields=('nutricionista', 'data'), name='metrica_diaria_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='metricaclientenutricionista',
+            index=models.Index(condition=models.Q(('consultas__gt', 0)), fields=['nutricionista'], name='metrica_cliente_ativo_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='metricaclientenutricionista',
+            constraint=models.UniqueConstraint(fields=('nutricionista', 'cliente'), name='metrica_cliente_unica'),
+        ),
+    ]
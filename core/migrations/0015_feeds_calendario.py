@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:34
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def criar_tokens(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    TokenCalendario = apps.get_model('core', 'TokenCalendario')
+    sem_token = User.objects.filter(token_calendario__isnull=True).values_list('id', flat=True).iterator()
+    TokenCalendario.objects.bulk_create(
+        (TokenCalendario(usuario_id=usuario_id, token=core.models.gerar_token_calendario()) for usuario_id in sem_token),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_jobs_notificacoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='TokenCalendario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=core.models.gerar_token_calendario, max_length=64, unique=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='token_calendario', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(criar_tokens, migrations.RunPython.noop),
+    ]
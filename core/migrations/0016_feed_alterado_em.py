@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_feeds_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tokencalendario',
+            name='feed_alterado_em',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
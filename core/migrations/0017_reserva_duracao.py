@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_feed_alterado_em'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservahorario',
+            name='duracao',
+            field=models.PositiveIntegerField(default=60, help_text='Duração em minutos, copiada do nutricionista ao segurar o horário'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+"""Modelos de plano alimentar: o mesmo plano-base aplicado a muitos clientes.
+
+Aplicar um modelo só cria as linhas de PlanoAlimentar (bulk_create), apontando
+para o modelo; as refeições e os itens continuam apenas no modelo, então a
+tabela de refeições não cresce com clientes x refeições. O que mudar no modelo
+aparece em todos os planos que ainda apontam para ele.
+
+Para ajustar o plano de um cliente, `personalizar_planos` copia as refeições e
+os itens do modelo para o plano e desfaz o vínculo. O número de queries é fixo
+(planos, refeições do modelo, itens, INSERT das refeições, INSERT dos itens,
+UPDATE dos planos), não importa quantos planos ou refeições.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, QuerySet
+
+from . import dashboard
+from .dados_sinteticos import inserir_em_lote
+from .models import ItemRefeicao, PlanoAlimentar, Refeicao
+
+
+def aplicar_modelo(modelo, clientes, rascunho=False, tamanho_lote=1000):
+    """Cria, para cada cliente, um plano que usa as refeições do modelo; devolve os planos criados."""
+    if isinstance(clientes, QuerySet):
+        clientes_ids = list(clientes.values_list('id', flat=True))
+    else:
+        clientes_ids = [cliente.pk for cliente in clientes]
+    planos = [
+        PlanoAlimentar(
+            cliente_id=cliente_id, nutricionista_id=modelo.nutricionista_id, modelo=modelo,
+            observacoes=modelo.observacoes, rascunho=rascunho,
+        ) for cliente_id in clientes_ids
+    ]
+    with transaction.atomic():
+        inserir_em_lote(PlanoAlimentar, planos, tamanho_lote)
+        # bulk_create não dispara os sinais que invalidam o dashboard do cliente
+        if not rascunho:
+            for cliente_id in set(clientes_ids):
+                dashboard.invalidar_dashboard_cliente(cliente_id)
+    return planos
+
+
+def personalizar_planos(planos, tamanho_lote=1000):
+    """Copia para cada plano as refeições (e itens) do seu modelo e desfaz o vínculo; devolve quantos planos mudaram."""
+    with transaction.atomic():
+        vinculados = list(planos.filter(modelo__isnull=False).select_for_update().values_list('id', 'modelo_id', 'cliente_id', 'rascunho'))
+        if not vinculados:
+            return 0
+        modelos = {modelo_id for _, modelo_id, _, _ in vinculados}
+        refeicoes_por_modelo = defaultdict(list)
+        for refeicao in Refeicao.objects.filter(modelo_id__in=modelos).order_by('id'):
+            refeicoes_por_modelo[refeicao.modelo_id].append(refeicao)
+        itens_por_refeicao = defaultdict(list)
+        for refeicao_id, alimento_id, quantidade_g in ItemRefeicao.objects.filter(refeicao__modelo_id__in=modelos).order_by('id').values_list('refeicao_id', 'alimento_id', 'quantidade_g'):
+            itens_por_refeicao[refeicao_id].append((alimento_id, quantidade_g))
+
+        copias = []; origens = []
+        for plano_id, modelo_id, _, _ in vinculados:
+            for refeicao in refeicoes_por_modelo[modelo_id]:
+                copias.append(Refeicao(
+                    plano_alimentar_id=plano_id, nome=refeicao.nome, alimentos=refeicao.alimentos,
+                    quantidades=refeicao.quantidades, calorias=refeicao.calorias,
+                ))
+                origens.append(refeicao.id)
+        inserir_em_lote(Refeicao, copias, tamanho_lote)
+        ItemRefeicao.objects.bulk_create((
+            ItemRefeicao(refeicao_id=copia.id, alimento_id=alimento_id, quantidade_g=quantidade_g)
+            for copia, origem in zip(copias, origens) for alimento_id, quantidade_g in itens_por_refeicao[origem]
+        ), batch_size=tamanho_lote)
+        # As refeições passam a ter outros ids: a nova versão descarta os totais de nutrientes em cache
+        PlanoAlimentar.objects.filter(id__in=[plano_id for plano_id, _, _, _ in vinculados]).update(modelo=None, versao=F('versao') + 1)
+        for cliente_id in {cliente_id for _, _, cliente_id, rascunho in vinculados if not rascunho}:
+            dashboard.invalidar_dashboard_cliente(cliente_id)
+    return len(vinculados)
+
+
+def invalidar_planos_do_modelo(modelo_id):
+    """Um modelo mudou: descarta os dashboards dos clientes cujos planos ainda apontam para ele."""
+    clientes = PlanoAlimentar.objects.filter(modelo_id=modelo_id, rascunho=False).values_list('cliente_id', flat=True).distinct()
+    for cliente_id in clientes:
+        dashboard.invalidar_dashboard_cliente(cliente_id)
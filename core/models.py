@@ -1,9 +1,15 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+import secrets
  
  
 def user_directory_path(instance, filename):
     return f'user_{instance.usuario.id}/profile_pics/{filename}'
+
+def gerar_token_calendario():
+    return secrets.token_urlsafe(32)
  
 class User(AbstractUser):
     class UserType(models.TextChoices):
@@ -14,6 +20,12 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     telefone = models.CharField(max_length=15)
     user_type = models.CharField(max_length=20, choices=UserType.choices, default=UserType.CLIENTE)
+
+    def get_session_auth_hash(self):
+        # Usuário reconstruído do cache de core.backends: a senha não foi carregada e o hash da sessão veio junto
+        if 'password' not in self.__dict__ and hasattr(self, 'hash_sessao_em_cache'):
+            return self.hash_sessao_em_cache
+        return super().get_session_auth_hash()
  
 class Especialidade(models.Model):
     nome = models.CharField(max_length=100)
@@ -22,18 +34,93 @@ class Especialidade(models.Model):
     def __str__(self):
         return self.nome
  
+class NutricionistaQuerySet(models.QuerySet):
+    def atendendo_em(self, dia_semana, depois_de=None, antes_de=None):
+        """Nutricionistas com alguma janela no dia da semana (0 = segunda) que termina depois de `depois_de` e/ou começa antes de `antes_de`."""
+        janelas = JanelaAtendimento.objects.filter(nutricionista=models.OuterRef('pk'), dia_semana=dia_semana)
+        if depois_de:
+            janelas = janelas.filter(hora_fim__gt=depois_de)
+        if antes_de:
+            janelas = janelas.filter(hora_inicio__lt=antes_de)
+        return self.filter(models.Exists(janelas))
+
+
 class Nutricionista(models.Model):
     usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil_nutricionista')
     especialidades = models.ManyToManyField(Especialidade)
     preco_consulta = models.DecimalField(max_digits=8, decimal_places=2, help_text="Preço por consulta")
     duracao_consulta = models.IntegerField(help_text="Duração da consulta em minutos")
-    horarios_disponiveis = models.JSONField(null=True, blank=True)
    
     # --- NOVO CAMPO ADICIONADO (Baseado no RF04 e RF20) ---
     is_approved = models.BooleanField(default=False, help_text="Aprovado pelo Admin")
+    atende_presencial = models.BooleanField(default=True)
+    atende_online = models.BooleanField(default=True)
+
+    objects = NutricionistaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Ordem estável da listagem paginada por chave (preço, id)
+            models.Index(fields=['preco_consulta', 'id'], name='nutri_aprovado_preco_idx', condition=models.Q(is_approved=True)),
+        ]
  
     def __str__(self):
         return self.usuario.get_full_name() or self.usuario.username
+
+
+class DiaSemana(models.IntegerChoices):
+    SEGUNDA = 0, 'Segunda-feira'
+    TERCA = 1, 'Terça-feira'
+    QUARTA = 2, 'Quarta-feira'
+    QUINTA = 3, 'Quinta-feira'
+    SEXTA = 4, 'Sexta-feira'
+    SABADO = 5, 'Sábado'
+    DOMINGO = 6, 'Domingo'
+
+
+class JanelaAtendimento(models.Model):
+    # Várias janelas no mesmo dia expressam pausas (ex.: 08:00-12:00 e 14:00-18:00)
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='janelas')
+    dia_semana = models.PositiveSmallIntegerField(choices=DiaSemana.choices)
+    hora_inicio = models.TimeField()
+    hora_fim = models.TimeField()
+
+    class Meta:
+        ordering = ['dia_semana', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['dia_semana', 'hora_fim', 'hora_inicio'], name='janela_dia_horario_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(hora_fim__gt=models.F('hora_inicio')), name='janela_fim_apos_inicio'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dia_semana_display()} {self.hora_inicio:%H:%M}-{self.hora_fim:%H:%M} ({self.nutricionista})"
+
+
+class ExcecaoAgenda(models.Model):
+    # Sem horários = o dia inteiro. `disponivel` marca uma janela extra em vez de um bloqueio.
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='excecoes')
+    data = models.DateField()
+    hora_inicio = models.TimeField(null=True, blank=True)
+    hora_fim = models.TimeField(null=True, blank=True)
+    disponivel = models.BooleanField(default=False, help_text="Marque para abrir um horário extra; desmarcado bloqueia (feriado, folga, pausa)")
+    motivo = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        ordering = ['data', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['nutricionista', 'data'], name='excecao_nutri_data_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(hora_inicio__isnull=True, hora_fim__isnull=True, disponivel=False) | models.Q(hora_fim__gt=models.F('hora_inicio')),
+                name='excecao_horario_valido',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{'Extra' if self.disponivel else 'Bloqueio'} em {self.data:%d/%m/%Y} ({self.nutricionista})"
  
 class Cliente(models.Model):
     usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil_cliente')
@@ -59,34 +146,224 @@ class Consulta(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
     nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE)
     data_horario = models.DateTimeField()
+    duracao = models.PositiveIntegerField(default=60, help_text="Duração em minutos, copiada do nutricionista no agendamento")
+    valor = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, help_text="Preço da consulta, copiado do nutricionista no agendamento")
     modalidade = models.CharField(max_length=20, choices=ModalidadeChoices.choices)
     status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.CONFIRMADO)
+    # Last-Modified/ETag dos feeds iCalendar (core.calendario); UPDATEs em lote precisam atualizá-lo à mão
+    atualizado_em = models.DateTimeField(auto_now=True)
    
    
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['nutricionista', 'data_horario'], name='unique_appointment_time')
+            # Só consultas confirmadas ocupam o horário: um cancelamento libera o slot para outro cliente.
+            # O índice parcial desta restrição também atende a API de horários (nutricionista + intervalo + CONFIRMADO).
+            models.UniqueConstraint(fields=['nutricionista', 'data_horario'], condition=models.Q(status='CONFIRMADO'), name='unique_appointment_time')
+        ]
+        indexes = [
+            # dashboard_cliente e consultas_cliente: consultas do cliente por intervalo de data_horario
+            models.Index(fields=['cliente', 'data_horario'], name='consulta_cliente_data_idx'),
+            # Agenda completa do nutricionista (qualquer status), ex.: histórico e relatórios
+            models.Index(fields=['nutricionista', 'data_horario'], name='consulta_nutri_data_idx'),
+            # Jobs (core.jobs): confirmadas por horário; o índice encolhe conforme as passadas são concluídas
+            models.Index(fields=['data_horario', 'id'], name='consulta_confirmada_data_idx', condition=models.Q(status='CONFIRMADO')),
         ]
  
     def __str__(self):
         return f"Consulta de {self.cliente} com {self.nutricionista} em {self.data_horario.strftime('%d/%m/%Y %H:%M')}"
  
+class MetricaDiariaNutricionista(models.Model):
+    # Rollup mantido pelos sinais de Consulta (core.metricas); reconstruído por reconciliar_metricas
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='metricas_diarias')
+    data = models.DateField(help_text="Dia local da consulta")
+    confirmadas = models.IntegerField(default=0)
+    concluidas = models.IntegerField(default=0)
+    canceladas = models.IntegerField(default=0)
+    minutos_agendados = models.IntegerField(default=0, help_text="Duração das consultas confirmadas e concluídas")
+    receita = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Valor das consultas concluídas")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['nutricionista', 'data'], name='metrica_diaria_unica'),
+        ]
+
+    def __str__(self):
+        return f"Métricas de {self.nutricionista} em {self.data:%d/%m/%Y}"
+
+class MetricaClienteNutricionista(models.Model):
+    # Consultas não canceladas de cada cliente com o nutricionista; > 0 = cliente ativo no dashboard
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='metricas_clientes')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='metricas_nutricionistas')
+    consultas = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['nutricionista', 'cliente'], name='metrica_cliente_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['nutricionista'], name='metrica_cliente_ativo_idx', condition=models.Q(consultas__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente} com {self.nutricionista}: {self.consultas} consultas"
+
+class Notificacao(models.Model):
+    # Caixa de saída: os jobs enfileiram aqui e core.jobs.enviar_notificacoes drena em lotes
+    class TipoChoices(models.TextChoices):
+        LEMBRETE = 'LEMBRETE', 'Lembrete de consulta'
+
+    class StatusChoices(models.TextChoices):
+        PENDENTE = 'PENDENTE', 'Pendente'
+        ENVIADA = 'ENVIADA', 'Enviada'
+        FALHOU = 'FALHOU', 'Falhou'
+        DESCARTADA = 'DESCARTADA', 'Descartada'
+
+    consulta = models.ForeignKey(Consulta, on_delete=models.CASCADE, related_name='notificacoes')
+    tipo = models.CharField(max_length=20, choices=TipoChoices.choices)
+    destinatario = models.EmailField()
+    assunto = models.CharField(max_length=200)
+    corpo = models.TextField()
+    status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDENTE)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField()
+    criada_em = models.DateTimeField(auto_now_add=True)
+    enviada_em = models.DateTimeField(null=True, blank=True)
+    erro = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            # Enfileirar de novo a mesma notificação não duplica o envio
+            models.UniqueConstraint(fields=['consulta', 'tipo'], name='notificacao_unica_por_consulta'),
+        ]
+        indexes = [
+            models.Index(fields=['proxima_tentativa', 'id'], name='notificacao_pendente_idx', condition=models.Q(status='PENDENTE')),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} para {self.destinatario} ({self.get_status_display()})"
+
+class TokenCalendario(models.Model):
+    # Autentica o feed .ics do usuário (o app de calendário não tem sessão); gerar outro invalida o link antigo
+    usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='token_calendario')
+    token = models.CharField(max_length=64, unique=True, default=gerar_token_calendario)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    # Mudanças no feed que não passam por Consulta.atualizado_em (consultas apagadas, nomes alterados); core.calendario
+    feed_alterado_em = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Calendário de {self.usuario}"
+
+class ReservaHorario(models.Model):
+    # Segura um horário por alguns minutos enquanto o cliente conclui o agendamento
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='reservas')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='reservas')
+    data_horario = models.DateTimeField()
+    duracao = models.PositiveIntegerField(default=60, help_text="Duração em minutos, copiada do nutricionista ao segurar o horário")
+    expira_em = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['nutricionista', 'data_horario'], name='reserva_horario_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['expira_em'], name='reserva_expira_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reserva de {self.cliente} com {self.nutricionista} em {self.data_horario:%d/%m/%Y %H:%M}"
+
+class ModeloPlano(models.Model):
+    # Plano-base reutilizável: as refeições ficam no modelo e os planos aplicados a partir dele apontam para elas
+    nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE, related_name='modelos_plano')
+    nome = models.CharField(max_length=100)
+    observacoes = models.TextField(blank=True, null=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['nome']
+
+    def __str__(self):
+        return f"{self.nome} ({self.nutricionista})"
+
 class PlanoAlimentar(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE)
     nutricionista = models.ForeignKey(Nutricionista, on_delete=models.CASCADE)
     data_criacao = models.DateField(auto_now_add=True)
     observacoes = models.TextField(blank=True, null=True)
+    # Rascunhos (ex.: gerados por core.gerador_planos) não aparecem para o cliente até serem revisados
+    rascunho = models.BooleanField(default=False)
+    # Incrementada (pelos sinais) a cada mudança nos itens das refeições; compõe a chave do cache de nutrientes
+    versao = models.PositiveIntegerField(default=1, editable=False)
+    # Enquanto aponta para um modelo, o plano não tem refeições próprias: usa as do modelo (ver core.modelos_plano)
+    modelo = models.ForeignKey(
+        ModeloPlano, on_delete=models.PROTECT, null=True, blank=True, related_name='planos',
+        help_text="Refeições vindas do modelo; ao personalizar o plano elas são copiadas e o vínculo some",
+    )
  
     def __str__(self):
         return f"Plano para {self.cliente} criado em {self.data_criacao.strftime('%d/%m/%Y')}"
+
+    def refeicoes_do_plano(self):
+        """As refeições que o cliente vê: as do modelo, se o plano ainda aponta para um, senão as próprias."""
+        return self.modelo.refeicoes.all() if self.modelo_id else self.refeicoes.all()
  
 class Refeicao(models.Model):
-    plano_alimentar = models.ForeignKey(PlanoAlimentar, on_delete=models.CASCADE, related_name='refeicoes')
+    # Pertence a um plano ou a um modelo de plano, nunca aos dois
+    plano_alimentar = models.ForeignKey(PlanoAlimentar, on_delete=models.CASCADE, related_name='refeicoes', null=True, blank=True)
+    modelo = models.ForeignKey(ModeloPlano, on_delete=models.CASCADE, related_name='refeicoes', null=True, blank=True)
     nome = models.CharField(max_length=100)
     alimentos = models.TextField()
     quantidades = models.CharField(max_length=255)
     calorias = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(plano_alimentar__isnull=False, modelo__isnull=True) | models.Q(plano_alimentar__isnull=True, modelo__isnull=False),
+                name='refeicao_de_plano_ou_modelo',
+            ),
+        ]
  
     def __str__(self):
-        return f"{self.nome} - {self.plano_alimentar}"
+        return f"{self.nome} - {self.plano_alimentar or self.modelo}"
+
+    def clean(self):
+        if (self.plano_alimentar_id is None) == (self.modelo_id is None):
+            raise ValidationError('A refeição deve pertencer a um plano alimentar ou a um modelo de plano.')
+
+class Alimento(models.Model):
+    # Catálogo de referência (ex.: TACO). Nutrientes por 100 g do alimento; a ordem de
+    # core.nutrientes.NUTRIENTES é a ordem das colunas do vetor usado nos cálculos.
+    codigo = models.CharField(max_length=20, unique=True, help_text="Código do alimento na tabela de origem")
+    fonte = models.CharField(max_length=20, default='TACO')
+    nome = models.CharField(max_length=255)
+    grupo = models.CharField(max_length=100, blank=True)
+    energia_kcal = models.FloatField(default=0)
+    proteina_g = models.FloatField(default=0)
+    carboidrato_g = models.FloatField(default=0)
+    lipideos_g = models.FloatField(default=0)
+    fibra_g = models.FloatField(default=0)
+    calcio_mg = models.FloatField(default=0)
+    ferro_mg = models.FloatField(default=0)
+    sodio_mg = models.FloatField(default=0)
+    vitamina_c_mg = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['nome']
+
+    def __str__(self):
+        return self.nome
+
+class ItemRefeicao(models.Model):
+    refeicao = models.ForeignKey(Refeicao, on_delete=models.CASCADE, related_name='itens')
+    alimento = models.ForeignKey(Alimento, on_delete=models.PROTECT, related_name='itens')
+    quantidade_g = models.FloatField(help_text="Quantidade em gramas")
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(quantidade_g__gt=0), name='item_refeicao_quantidade_positiva'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantidade_g:g} g de {self.alimento}"
  
\ No newline at end of file
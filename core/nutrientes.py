@@ -0,0 +1,123 @@
+"""Totais de nutrientes dos planos alimentares, calculados em lote com NumPy.
+
+Cada item de refeição vira uma linha de uma matriz (itens x nutrientes) com os
+valores por 100 g do alimento; multiplicada pela quantidade/100 de cada item e
+somada por refeição e por plano, dá todos os totais de uma vez, sem laço Python
+por item. O resultado fica em cache por plano, numa chave com a versão do plano
+(PlanoAlimentar.versao, incrementada pelos sinais quando os itens mudam) e a
+versão do catálogo de alimentos (trocada quando um Alimento muda ou é importado).
+"""
+import time as relogio
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+
+from .models import ItemRefeicao, PlanoAlimentar
+
+
+# (campo de Alimento, rótulo) na ordem das colunas da matriz de nutrientes
+NUTRIENTES = (
+    ('energia_kcal', 'Energia (kcal)'),
+    ('proteina_g', 'Proteína (g)'),
+    ('carboidrato_g', 'Carboidrato (g)'),
+    ('lipideos_g', 'Lipídeos (g)'),
+    ('fibra_g', 'Fibra (g)'),
+    ('calcio_mg', 'Cálcio (mg)'),
+    ('ferro_mg', 'Ferro (mg)'),
+    ('sodio_mg', 'Sódio (mg)'),
+    ('vitamina_c_mg', 'Vitamina C (mg)'),
+)
+CAMPOS_NUTRIENTES = tuple(campo for campo, _ in NUTRIENTES)
+CHAVE_VERSAO_CATALOGO = 'nutrientes:versao:catalogo'
+
+
+def versao_catalogo():
+    versao = cache.get(CHAVE_VERSAO_CATALOGO)
+    if versao is None:
+        # Versão inicial do relógio: se a chave for despejada, não volta a um número já usado
+        cache.add(CHAVE_VERSAO_CATALOGO, relogio.time_ns() // 1000, None)
+        versao = cache.get(CHAVE_VERSAO_CATALOGO)
+    return versao
+
+
+def _trocar_versao_catalogo():
+    try:
+        cache.incr(CHAVE_VERSAO_CATALOGO)
+    except ValueError:
+        cache.set(CHAVE_VERSAO_CATALOGO, relogio.time_ns() // 1000, None)
+
+
+def invalidar_catalogo():
+    """Descarta os totais em cache de todos os planos (um alimento do catálogo mudou)."""
+    _trocar_versao_catalogo()
+    transaction.on_commit(_trocar_versao_catalogo)
+
+
+def invalidar_plano(refeicao_id):
+    """Incrementa a versão do plano da refeição (ou dos planos que usam o modelo dela): os totais em cache da versão anterior deixam de ser lidos."""
+    PlanoAlimentar.objects.filter(Q(refeicoes__id=refeicao_id) | Q(modelo__refeicoes__id=refeicao_id)).update(versao=F('versao') + 1)
+
+
+def _chave_totais(plano_id, versao_plano, catalogo):
+    return f'nutrientes:plano:{plano_id}:v{versao_plano}:c{catalogo}'
+
+
+def _como_dict(vetor):
+    return {campo: round(float(valor), 2) for campo, valor in zip(CAMPOS_NUTRIENTES, vetor)}
+
+
+def calcular_totais(planos_ids):
+    """{plano_id: {'total': {nutriente: valor}, 'refeicoes': {refeicao_id: {nutriente: valor}}}} com uma query.
+
+    Refeições sem itens não aparecem em 'refeicoes'; planos sem itens têm total zero. Os itens das
+    refeições de um modelo (core.modelos_plano) entram uma vez para cada plano que aponta para ele.
+    """
+    planos_ids = list(planos_ids)
+    linhas = list(
+        ItemRefeicao.objects.filter(Q(refeicao__plano_alimentar_id__in=planos_ids) | Q(refeicao__modelo__planos__id__in=planos_ids))
+        .annotate(plano_id=Coalesce('refeicao__plano_alimentar_id', 'refeicao__modelo__planos__id'))
+        .values_list('plano_id', 'refeicao_id', 'quantidade_g', *(f'alimento__{campo}' for campo in CAMPOS_NUTRIENTES))
+    )
+    resultado = {plano_id: {'total': _como_dict(np.zeros(len(CAMPOS_NUTRIENTES))), 'refeicoes': {}} for plano_id in planos_ids}
+    if not linhas:
+        return resultado
+
+    matriz = np.asarray(linhas, dtype=np.float64)
+    planos = matriz[:, 0].astype(np.int64); refeicoes = matriz[:, 1].astype(np.int64)
+    # Nutrientes de cada item: valores por 100 g x quantidade/100
+    valores = matriz[:, 3:] * (matriz[:, 2] / 100.0)[:, np.newaxis]
+
+    def somar_por(chaves):
+        unicos, grupo = np.unique(chaves, axis=0, return_inverse=True)
+        somas = np.zeros((len(unicos), valores.shape[1]))
+        np.add.at(somas, grupo.reshape(-1), valores)
+        return unicos.tolist(), somas
+
+    for plano_id, soma in zip(*somar_por(planos)):
+        resultado[plano_id]['total'] = _como_dict(soma)
+    # Por (plano, refeição): a refeição de um modelo aparece em vários planos
+    for (plano_id, refeicao_id), soma in zip(*somar_por(np.column_stack((planos, refeicoes)))):
+        resultado[plano_id]['refeicoes'][refeicao_id] = _como_dict(soma)
+    return resultado
+
+
+def totais_planos(planos):
+    """Totais de vários planos, do cache quando possível; os que faltam são calculados juntos."""
+    catalogo = versao_catalogo()
+    chaves = {plano.id: _chave_totais(plano.id, plano.versao, catalogo) for plano in planos}
+    em_cache = cache.get_many(list(chaves.values()))
+    totais = {plano_id: em_cache[chave] for plano_id, chave in chaves.items() if chave in em_cache}
+    faltando = [plano_id for plano_id in chaves if plano_id not in totais]
+    if faltando:
+        calculados = calcular_totais(faltando)
+        cache.set_many({chaves[plano_id]: calculados[plano_id] for plano_id in faltando}, getattr(settings, 'NUTRIENTES_CACHE_TIMEOUT', 60 * 60))
+        totais.update(calculados)
+    return totais
+
+
+def totais_plano(plano):
+    return totais_planos([plano])[plano.id]
@@ -0,0 +1,77 @@
+import base64
+import json
+from datetime import datetime, time
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+TAMANHO_PAGINA = 20
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+class _CodificadorCursor(DjangoJSONEncoder):
+    # O DjangoJSONEncoder corta datetime/time em milissegundos: linhas que diferem só nos microssegundos
+    # seriam puladas ou repetidas entre as páginas
+    def default(self, o):
+        if isinstance(o, (datetime, time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def codificar_cursor(valores):
+    dados = json.dumps(list(valores), cls=_CodificadorCursor, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, model, campos):
+    """Valores do cursor convertidos pelos campos de `model` na ordenação `campos`; CursorInvalido se não servirem."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as erro:
+        raise CursorInvalido('Cursor inválido.') from erro
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        raise CursorInvalido('Cursor inválido.')
+    convertidos = []
+    for campo, valor in zip(campos, valores):
+        # Um valor bem formado mas do tipo errado só falharia ao avaliar o queryset (erro 500)
+        try:
+            convertido = model._meta.get_field(campo.lstrip('-')).to_python(valor)
+        except (ValidationError, TypeError) as erro:
+            raise CursorInvalido('Cursor inválido.') from erro
+        if convertido is None:
+            raise CursorInvalido('Cursor inválido.')
+        convertidos.append(convertido)
+    return convertidos
+
+
+def filtro_apos_cursor(campos, valores):
+    """Monta o filtro "linha depois de `valores`" para a ordenação `campos` (ex.: ('preco_consulta', 'id'))."""
+    filtro = Q()
+    for indice, campo in enumerate(campos):
+        nome = campo.lstrip('-'); operador = 'lt' if campo.startswith('-') else 'gt'
+        condicao = Q(**{f'{nome}__{operador}': valores[indice]})
+        for anterior, valor in zip(campos[:indice], valores):
+            condicao &= Q(**{anterior.lstrip('-'): valor})
+        filtro |= condicao
+    return filtro
+
+
+def paginar_por_chave(queryset, campos, cursor=None, tamanho=TAMANHO_PAGINA):
+    """Paginação por chave (keyset): retorna (itens, próximo cursor ou None).
+
+    O último campo de `campos` precisa ser único (normalmente o id) para a
+    ordenação ser estável. Cada página custa o mesmo, não importa a profundidade.
+    """
+    if cursor:
+        queryset = queryset.filter(filtro_apos_cursor(campos, decodificar_cursor(cursor, queryset.model, campos)))
+    itens = list(queryset.order_by(*campos)[:tamanho + 1])
+    proximo_cursor = None
+    if len(itens) > tamanho:
+        itens = itens[:tamanho]
+        proximo_cursor = codificar_cursor(getattr(itens[-1], campo.lstrip('-')) for campo in campos)
+    return itens, proximo_cursor
@@ -0,0 +1,140 @@
+"""Leituras em réplicas do Postgres, escritas no primário.
+
+REPLICAS_LEITURA lista os aliases de DATABASES que recebem as leituras; vazio
+(o padrão), tudo vai para o 'default' como antes. Como a réplica pode estar
+alguns instantes atrás do primário, as leituras voltam para o primário quando:
+  - a mesma requisição (ou comando) já escreveu algo;
+  - há uma transação aberta no primário (o que foi escrito nela só existe lá);
+  - o navegador traz o cookie de fixação, gravado pelo ReplicaLeituraMiddleware
+    depois de uma escrita do usuário e válido por REPLICA_FIXACAO_SEGUNDOS
+    (ex.: a lista de consultas logo após agendar_consulta);
+  - o código pede explicitamente com `ler_do_primario()`, como fazem os caches
+    invalidados por sinais: recalculados a partir de uma réplica atrasada, eles
+    guardariam o estado antigo até a próxima invalidação.
+Sessões são lidas sempre do primário e gravá-las não fixa o usuário no primário.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+APPS_SEMPRE_NO_PRIMARIO = {'sessions'}
+
+
+class EstadoLeitura:
+    # Mutável de propósito: as views async rodam em threads com cópia do contexto, e
+    # uma escrita feita lá precisa chegar ao middleware que criou o estado
+    __slots__ = ('fixado', 'escreveu', 'replica')
+
+    def __init__(self, fixado=False):
+        self.fixado = fixado
+        self.escreveu = False
+        self.replica = None
+
+
+_estado = ContextVar('estado_leitura', default=None)
+
+
+def _estado_atual():
+    estado = _estado.get()
+    if estado is None:
+        # Fora de uma requisição (comandos, threads próprias): um estado por contexto
+        estado = EstadoLeitura()
+        _estado.set(estado)
+    return estado
+
+
+def replicas_leitura():
+    return getattr(settings, 'REPLICAS_LEITURA', ())
+
+
+@contextmanager
+def ler_do_primario():
+    """Manda ao primário as leituras feitas dentro do bloco."""
+    estado = _estado_atual()
+    fixado = estado.fixado
+    estado.fixado = True
+    try:
+        yield
+    finally:
+        estado.fixado = fixado
+
+
+class RoteadorReplicas:
+    def db_for_read(self, model, **hints):
+        replicas = replicas_leitura()
+        if not replicas or model._meta.app_label in APPS_SEMPRE_NO_PRIMARIO:
+            return DEFAULT_DB_ALIAS
+        estado = _estado_atual()
+        if estado.fixado or estado.escreveu or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # Uma réplica só por requisição: réplicas com atrasos diferentes dariam leituras que "voltam no tempo"
+        if estado.replica not in replicas:
+            estado.replica = random.choice(replicas)
+        return estado.replica
+
+    def db_for_write(self, model, **hints):
+        if replicas_leitura() and model._meta.app_label not in APPS_SEMPRE_NO_PRIMARIO:
+            _estado_atual().escreveu = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados: objetos lidos de qualquer um podem se relacionar
+        bancos = {DEFAULT_DB_ALIAS, *replicas_leitura()}
+        if obj1._state.db in bancos and obj2._state.db in bancos:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # O esquema chega às réplicas pela replicação
+        return False if db in replicas_leitura() else None
+
+
+class ReplicaLeituraMiddleware:
+    """Cria o estado de roteamento da requisição e cuida do cookie de fixação no primário.
+
+    Síncrono e assíncrono, como o MiddlewareMixin do Django: sob ASGI a cadeia segue
+    async e o long-poll de eventos não prende a thread compartilhada das views síncronas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas_leitura():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.cookie = getattr(settings, 'REPLICA_FIXACAO_COOKIE', 'ler_primario')
+        self.segundos = getattr(settings, 'REPLICA_FIXACAO_SEGUNDOS', 5)
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        estado = EstadoLeitura(fixado=self.cookie in request.COOKIES)
+        token = _estado.set(estado)
+        try:
+            response = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self._fixar(estado, response)
+
+    async def __acall__(self, request):
+        # O estado vai junto para as threads das views (sync_to_async copia o contexto)
+        estado = EstadoLeitura(fixado=self.cookie in request.COOKIES)
+        token = _estado.set(estado)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self._fixar(estado, response)
+
+    def _fixar(self, estado, response):
+        if estado.escreveu:
+            response.set_cookie(self.cookie, '1', max_age=self.segundos, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,233 @@
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import calendario, conexoes, dashboard, disponibilidade, eventos, metricas, modelos_plano, nutrientes
+from .backends import invalidar_usuario
+from .models import (
+    Alimento, Cliente, Consulta, ExcecaoAgenda, ItemRefeicao, JanelaAtendimento, Nutricionista, PlanoAlimentar, Refeicao, TokenCalendario, User
+)
+
+
+# --- INVALIDAÇÃO DO CACHE DE DISPONIBILIDADE ---
+# Observação: QuerySet.update() e bulk_create() não disparam sinais; código que
+# altera consultas em lote deve chamar disponibilidade.invalidar_dia() (e
+# eventos.publicar_agenda()) por conta própria.
+
+def _dia_local(data_horario):
+    return timezone.localtime(data_horario, timezone.get_default_timezone()).date()
+
+
+@receiver(post_init, sender=Consulta)
+def guardar_estado_consulta(sender, instance, **kwargs):
+    # Lê de __dict__ para não disparar consultas em instâncias com campos adiados (.only/.defer)
+    campos = instance.__dict__
+    instance._agenda_original = (campos.get('nutricionista_id'), campos.get('data_horario'), campos.get('status'))
+
+
+@receiver(post_save, sender=Consulta)
+def invalidar_disponibilidade_consulta(sender, instance, created, **kwargs):
+    atual = (instance.nutricionista_id, instance.data_horario, instance.status)
+    original = instance._agenda_original
+    if created or atual != original:
+        disponibilidade.invalidar_dia(instance.nutricionista_id, _dia_local(instance.data_horario))
+        if not created and original[1] and original[:2] != atual[:2]:
+            disponibilidade.invalidar_dia(original[0], _dia_local(original[1]))
+        publicar_eventos_consulta((None, None, None) if created else original, instance)
+    instance._agenda_original = atual
+
+
+@receiver(post_delete, sender=Consulta)
+def invalidar_disponibilidade_consulta_removida(sender, instance, **kwargs):
+    disponibilidade.invalidar_dia(instance.nutricionista_id, _dia_local(instance.data_horario))
+    if instance.status == Consulta.StatusChoices.CONFIRMADO:
+        eventos.publicar_agenda(instance.nutricionista_id, eventos.LIBERADO, instance.data_horario, instance.duracao)
+
+
+@receiver(post_init, sender=Nutricionista)
+def guardar_agenda_nutricionista(sender, instance, **kwargs):
+    instance._agenda_original = instance.__dict__.get('duracao_consulta')
+
+
+@receiver(post_save, sender=Nutricionista)
+def invalidar_agenda_nutricionista(sender, instance, created, **kwargs):
+    if not created and instance.duracao_consulta != instance._agenda_original:
+        disponibilidade.invalidar_agenda(instance.id)
+    instance._agenda_original = instance.duracao_consulta
+
+
+@receiver(post_save, sender=JanelaAtendimento)
+@receiver(post_delete, sender=JanelaAtendimento)
+@receiver(post_save, sender=ExcecaoAgenda)
+@receiver(post_delete, sender=ExcecaoAgenda)
+def invalidar_agenda_janelas(sender, instance, **kwargs):
+    disponibilidade.invalidar_agenda(instance.nutricionista_id)
+
+
+# --- EVENTOS DE AGENDA (horário ocupado/liberado) PARA AS PÁGINAS ABERTAS ---
+
+def publicar_eventos_consulta(original, instance):
+    confirmado = Consulta.StatusChoices.CONFIRMADO
+    nutricionista_id, data_horario, status = original
+    mudou_horario = (nutricionista_id, data_horario) != (instance.nutricionista_id, instance.data_horario)
+    if status == confirmado and data_horario and (instance.status != confirmado or mudou_horario):
+        eventos.publicar_agenda(nutricionista_id, eventos.LIBERADO, data_horario, instance.duracao)
+    if instance.status == confirmado and (status != confirmado or mudou_horario):
+        eventos.publicar_agenda(instance.nutricionista_id, eventos.OCUPADO, instance.data_horario, instance.duracao)
+
+
+# --- INVALIDAÇÃO DO CACHE DO DASHBOARD DO CLIENTE ---
+
+@receiver(post_save, sender=Consulta)
+@receiver(post_delete, sender=Consulta)
+@receiver(post_save, sender=PlanoAlimentar)
+@receiver(post_delete, sender=PlanoAlimentar)
+def invalidar_dashboard_por_cliente(sender, instance, **kwargs):
+    dashboard.invalidar_dashboard_cliente(instance.cliente_id)
+
+
+@receiver(post_save, sender=Refeicao)
+@receiver(post_delete, sender=Refeicao)
+def invalidar_dashboard_refeicao(sender, instance, **kwargs):
+    if instance.modelo_id:
+        # Refeição de um modelo: vale para todos os planos que ainda apontam para ele
+        modelos_plano.invalidar_planos_do_modelo(instance.modelo_id)
+        return
+    if Refeicao.plano_alimentar.is_cached(instance):
+        cliente_id = instance.plano_alimentar.cliente_id
+    else:
+        cliente_id = PlanoAlimentar.objects.filter(id=instance.plano_alimentar_id).values_list('cliente_id', flat=True).first()
+    if cliente_id:
+        dashboard.invalidar_dashboard_cliente(cliente_id)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_delete, sender=Cliente)
+def invalidar_dashboard_do_cliente(sender, instance, **kwargs):
+    dashboard.invalidar_dashboard_cliente(instance.id)
+
+
+@receiver(post_save, sender=Nutricionista)
+def invalidar_dashboards_do_nutricionista(sender, instance, created, **kwargs):
+    if not created:
+        dashboard.invalidar_dashboard_nutricionista(instance.usuario_id)
+
+
+@receiver(post_save, sender=User)
+def invalidar_dashboards_do_usuario_nutricionista(sender, instance, created, update_fields=None, **kwargs):
+    # O login grava só last_login; só nome/dados de um nutricionista interessam aos dashboards
+    if created or instance.user_type != User.UserType.NUTRICIONISTA or update_fields == frozenset({'last_login'}):
+        return
+    dashboard.invalidar_dashboard_nutricionista(instance.id)
+
+
+# --- INVALIDAÇÃO DO USUÁRIO EM CACHE (core.backends.PerfilModelBackend) ---
+
+@receiver(post_save, sender=User)
+def invalidar_usuario_salvo(sender, instance, created, update_fields=None, **kwargs):
+    # O last_login gravado no login não muda nada do que as páginas leem do usuário em cache
+    if not created and update_fields != frozenset({'last_login'}):
+        invalidar_usuario(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def invalidar_usuario_removido(sender, instance, **kwargs):
+    invalidar_usuario(instance.id)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_delete, sender=Cliente)
+@receiver(post_save, sender=Nutricionista)
+@receiver(post_delete, sender=Nutricionista)
+@receiver(post_save, sender=TokenCalendario)
+@receiver(post_delete, sender=TokenCalendario)
+def invalidar_usuario_do_perfil(sender, instance, **kwargs):
+    invalidar_usuario(instance.usuario_id)
+
+
+# --- TOKEN DO FEED DE CALENDÁRIO (core.calendario) ---
+
+@receiver(post_save, sender=User)
+def criar_token_calendario(sender, instance, created, raw=False, **kwargs):
+    # Criado no cadastro: as páginas que mostram o link não precisam gravar nada num GET
+    if created and not raw:
+        TokenCalendario.objects.create(usuario=instance)
+
+
+@receiver(post_delete, sender=Consulta)
+def marcar_feeds_consulta_removida(sender, instance, **kwargs):
+    # Uma consulta apagada some do feed sem deixar um atualizado_em maior para trás
+    calendario.marcar_feeds_alterados(User.objects.filter(
+        Q(perfil_cliente__id=instance.cliente_id) | Q(perfil_nutricionista__id=instance.nutricionista_id)
+    ))
+
+
+@receiver(post_save, sender=User)
+def marcar_feeds_usuario_renomeado(sender, instance, created, update_fields=None, **kwargs):
+    # O nome do usuário aparece no SUMMARY dos eventos nos feeds de quem tem consultas com ele
+    if created or (update_fields is not None and not update_fields & {'first_name', 'last_name', 'username'}):
+        return
+    calendario.marcar_feeds_alterados(User.objects.filter(
+        Q(perfil_cliente__consulta__nutricionista__usuario=instance) | Q(perfil_nutricionista__consulta__cliente__usuario=instance)
+    ))
+
+
+# --- INVALIDAÇÃO DOS TOTAIS DE NUTRIENTES (core.nutrientes) ---
+# bulk_create/update de itens não disparam sinais: quem altera itens em lote chama nutrientes.invalidar_plano()
+
+@receiver(post_save, sender=ItemRefeicao)
+@receiver(post_delete, sender=ItemRefeicao)
+def invalidar_nutrientes_item(sender, instance, **kwargs):
+    nutrientes.invalidar_plano(instance.refeicao_id)
+
+
+@receiver(post_save, sender=Alimento)
+@receiver(post_delete, sender=Alimento)
+def invalidar_nutrientes_alimento(sender, instance, created=False, **kwargs):
+    # Um alimento novo ainda não está em nenhum plano
+    if not created:
+        nutrientes.invalidar_catalogo()
+
+
+# --- MÉTRICAS DO DASHBOARD DO NUTRICIONISTA (core.metricas) ---
+# update()/bulk_create() de consultas não passam por aqui: chame metricas.registrar_mudanca() ou rode reconciliar_metricas
+
+@receiver(post_init, sender=Consulta)
+def guardar_metricas_consulta(sender, instance, **kwargs):
+    instance._metricas_original = metricas.estado_consulta(instance)
+
+
+@receiver(pre_save, sender=Consulta)
+def completar_metricas_consulta(sender, instance, **kwargs):
+    # Instância com campos adiados: o estado anterior vem do banco, uma query só neste caso
+    original = instance._metricas_original
+    if instance.pk and not instance._state.adding and not metricas.estado_completo(original):
+        instance._metricas_original = Consulta.objects.filter(pk=instance.pk).values_list(*metricas.CAMPOS_CONSULTA).first()
+
+
+@receiver(post_save, sender=Consulta)
+def atualizar_metricas_consulta(sender, instance, created, **kwargs):
+    original = None if created else instance._metricas_original
+    # Campos adiados não são gravados: continuam com o valor anterior
+    atual = tuple(
+        anterior if valor is metricas.ADIADO else valor
+        for valor, anterior in zip(metricas.estado_consulta(instance), original or (None,) * len(metricas.CAMPOS_CONSULTA))
+    )
+    metricas.registrar_mudanca(original, atual)
+    instance._metricas_original = atual
+
+
+@receiver(post_delete, sender=Consulta)
+def atualizar_metricas_consulta_removida(sender, instance, **kwargs):
+    if metricas.estado_completo(instance._metricas_original):
+        metricas.registrar_mudanca(instance._metricas_original, None)
+
+
+# --- CONEXÕES COM O BANCO (core.conexoes) ---
+# Ligados depois do close_old_connections do Django: a verificação só vê as conexões que ele manteve
+
+connection_created.connect(conexoes.registrar_conexao, dispatch_uid='core.conexoes.registrar_conexao')
+request_started.connect(conexoes.verificar_conexoes_persistentes, dispatch_uid='core.conexoes.verificar_conexoes_persistentes')
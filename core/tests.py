@@ -1,3 +1,1336 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import pickle
+import runpy
+import sys
+import tempfile
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.contrib.sessions.models import Session
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from config.urls import urlpatterns as rotas_projeto
+from . import disponibilidade, eventos, gerador_planos, jobs, metricas, modelos_plano, nutrientes
+from .benchmark import CENARIOS, Benchmark, BenchmarkConcorrencia, BenchmarkConexoes, comparar_com_baseline, percentil
+from .backends import PerfilModelBackend
+from .conexoes import contar_conexoes, verificar_conexoes_persistentes
+from .dados_sinteticos import GeradorDadosSinteticos
+from .dashboard import dados_dashboard_cliente
+from .agendamento import ResultadoAgendamento, limpar_reservas_expiradas, reservar_consulta, segurar_horario
+from .middleware import ColetorSQL
+from .paginacao import codificar_cursor, paginar_por_chave
+from .replicas import ReplicaLeituraMiddleware, ler_do_primario
+from .urls import rotas_eventos
+from .models import User, Nutricionista, Cliente, Consulta, JanelaAtendimento, ExcecaoAgenda, Especialidade, ReservaHorario, PlanoAlimentar, Refeicao, Alimento, ItemRefeicao, ModeloPlano, MetricaDiariaNutricionista, MetricaClienteNutricionista, Notificacao, TokenCalendario
+
+
+JANELAS_SEMANA = [(dia, time(8), time(12)) for dia in range(5)]
+
+
+def criar_nutricionista(email='nutri@teste.com', **kwargs):
+    usuario = User.objects.create_user(username=email, email=email, password=None, first_name='Ana', user_type=User.UserType.NUTRICIONISTA)
+    dados = {'preco_consulta': 150, 'duracao_consulta': 60, 'is_approved': True}
+    dados.update(kwargs)
+    nutri = Nutricionista.objects.create(usuario=usuario, **dados)
+    JanelaAtendimento.objects.bulk_create(JanelaAtendimento(nutricionista=nutri, dia_semana=dia, hora_inicio=inicio, hora_fim=fim) for dia, inicio, fim in JANELAS_SEMANA)
+    return nutri
+
+
+def criar_cliente(email='cliente@teste.com'):
+    usuario = User.objects.create_user(username=email, email=email, password=None, first_name='Bia')
+    return Cliente.objects.create(usuario=usuario, peso=70, altura=1.7, idade=30, objetivos='EMAGRECIMENTO')
+
+
+def proxima_segunda():
+    hoje = timezone.localdate()
+    return hoje + timedelta(days=7 - hoje.weekday())
+
+
+def local(data, hora):
+    return timezone.make_aware(datetime.combine(data, hora), timezone.get_default_timezone())
+
+
+class ApiHorariosDisponiveisTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.url = reverse('api_horarios_disponiveis')
+        self.segunda = proxima_segunda()
+
+    def test_dia_unico_exclui_horarios_confirmados(self):
+        Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(self.segunda, time(9)), modalidade='ONLINE')
+        resposta = self.client.get(self.url, {'nutri_id': self.nutri.id, 'data': self.segunda.isoformat()})
+        self.assertEqual([h['display'] for h in resposta.json()['horarios']], ['08:00', '10:00', '11:00'])
+
+    def test_intervalo_usa_uma_consulta_para_todos_os_dias(self):
+        Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(self.segunda + timedelta(days=1), time(8)), modalidade='ONLINE')
+        fim = self.segunda + timedelta(days=29)
+        # sessão + usuário com perfis + nutricionista + janelas + exceções + consultas + reservas do intervalo
+        with self.assertNumQueries(7):
+            resposta = self.client.get(self.url, {'nutri_id': self.nutri.id, 'inicio': self.segunda.isoformat(), 'fim': fim.isoformat()})
+        dias = resposta.json()['dias']
+        self.assertEqual(len(dias), 30)
+        self.assertEqual(dias[self.segunda.isoformat()], ['08:00', '09:00', '10:00', '11:00'])
+        self.assertEqual(dias[(self.segunda + timedelta(days=1)).isoformat()], ['09:00', '10:00', '11:00'])
+        self.assertEqual(dias[(self.segunda + timedelta(days=5)).isoformat()], [])
+
+    def test_intervalo_acima_do_limite_e_rejeitado(self):
+        resposta = self.client.get(self.url, {'nutri_id': self.nutri.id, 'inicio': '2030-01-01', 'fim': '2030-03-15'})
+        self.assertEqual(resposta.status_code, 400)
+
+
+class CacheDisponibilidadeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.segunda = proxima_segunda()
+
+    def livres(self):
+        return [h.strftime('%H:%M') for h in disponibilidade.horarios_livres(self.nutri, self.segunda, self.segunda)[self.segunda]]
+
+    def test_segunda_leitura_so_consulta_as_reservas(self):
+        self.livres()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.livres(), ['08:00', '09:00', '10:00', '11:00'])
+        self.assertEqual(disponibilidade.estatisticas_cache(), {'acertos': 1, 'falhas': 1, 'taxa_acerto': 0.5})
+
+    def test_consulta_criada_e_cancelada_invalida_o_dia(self):
+        self.livres()
+        consulta = Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(self.segunda, time(10)), modalidade='ONLINE')
+        self.assertEqual(self.livres(), ['08:00', '09:00', '11:00'])
+        consulta.status = Consulta.StatusChoices.CANCELADO; consulta.save()
+        self.assertEqual(self.livres(), ['08:00', '09:00', '10:00', '11:00'])
+
+    def test_alterar_horarios_do_nutricionista_invalida_a_agenda(self):
+        self.livres()
+        disponibilidade.definir_janelas_semanais(self.nutri, [(0, time(14), time(16))])
+        self.assertEqual(self.livres(), ['14:00', '15:00'])
+        self.nutri.duracao_consulta = 30; self.nutri.save()
+        self.assertEqual(self.livres(), ['14:00', '14:30', '15:00', '15:30'])
+
+    def test_excecao_invalida_a_agenda(self):
+        self.livres()
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=self.segunda, motivo='Feriado')
+        self.assertEqual(self.livres(), [])
+
+
+class JanelasAtendimentoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.segunda = proxima_segunda()
+
+    def livres(self):
+        return [h.strftime('%H:%M') for h in disponibilidade.calcular_horarios_livres(self.nutri, self.segunda, self.segunda)[self.segunda]]
+
+    def test_pausa_e_janela_extra(self):
+        disponibilidade.definir_janelas_semanais(self.nutri, [(0, time(8), time(10)), (0, time(14), time(16))])
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=self.segunda, hora_inicio=time(9), hora_fim=time(9, 30))
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=self.segunda, hora_inicio=time(18), hora_fim=time(19), disponivel=True)
+        self.assertEqual(self.livres(), ['08:00', '14:00', '15:00', '18:00'])
+
+    def test_consulta_precisa_caber_na_janela(self):
+        self.nutri.duracao_consulta = 50
+        self.assertEqual(self.livres(), ['08:00', '08:50', '09:40', '10:30'])
+
+    def test_atendendo_em(self):
+        noturno = criar_nutricionista('noturno@teste.com')
+        disponibilidade.definir_janelas_semanais(noturno, [(1, time(17), time(21))])
+        self.assertEqual(list(Nutricionista.objects.atendendo_em(1, depois_de=time(18))), [noturno])
+        self.assertEqual(Nutricionista.objects.atendendo_em(1, antes_de=time(9)).count(), 1)
+
+
+class BuscaProximoHorarioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.segunda = proxima_segunda()
+        self.url = reverse('encontrar_nutricionista')
+
+    def buscar(self, **params):
+        params.setdefault('ordenar', 'proximo_horario'); params.setdefault('data_inicio', self.segunda.isoformat())
+        return self.client.get(self.url, params).context['nutricionistas']
+
+    def test_ordena_pelo_primeiro_horario_livre(self):
+        cheio = criar_nutricionista('cheio@teste.com')
+        livre = criar_nutricionista('livre@teste.com', preco_consulta=300)
+        for hora in (8, 9, 10, 11):
+            Consulta.objects.create(cliente=self.cliente, nutricionista=cheio, data_horario=local(self.segunda, time(hora)), modalidade='ONLINE')
+        resultado = self.buscar()
+        self.assertEqual([nutri.id for nutri in resultado], [livre.id, cheio.id])
+        self.assertEqual(resultado[1].proximo_horario, datetime.combine(self.segunda + timedelta(days=1), time(8)))
+        self.assertEqual([nutri.id for nutri in self.buscar(preco_max='200')], [cheio.id])
+
+    def test_numero_de_consultas_nao_cresce_com_os_candidatos(self):
+        criar_nutricionista('a@teste.com')
+        self.buscar()  # carrega o usuário e os perfis no cache
+        with self.assertNumQueries(8) as contexto:
+            self.buscar()
+        for indice in range(10):
+            criar_nutricionista(f'n{indice}@teste.com', atende_presencial=indice % 2 == 0)
+        with self.assertNumQueries(len(contexto.captured_queries)):
+            self.assertEqual(len(self.buscar()), 11)
+        self.assertEqual(len(self.buscar(modalidade='PRESENCIAL')), 6)
+
+
+class ListagemNutricionistasTests(TestCase):
+    def setUp(self):
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        especialidade = Especialidade.objects.create(nome='Esportiva')
+        for indice in range(25):
+            nutri = criar_nutricionista(f'n{indice}@teste.com', preco_consulta=100 + indice % 5)
+            nutri.especialidades.add(especialidade)
+
+    def test_paginas_cobrem_todos_sem_repetir_e_com_consultas_constantes(self):
+        url = reverse('api_nutricionistas'); vistos = []; cursor = None
+        while True:
+            # sessão + usuário (só na primeira página, depois vem do cache) + página + especialidades da página
+            with self.assertNumQueries(3 if cursor else 4):
+                dados = self.client.get(url, {'cursor': cursor} if cursor else {}).json()
+            vistos += [(Decimal(item['preco_consulta']), item['id']) for item in dados['resultados']]
+            cursor = dados['proximo_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(vistos), 25)
+        self.assertEqual(vistos, sorted(vistos))
+        self.assertEqual(dados['resultados'][0]['especialidades'], ['Esportiva'])
+
+    def test_pagina_html_tem_link_para_a_proxima(self):
+        resposta = self.client.get(reverse('encontrar_nutricionista'))
+        self.assertEqual(len(resposta.context['nutricionistas']), 20)
+        self.assertIn('cursor=', resposta.context['proxima_pagina'])
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get(reverse('api_nutricionistas'), {'cursor': 'xyz'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_nutricionistas'), {'cursor': codificar_cursor(['barato', 1])}).status_code, 400)
+
+
+class ReservaConsultaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.segunda = proxima_segunda()
+
+    def reservar(self, hora, cliente=None):
+        return reservar_consulta(cliente or self.cliente, self.nutri, local(self.segunda, hora), 'ONLINE')
+
+    def test_reserva_e_conflito_no_mesmo_horario(self):
+        self.assertTrue(self.reservar(time(9)).sucesso)
+        self.assertEqual(self.reservar(time(9)).erro, ResultadoAgendamento.HORARIO_OCUPADO)
+
+    def test_horario_fora_da_agenda(self):
+        self.assertEqual(self.reservar(time(13)).erro, ResultadoAgendamento.FORA_DA_AGENDA)
+        self.assertEqual(self.reservar(time(9, 30)).erro, ResultadoAgendamento.FORA_DA_AGENDA)
+
+    def test_sobreposicao_apos_mudanca_de_duracao(self):
+        self.nutri.duracao_consulta = 90; self.nutri.save()
+        self.assertTrue(self.reservar(time(8)).sucesso)
+        self.nutri.duracao_consulta = 60; self.nutri.save()
+        self.assertEqual(self.reservar(time(9)).erro, ResultadoAgendamento.HORARIO_OCUPADO)
+        self.assertTrue(self.reservar(time(10)).sucesso)
+        livres = disponibilidade.horarios_livres(self.nutri, self.segunda, self.segunda)[self.segunda]
+        self.assertEqual([h.strftime('%H:%M') for h in livres], ['11:00'])
+
+    def test_cancelamento_libera_o_horario(self):
+        consulta = self.reservar(time(9)).consulta
+        consulta.status = Consulta.StatusChoices.CANCELADO; consulta.save()
+        self.assertTrue(self.reservar(time(9)).sucesso)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ReservaConcorrenteTests(TransactionTestCase):
+    THREADS = 24
+    HORARIOS = (time(8), time(9), time(10), time(11))
+
+    def test_threads_disputando_os_mesmos_horarios_nao_geram_dupla_reserva(self):
+        cache.clear()
+        nutri = criar_nutricionista()
+        clientes = [criar_cliente(f'c{indice}@teste.com') for indice in range(self.THREADS)]
+        segunda = proxima_segunda()
+        largada = threading.Barrier(self.THREADS)
+        resultados = []
+
+        def disputar(cliente):
+            try:
+                largada.wait()
+                for hora in self.HORARIOS:
+                    resultados.append(reservar_consulta(cliente, nutri, local(segunda, hora), 'ONLINE'))
+            finally:
+                connection.close()
+
+        inicio = time_module.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(executor.map(disputar, clientes))
+        duracao = time_module.perf_counter() - inicio
+
+        self.assertEqual(len(resultados), self.THREADS * len(self.HORARIOS))
+        self.assertEqual(sum(resultado.sucesso for resultado in resultados), len(self.HORARIOS))
+        self.assertEqual(Consulta.objects.filter(nutricionista=nutri, status=Consulta.StatusChoices.CONFIRMADO).count(), len(self.HORARIOS))
+        sys.stderr.write(f"\n[reserva concorrente] {len(resultados)} tentativas em {duracao:.3f}s ({len(resultados) / duracao:.0f} tentativas/s)\n")
+
+
+class ReservaTemporariaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.outro = criar_cliente('outro@teste.com')
+        self.segunda = proxima_segunda()
+
+    def livres(self, cliente):
+        return [h.strftime('%H:%M') for h in disponibilidade.horarios_livres(self.nutri, self.segunda, self.segunda, cliente=cliente)[self.segunda]]
+
+    def test_reserva_esconde_o_horario_dos_outros_e_vira_consulta(self):
+        self.assertTrue(segurar_horario(self.cliente, self.nutri, local(self.segunda, time(9))).sucesso)
+        self.assertEqual(self.livres(self.outro), ['08:00', '10:00', '11:00'])
+        self.assertEqual(self.livres(self.cliente), ['08:00', '09:00', '10:00', '11:00'])
+        self.assertEqual(segurar_horario(self.outro, self.nutri, local(self.segunda, time(9))).erro, ResultadoAgendamento.HORARIO_RESERVADO)
+        self.assertEqual(reservar_consulta(self.outro, self.nutri, local(self.segunda, time(9)), 'ONLINE').erro, ResultadoAgendamento.HORARIO_RESERVADO)
+        self.assertTrue(reservar_consulta(self.cliente, self.nutri, local(self.segunda, time(9)), 'ONLINE').sucesso)
+        self.assertFalse(ReservaHorario.objects.exists())
+
+    def test_reserva_expirada_libera_o_horario(self):
+        segurar_horario(self.cliente, self.nutri, local(self.segunda, time(9)))
+        ReservaHorario.objects.update(expira_em=timezone.now() - timedelta(seconds=1))
+        self.assertIn('09:00', self.livres(self.outro))
+        self.assertTrue(segurar_horario(self.outro, self.nutri, local(self.segunda, time(9))).sucesso)
+        self.assertEqual(limpar_reservas_expiradas(), 0)
+
+    def test_reserva_bloqueia_horarios_que_se_sobrepoem(self):
+        self.assertTrue(segurar_horario(self.cliente, self.nutri, local(self.segunda, time(10))).sucesso)
+        self.nutri.duracao_consulta = 30; self.nutri.save()
+        self.assertEqual(segurar_horario(self.outro, self.nutri, local(self.segunda, time(10, 30))).erro, ResultadoAgendamento.HORARIO_RESERVADO)
+        self.assertEqual(reservar_consulta(self.outro, self.nutri, local(self.segunda, time(10, 30)), 'ONLINE').erro, ResultadoAgendamento.HORARIO_RESERVADO)
+        self.assertTrue(reservar_consulta(self.outro, self.nutri, local(self.segunda, time(9, 30)), 'ONLINE').sucesso)
+        self.assertTrue(reservar_consulta(self.outro, self.nutri, local(self.segunda, time(11)), 'ONLINE').sucesso)
+
+    def test_api_responde_conflito(self):
+        segurar_horario(self.cliente, self.nutri, local(self.segunda, time(9)))
+        self.client.force_login(self.outro.usuario)
+        resposta = self.client.post(reverse('api_reservar_horario'), {'nutri_id': self.nutri.id, 'data_horario': f'{self.segunda.isoformat()}T09:00:00'})
+        self.assertEqual(resposta.status_code, 409)
+        resposta = self.client.post(reverse('api_reservar_horario'), {'nutri_id': self.nutri.id, 'data_horario': f'{self.segunda.isoformat()}T10:00:00'})
+        self.assertEqual(resposta.status_code, 200)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN com enable_seqscan só é verificado no PostgreSQL')
+class PlanoDeExecucaoTests(TestCase):
+    """Roda as views quentes, captura o SQL sobre core_consulta e exige que o plano use índice.
+
+    Com enable_seqscan desligado o planejador só cai em "Seq Scan" quando não
+    existe índice utilizável, o que independe do volume de dados do teste. Uma
+    varredura de índice cuja condição não usa a primeira coluna do índice (o índice
+    inteiro é percorrido) também conta como falha.
+    """
+    TABELAS = ('core_consulta', 'core_reservahorario')
+
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.segunda = proxima_segunda()
+        Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(self.segunda, time(9)), modalidade='ONLINE')
+
+    def varreduras(self, no):
+        if no.get('Relation Name') in self.TABELAS:
+            yield no
+        for filho in no.get('Plans', ()):
+            yield from self.varreduras(filho)
+
+    def primeira_coluna(self, cursor, indice):
+        cursor.execute(
+            'SELECT a.attname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] WHERE c.relname = %s', [indice],
+        )
+        return cursor.fetchone()[0]
+
+    def assertSemSeqScan(self, requisicao):
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertLess(requisicao().status_code, 400)
+        verificadas = 0
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in capturadas.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or not any(f'FROM "{tabela}"' in sql for tabela in self.TABELAS):
+                    continue
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                plano = cursor.fetchone()[0]
+                plano = json.loads(plano) if isinstance(plano, str) else plano
+                for no in self.varreduras(plano[0]['Plan']):
+                    self.assertNotEqual(no['Node Type'], 'Seq Scan', sql)
+                    if no['Node Type'] in ('Index Scan', 'Index Only Scan'):
+                        coluna = self.primeira_coluna(cursor, no['Index Name'])
+                        self.assertIn(coluna, no.get('Index Cond', ''), f"{sql}\nvarredura completa de {no['Index Name']}")
+                verificadas += 1
+        self.assertGreater(verificadas, 0)
+
+    def test_dashboard_cliente(self):
+        self.assertSemSeqScan(lambda: self.client.get(reverse('dashboard_cliente')))
+
+    def test_consultas_cliente(self):
+        self.assertSemSeqScan(lambda: self.client.get(reverse('consultas_cliente')))
+
+    def test_api_horarios_disponiveis(self):
+        fim = self.segunda + timedelta(days=29)
+        self.assertSemSeqScan(lambda: self.client.get(reverse('api_horarios_disponiveis'), {'nutri_id': self.nutri.id, 'inicio': self.segunda.isoformat(), 'fim': fim.isoformat()}))
+
+    def test_busca_por_proximo_horario(self):
+        self.assertSemSeqScan(lambda: self.client.get(reverse('encontrar_nutricionista'), {'ordenar': 'proximo_horario'}))
+
+    def test_agendamento(self):
+        dados = {'modalidade': 'ONLINE', 'data_horario_selecionado': f'{self.segunda.isoformat()} 10:00:00'}
+        self.assertSemSeqScan(lambda: self.client.post(reverse('agendar_consulta', args=[self.nutri.id]), dados))
+
+
+class InstrumentacaoSQLTests(TestCase):
+    def setUp(self):
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+
+    @override_settings(SQL_INSTRUMENTACAO=True)
+    def test_cabecalhos_com_o_numero_de_consultas(self):
+        with CaptureQueriesContext(connection) as capturadas, self.assertLogs('core.sql', 'INFO') as logs:
+            resposta = self.client.get(reverse('selecionar_conta'))
+        self.assertEqual(resposta['X-SQL-Queries'], str(len(capturadas.captured_queries)))
+        self.assertEqual(resposta['X-SQL-Conexoes'], '0')  # a conexão do teste já estava aberta
+        self.assertEqual(json.loads(logs.records[0].getMessage())['caminho'], reverse('selecionar_conta'))
+
+    def test_desligada_nao_adiciona_cabecalhos(self):
+        self.assertNotIn('X-SQL-Queries', self.client.get(reverse('selecionar_conta')))
+
+    def test_detecta_n_mais_um(self):
+        nutris = [criar_nutricionista(f'n{indice}@teste.com') for indice in range(6)]
+        coletor = ColetorSQL()
+        with connection.execute_wrapper(coletor):
+            for nutri in nutris:
+                Nutricionista.objects.get(id=nutri.id)
+            Especialidade.objects.count()
+        suspeitas = coletor.suspeitas_n1(limite=5)
+        self.assertEqual(len(suspeitas), 1)
+        self.assertEqual(suspeitas[0]['vezes'], 6)
+
+
+class GeradorDadosSinteticosTests(TransactionTestCase):
+    # A carga commita lote a lote, como num banco real
+    def gerar(self, **kwargs):
+        opcoes = dict(seed=7, clientes=30, nutricionistas=4, consultas=200, planos=10, tamanho_lote=25, data_base=proxima_segunda())
+        opcoes.update(kwargs)
+        GeradorDadosSinteticos(**opcoes).gerar()
+
+    def test_volumes_e_agenda_respeitada(self):
+        self.gerar()
+        self.assertEqual(Cliente.objects.count(), 30)
+        self.assertEqual(Nutricionista.objects.count(), 4)
+        self.assertEqual(Consulta.objects.count(), 200)
+        self.assertEqual(PlanoAlimentar.objects.count(), 10)
+        self.assertEqual(TokenCalendario.objects.count(), User.objects.count())
+        for consulta in Consulta.objects.select_related('nutricionista'):
+            inicio = timezone.localtime(consulta.data_horario)
+            fim = inicio + timedelta(minutes=consulta.duracao)
+            self.assertTrue(consulta.nutricionista.janelas.filter(
+                dia_semana=inicio.weekday(), hora_inicio__lte=inicio.time(), hora_fim__gte=fim.time()
+            ).exists())
+
+    def test_mesma_semente_mesmos_dados(self):
+        def assinatura():
+            return [
+                (c.nutricionista.usuario.email, c.cliente.usuario.email, c.data_horario, c.status)
+                for c in Consulta.objects.select_related('nutricionista__usuario', 'cliente__usuario').order_by('id')
+            ]
+        self.gerar()
+        primeira = assinatura()
+        Consulta.objects.all().delete(); User.objects.all().delete()
+        self.gerar()
+        self.assertEqual(assinatura(), primeira)
+
+    def test_mesma_data_base_mesmos_dados_em_qualquer_hora(self):
+        def assinatura():
+            return list(Consulta.objects.order_by('id').values_list('data_horario', 'status', 'modalidade', 'cliente__usuario__email'))
+        data_base = proxima_segunda()
+        with mock.patch('django.utils.timezone.now', return_value=local(data_base, time(8))):
+            self.gerar(data_base=data_base)
+        primeira = assinatura()
+        Consulta.objects.all().delete(); User.objects.all().delete()
+        with mock.patch('django.utils.timezone.now', return_value=local(data_base + timedelta(days=3), time(18))):
+            self.gerar(data_base=data_base)
+        self.assertEqual(assinatura(), primeira)
+
+
+class BenchmarkTests(TestCase):
+    def test_percentil_interpolado(self):
+        self.assertEqual(percentil([10, 20, 30, 40, 50], 0.5), 30)
+        self.assertAlmostEqual(percentil([10, 20], 0.95), 19.5)
+
+    def test_regressao_de_queries_e_latencia(self):
+        baseline = {'cenarios': {'dashboard_cliente': {'queries_max': 8, 'p95_ms': 20.0, 'erros': 0}}}
+        igual = {'cenarios': {'dashboard_cliente': {'queries_max': 8, 'p95_ms': 26.0, 'erros': 0}}}
+        pior = {'cenarios': {'dashboard_cliente': {'queries_max': 9, 'p95_ms': 40.0, 'erros': 0}}}
+        self.assertEqual(comparar_com_baseline(igual, baseline), [])
+        self.assertEqual(len(comparar_com_baseline(pior, baseline)), 2)
+
+    def test_executa_cenarios(self):
+        GeradorDadosSinteticos(seed=1, clientes=10, nutricionistas=3, consultas=30, tamanho_lote=50).gerar()
+        Nutricionista.objects.update(is_approved=True)
+        cenarios = [cenario for cenario in CENARIOS if cenario != 'login_usuario']
+        resultado = Benchmark(iteracoes=3, aquecimento=1, usuarios=3, cenarios=cenarios).executar()
+        self.assertEqual(set(resultado['cenarios']), set(cenarios))
+        for metricas in resultado['cenarios'].values():
+            self.assertEqual(metricas['erros'], 0)
+            self.assertEqual(metricas['requisicoes'], 3)
+
+
+class RotasComEventos:
+    # ROOT_URLCONF dos testes do long-poll: a rota de eventos só é registrada com VIEWS_ASYNC
+    urlpatterns = rotas_projeto + rotas_eventos
+
+
+class ViewsAsyncTests(TransactionTestCase):
+    # As views async usam conexões das threads do pool, que não enxergam a transação de um TestCase
+    # Fora de transação as leituras podem ir às réplicas (DB_REPLICAS), que nos testes espelham o 'default'
+    databases = '__all__'
+
+    def setUp(self):
+        # Conexões por requisição: as threads do pool não podem segurar conexões com o banco de teste até o fim
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+        self.addCleanup(connection.settings_dict.__setitem__, 'CONN_MAX_AGE', max_age)
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.async_client.force_login(self.cliente.usuario)
+
+    def get_async(self, url):
+        async def requisitar():
+            return await self.async_client.get(url)
+        return async_to_sync(requisitar)()
+
+    def test_horarios_iguais_aos_da_view_sincrona(self):
+        inicio = proxima_segunda()
+        parametros = {'nutri_id': self.nutri.id, 'inicio': inicio.isoformat(), 'fim': (inicio + timedelta(days=6)).isoformat()}
+        # O AsyncClient do Django 3.2 ignora o dicionário de dados no GET: a query string vai na URL
+        resposta = self.get_async(reverse('api_horarios_disponiveis_async') + '?' + urlencode(parametros))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), self.client.get(reverse('api_horarios_disponiveis'), parametros).json())
+
+    def test_long_poll_so_com_views_async(self):
+        pagina = self.client.get(reverse('agendar_consulta', args=[self.nutri.id]))
+        self.assertNotContains(pagina, 'ouvirEventos')
+        self.assertEqual(self.client.get('/cliente/api/eventos-agenda/').status_code, 404)
+        with override_settings(VIEWS_ASYNC=True, EVENTOS_LONG_POLL=True, ROOT_URLCONF=RotasComEventos):
+            self.assertContains(self.client.get(reverse('agendar_consulta', args=[self.nutri.id])), reverse('api_eventos_agenda'))
+
+    def test_deploy_asgi_com_varios_workers_desliga_o_long_poll(self):
+        with mock.patch.dict(os.environ, {'WEB_WORKERS': '4', 'EVENTOS_BACKEND': 'core.eventos.BarramentoLocal'}), mock.patch('sys.stderr', io.StringIO()):
+            configuracao = runpy.run_path(str(settings.BASE_DIR / 'deploy' / 'gunicorn_asgi.py'))
+            self.assertEqual(os.environ['EVENTOS_LONG_POLL'], 'False')
+        self.assertEqual(configuracao['workers'], 4)
+
+    @override_settings(SQL_INSTRUMENTACAO=True)
+    def test_instrumentacao_mede_as_consultas_das_threads_do_pool(self):
+        with self.assertLogs('core.sql', 'INFO') as logs:
+            resposta = self.get_async(reverse('api_horarios_disponiveis_async') + f'?nutri_id={self.nutri.id}&inicio={proxima_segunda()}&fim={proxima_segunda()}')
+        registro = json.loads(logs.records[0].getMessage())
+        self.assertEqual(resposta.status_code, 200)
+        self.assertGreater(registro['queries'], 0)
+        self.assertEqual(resposta['X-SQL-Queries'], str(registro['queries']))
+
+    @override_settings(DEBUG=True, SQL_INSTRUMENTACAO=True, REPLICAS_LEITURA=['default'])
+    def test_cadeia_de_middleware_toda_async_sob_asgi(self):
+        # Com todos os middlewares opcionais ligados: um só síncrono serializaria as views async do worker
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            handler = ASGIHandler()
+            logging.getLogger('django.request').debug('middleware carregado')
+        self.assertEqual([linha for linha in logs.output if 'adapted' in linha], [])
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+
+    def test_perfil_exige_login(self):
+        self.async_client.logout()
+        self.assertEqual(self.get_async(reverse('perfil_cliente_async')).status_code, 302)
+
+    @override_settings(EVENTOS_LONG_POLL_TIMEOUT=5, VIEWS_ASYNC=True, EVENTOS_LONG_POLL=True, ROOT_URLCONF=RotasComEventos)
+    def test_long_poll_acorda_com_nova_consulta(self):
+        url = reverse('api_eventos_agenda') + f'?nutri_id={self.nutri.id}'
+        cursor = self.get_async(url).json()['ultimo']
+        segunda = proxima_segunda()
+        def criar_consulta():
+            Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(segunda, time(9)), modalidade='ONLINE')
+            connection.close()  # senão a conexão da thread só fecha no GC e pode segurar o banco de teste no teardown
+        publicar = threading.Timer(0.2, criar_consulta)
+        publicar.start()
+        inicio = time_module.perf_counter()
+        resposta = self.get_async(url + f'&desde={cursor}').json()
+        publicar.join()
+        self.assertLess(time_module.perf_counter() - inicio, 4)
+        self.assertEqual([(evento['tipo'], evento['data'], evento['inicio'], evento['fim']) for evento in resposta['eventos']], [('ocupado', segunda.isoformat(), '09:00', '10:00')])
+        self.assertEqual(resposta['ultimo'], cursor + 1)
+
+    @override_settings(EVENTOS_LONG_POLL_TIMEOUT=3, VIEWS_ASYNC=True, EVENTOS_LONG_POLL=True, ROOT_URLCONF=RotasComEventos, REPLICAS_LEITURA=['default'], SQL_INSTRUMENTACAO=True)
+    def test_long_poll_nao_segura_as_outras_requisicoes(self):
+        # Middleware síncrono na cadeia ASGI ocuparia a thread compartilhada durante todo o long-poll
+        url = reverse('api_eventos_agenda') + f'?nutri_id={self.nutri.id}'
+        cursor = self.get_async(url).json()['ultimo']
+
+        async def concorrentes():
+            espera = asyncio.ensure_future(self.async_client.get(url + f'&desde={cursor}'))
+            await asyncio.sleep(0.2)
+            inicio = time_module.perf_counter()
+            login = await self.async_client.get(reverse('login'))
+            duracao = time_module.perf_counter() - inicio
+            return login, duracao, await espera
+
+        # asyncio.run, como no uvicorn: sob async_to_sync a thread principal atenderia as chamadas aninhadas
+        login, duracao, espera = asyncio.run(concorrentes())
+        self.assertEqual((login.status_code, espera.status_code), (200, 200))
+        self.assertLess(duracao, 1)
+
+    def test_benchmark_wsgi_asgi(self):
+        resultado = BenchmarkConcorrencia(requisicoes=4, concorrencia=2, latencia_db_ms=0).executar()
+        for modos in resultado['endpoints'].values():
+            self.assertEqual(set(modos), set(BenchmarkConcorrencia.MODOS))
+            for metricas in modos.values():
+                self.assertEqual((metricas['requisicoes'], metricas['erros']), (4, 0))
+
+    def test_benchmark_conexoes(self):
+        resultado = BenchmarkConexoes(requisicoes=3).executar()
+        for modos in resultado['endpoints'].values():
+            self.assertEqual(modos['nova_por_requisicao']['conexoes_abertas'], 3)
+            self.assertLessEqual(modos['persistente']['conexoes_abertas'], 1)
+            self.assertFalse(any(metricas['erros'] for metricas in modos.values()))
+
+
+class ConexoesTests(TransactionTestCase):
+    # Fora de transação: a verificação ignora conexões com transação aberta
+    def test_conta_conexoes_abertas_no_bloco(self):
+        connection.close()
+        with contar_conexoes() as abertas:
+            User.objects.exists(); User.objects.exists()
+        self.assertEqual(abertas[0], 1)
+
+    # O receptor é chamado direto: o Client do Django desconecta e reconecta o close_old_connections do
+    # request_started, que passa a rodar depois do receptor e, com o get_autocommit, consumiria a marcação
+    def test_conexao_quebrada_e_trocada_no_primeiro_uso_da_requisicao(self):
+        connection.close(); User.objects.exists()
+        quebrada = connection.connection
+        quebrada.close()  # como se o servidor tivesse derrubado a conexão
+        with override_settings(DB_CONN_HEALTH_CHECKS=True):
+            verificar_conexoes_persistentes(sender=self.__class__)
+        self.assertIs(connection.connection, quebrada)  # o teste fica para o primeiro uso
+        self.assertFalse(User.objects.exists())
+        self.assertIsNot(connection.connection, quebrada)
+
+    def test_verificacao_so_no_primeiro_uso(self):
+        connection.close(); User.objects.exists()
+        with override_settings(DB_CONN_HEALTH_CHECKS=True), mock.patch.object(type(connections['default']), 'is_usable', return_value=True) as is_usable:
+            verificar_conexoes_persistentes(sender=self.__class__)
+            self.assertFalse(is_usable.called)
+            User.objects.exists(); User.objects.exists()
+        self.assertEqual(is_usable.call_count, 1)
+
+
+class EventosAgendaTests(TestCase):
+    def test_barramento_entrega_e_detecta_cursor_perdido(self):
+        barramento = eventos.BarramentoLocal(tamanho_historico=2)
+        for hora in ('08:00', '09:00', '10:00'):
+            barramento.publicar('agenda:1', {'inicio': hora})
+        novos, ultimo = async_to_sync(barramento.aguardar)('agenda:1', 1, timeout=0.1)
+        self.assertEqual(([evento['inicio'] for evento in novos], ultimo), (['09:00', '10:00'], 3))
+        self.assertEqual(async_to_sync(barramento.aguardar)('agenda:1', 0, timeout=0.1), (None, 3))
+        self.assertEqual(async_to_sync(barramento.aguardar)('agenda:1', 7, timeout=0.1), (None, 3))
+        self.assertEqual(async_to_sync(barramento.aguardar)('agenda:2', 0, timeout=0.05), ([], 0))
+
+    def test_consulta_publica_ocupado_e_liberado_apos_commit(self):
+        nutri = criar_nutricionista(); cliente = criar_cliente()
+        canal = eventos.canal_agenda(nutri.id); barramento = eventos.barramento()
+        antes = barramento.ultimo(canal)
+        with self.captureOnCommitCallbacks(execute=True):
+            consulta = Consulta.objects.create(cliente=cliente, nutricionista=nutri, data_horario=local(proxima_segunda(), time(9)), modalidade='ONLINE')
+        with self.captureOnCommitCallbacks(execute=True):
+            consulta.status = Consulta.StatusChoices.CANCELADO; consulta.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            consulta.delete()  # já cancelada: não libera de novo
+        novos, _ = async_to_sync(barramento.aguardar)(canal, antes, timeout=0.1)
+        self.assertEqual([evento['tipo'] for evento in novos], [eventos.OCUPADO, eventos.LIBERADO])
+
+
+class DashboardClienteCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.consulta = Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=local(proxima_segunda(), time(9)), modalidade='ONLINE')
+        self.plano = PlanoAlimentar.objects.create(cliente=self.cliente, nutricionista=self.nutri)
+        Refeicao.objects.create(plano_alimentar=self.plano, nome='Almoço', alimentos='Arroz, feijão', quantidades='100g, 80g')
+
+    def dashboard(self):
+        return self.client.get(reverse('dashboard_cliente')).context
+
+    def test_visita_repetida_nao_consulta_o_banco_para_o_payload(self):
+        self.dashboard()
+        with CaptureQueriesContext(connection) as capturadas:
+            contexto = self.dashboard()
+        self.assertFalse([q for q in capturadas.captured_queries if 'core_consulta' in q['sql'] or 'core_refeicao' in q['sql'] or 'core_planoalimentar' in q['sql']])
+        self.assertEqual(contexto['proxima_consulta'], self.consulta)
+        self.assertEqual(set(contexto['refeicoes']), {'almoco'})
+
+    def test_cache_nao_guarda_a_senha_do_nutricionista(self):
+        self.dashboard()
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get(reverse('dashboard_cliente'))
+        self.assertContains(resposta, 'Dr(a). Ana')
+        self.assertContains(resposta, 'R$ 150')
+        self.assertFalse([q for q in capturadas.captured_queries if 'core_nutricionista' in q['sql']])  # nenhum campo adiado lido
+        usuario = resposta.context['proxima_consulta'].nutricionista.usuario
+        self.assertNotIn('password', usuario.__dict__)
+        self.assertNotIn(self.nutri.usuario.password.encode(), pickle.dumps(dados_dashboard_cliente(self.cliente)))
+
+    def test_sinais_invalidam(self):
+        self.dashboard()
+        Refeicao.objects.create(plano_alimentar=self.plano, nome='Jantar', alimentos='Sopa', quantidades='300ml')
+        self.assertEqual(set(self.dashboard()['refeicoes']), {'almoco', 'jantar'})
+        antes = Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=self.consulta.data_horario - timedelta(hours=1), modalidade='ONLINE')
+        self.assertEqual(self.dashboard()['proxima_consulta'], antes)
+        self.nutri.preco_consulta = Decimal('321.00'); self.nutri.save()
+        self.assertEqual(self.dashboard()['proxima_consulta'].nutricionista.preco_consulta, Decimal('321.00'))
+
+    def test_proxima_consulta_vencida_e_recalculada(self):
+        dados_dashboard_cliente(self.cliente)
+        depois = self.consulta.data_horario + timedelta(minutes=1)
+        self.assertIsNone(dados_dashboard_cliente(self.cliente, agora=depois)['proxima_consulta'])
+
+
+class PerfilModelBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cliente = criar_cliente()
+        self.cliente.usuario.set_password('segredo123'); self.cliente.usuario.save()
+
+    def test_login_carrega_perfis_e_redireciona(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.post(reverse('login'), {'username': 'cliente@teste.com', 'password': 'segredo123'})
+        self.assertRedirects(resposta, reverse('dashboard_cliente'), fetch_redirect_response=False)
+        self.assertFalse([q for q in capturadas.captured_queries if q['sql'].startswith('SELECT') and 'FROM "core_cliente"' in q['sql']])
+
+    def test_senha_errada_nao_autentica(self):
+        resposta = self.client.post(reverse('login'), {'username': 'cliente@teste.com', 'password': 'errada'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_usuario_em_cache_ate_o_perfil_mudar(self):
+        self.client.force_login(self.cliente.usuario)
+        perfil = lambda: self.client.get(reverse('perfil_cliente'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        perfil()
+        # Só a sessão: usuário e perfil vêm do cache
+        with self.assertNumQueries(1):
+            perfil()
+        self.cliente.peso = 65; self.cliente.save()
+        self.assertEqual(perfil().json()['peso'], 65)
+        self.cliente.usuario.is_active = False; self.cliente.usuario.save()
+        self.assertEqual(perfil().status_code, 302)
+
+    def test_cache_nao_guarda_a_senha(self):
+        backend = PerfilModelBackend()
+        backend.get_user(self.cliente.usuario.id)
+        self.assertNotIn(self.cliente.usuario.password, repr(cache.get(f'auth:usuario:{self.cliente.usuario.id}')))
+        with self.assertNumQueries(0):
+            usuario = backend.get_user(self.cliente.usuario.id)
+            self.assertEqual((usuario.perfil_cliente.peso, usuario.perfil_cliente.usuario.email), (self.cliente.peso, 'cliente@teste.com'))
+            self.assertFalse(hasattr(usuario, 'perfil_nutricionista'))
+            self.assertEqual(usuario.get_session_auth_hash(), self.cliente.usuario.get_session_auth_hash())
+        usuario.first_name = 'Beatriz'; usuario.save()  # a senha adiada não é gravada
+        self.assertTrue(User.objects.get(pk=usuario.pk).check_password('segredo123'))
+
+
+class HistoricoConsultasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cliente = criar_cliente()
+        self.client.force_login(self.cliente.usuario)
+        self.url = reverse('api_consultas_cliente')
+        agora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        nutris = [criar_nutricionista(f'n{indice}@teste.com') for indice in range(3)]
+        # 25 futuras e 30 passadas; horários repetidos entre nutricionistas exercitam o desempate pelo id
+        Consulta.objects.bulk_create(
+            Consulta(cliente=self.cliente, nutricionista=nutris[indice % 3], data_horario=agora + timedelta(hours=sinal * (1 + indice // 3)), modalidade='ONLINE')
+            for sinal, quantidade in ((1, 25), (-1, 30)) for indice in range(quantidade)
+        )
+
+    def percorrer(self, lista):
+        vistos = []; cursor = None
+        while True:
+            parametros = {'lista': lista, **({'cursor': cursor} if cursor else {})}
+            # sessão + página com nutricionista e usuário (o usuário logado já está em cache)
+            with self.assertNumQueries(2):
+                dados = self.client.get(f'{self.url}?{urlencode(parametros)}').json()
+            vistos += [(item['data_horario'], item['id']) for item in dados['resultados']]
+            cursor = dados['proximo_cursor']
+            if not cursor:
+                return vistos
+
+    def test_paginas_cobrem_as_duas_listas_em_ordem(self):
+        self.client.get(f'{self.url}?lista=futuras')
+        futuras = self.percorrer('futuras'); passadas = self.percorrer('passadas')
+        self.assertEqual(len(futuras), 25); self.assertEqual(len(passadas), 30)
+        ordem = lambda vistos: [(datetime.fromisoformat(data), id_) for data, id_ in vistos]
+        self.assertEqual(ordem(futuras), sorted(ordem(futuras)))
+        self.assertEqual(ordem(passadas), sorted(ordem(passadas), reverse=True))
+
+    def test_pagina_html_tem_consultas_constantes(self):
+        self.client.get(reverse('consultas_cliente'))
+        with self.assertNumQueries(3):
+            resposta = self.client.get(reverse('consultas_cliente'))
+        self.assertEqual(len(resposta.context['consultas_futuras']), 20)
+        self.assertTrue(resposta.context['cursor_passadas'])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get(f'{self.url}?lista=todas').status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?lista=futuras&cursor=xyz').status_code, 400)
+        # Cursores bem formados com valores que não servem para a ordenação (data_horario, id)
+        for valores in (['ontem', 1], ['2030-01-01T10:00:00+00:00', 'x'], [None, 1]):
+            self.assertEqual(self.client.get(self.url, {'lista': 'futuras', 'cursor': codificar_cursor(valores)}).status_code, 400)
+
+    def test_cursor_preserva_microssegundos(self):
+        inicio = timezone.now().replace(microsecond=0) + timedelta(days=30)
+        # Mesmo milissegundo, microssegundos diferentes: com o cursor cortado em milissegundos a página repetiria linhas
+        Consulta.objects.bulk_create(
+            Consulta(cliente=self.cliente, nutricionista=Nutricionista.objects.first(), data_horario=inicio + timedelta(microseconds=micro), modalidade='ONLINE')
+            for micro in (100, 200, 300)
+        )
+        consultas = Consulta.objects.filter(data_horario__gte=inicio); vistos = []; cursor = None
+        while True:
+            pagina, cursor = paginar_por_chave(consultas, ('data_horario', 'id'), cursor, tamanho=1)
+            vistos += [consulta.data_horario.microsecond for consulta in pagina]
+            if not cursor:
+                break
+        self.assertEqual(vistos, [100, 200, 300])
+
+
+@override_settings(REPLICAS_LEITURA=['replica'])
+class RoteadorReplicasTests(SimpleTestCase):
+    def requisicao(self, escrever=False, cookies=None):
+        """Passa pelo ReplicaLeituraMiddleware e devolve (banco de leitura antes e depois da escrita, resposta)."""
+        bancos = []
+
+        def view(request):
+            bancos.append(Consulta.objects.all().db)
+            if escrever:
+                router.db_for_write(Consulta)
+            bancos.append(Consulta.objects.all().db)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        resposta = ReplicaLeituraMiddleware(view)(request)
+        return bancos, resposta
+
+    def test_leitura_na_replica_e_escrita_no_primario(self):
+        bancos, resposta = self.requisicao()
+        self.assertEqual(bancos, ['replica', 'replica'])
+        self.assertEqual(router.db_for_write(Consulta), 'default')
+        self.assertNotIn('ler_primario', resposta.cookies)
+
+    def test_escrita_fixa_o_primario_na_requisicao_e_nas_seguintes(self):
+        bancos, resposta = self.requisicao(escrever=True)
+        self.assertEqual(bancos, ['replica', 'default'])
+        self.assertEqual(resposta.cookies['ler_primario']['max-age'], 5)
+        bancos, _ = self.requisicao(cookies={'ler_primario': '1'})
+        self.assertEqual(bancos, ['default', 'default'])
+
+    def test_sessoes_e_caches_leem_do_primario(self):
+        bancos = []
+
+        def view(request):
+            bancos.append(Session.objects.all().db)
+            with ler_do_primario():
+                bancos.append(Consulta.objects.all().db)
+            bancos.append(Consulta.objects.all().db)
+            router.db_for_write(Session)
+            return HttpResponse()
+
+        resposta = ReplicaLeituraMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(bancos, ['default', 'default', 'replica'])
+        self.assertNotIn('ler_primario', resposta.cookies)
+
+    @override_settings(REPLICAS_LEITURA=[])
+    def test_sem_replicas_tudo_no_primario(self):
+        self.assertEqual(Consulta.objects.all().db, 'default')
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaLeituraMiddleware(lambda request: HttpResponse())
+
+
+class NutrientesPlanoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cliente = criar_cliente()
+        self.plano = PlanoAlimentar.objects.create(cliente=self.cliente, nutricionista=criar_nutricionista())
+        self.arroz = Alimento.objects.create(codigo='3', nome='Arroz, tipo 1, cozido', energia_kcal=128, proteina_g=2.5, carboidrato_g=28.1, lipideos_g=0.2, ferro_mg=0.1)
+        self.feijao = Alimento.objects.create(codigo='561', nome='Feijão, carioca, cozido', energia_kcal=76, proteina_g=4.8, carboidrato_g=13.6, lipideos_g=0.5, ferro_mg=1.3)
+        self.almoco = Refeicao.objects.create(plano_alimentar=self.plano, nome='Almoço', alimentos='Arroz e feijão', quantidades='150g, 100g')
+        self.jantar = Refeicao.objects.create(plano_alimentar=self.plano, nome='Jantar', alimentos='Arroz', quantidades='100g')
+        ItemRefeicao.objects.create(refeicao=self.almoco, alimento=self.arroz, quantidade_g=150)
+        ItemRefeicao.objects.create(refeicao=self.almoco, alimento=self.feijao, quantidade_g=100)
+        ItemRefeicao.objects.create(refeicao=self.jantar, alimento=self.arroz, quantidade_g=100)
+
+    def totais(self):
+        self.plano.refresh_from_db()
+        return nutrientes.totais_plano(self.plano)
+
+    def test_totais_por_refeicao_e_do_plano(self):
+        totais = self.totais()
+        self.assertEqual(totais['refeicoes'][self.almoco.id]['energia_kcal'], 268.0)
+        self.assertEqual(totais['refeicoes'][self.jantar.id]['proteina_g'], 2.5)
+        self.assertEqual(totais['total']['energia_kcal'], 396.0)
+        self.assertEqual(totais['total']['ferro_mg'], 1.55)
+
+    def test_varios_planos_numa_consulta(self):
+        vazio = PlanoAlimentar.objects.create(cliente=self.cliente, nutricionista=self.plano.nutricionista)
+        with self.assertNumQueries(1):
+            totais = nutrientes.calcular_totais([self.plano.id, vazio.id])
+        self.assertEqual(totais[vazio.id], {'total': {campo: 0.0 for campo in nutrientes.CAMPOS_NUTRIENTES}, 'refeicoes': {}})
+        self.assertEqual(totais[self.plano.id]['total']['carboidrato_g'], 83.85)
+
+    def test_cache_pela_versao_do_plano_e_do_catalogo(self):
+        self.totais()
+        with self.assertNumQueries(1):  # só o refresh do plano
+            self.totais()
+        ItemRefeicao.objects.create(refeicao=self.jantar, alimento=self.feijao, quantidade_g=50)
+        self.assertEqual(self.totais()['total']['energia_kcal'], 434.0)
+        self.arroz.energia_kcal = 130; self.arroz.save()
+        self.assertEqual(self.totais()['total']['energia_kcal'], 439.0)
+
+    def test_pagina_do_plano_mostra_os_totais(self):
+        self.client.force_login(self.cliente.usuario)
+        resposta = self.client.get(reverse('planos_alimentares_cliente'))
+        self.assertEqual(resposta.context['nutrientes_plano']['energia_kcal'], 396.0)
+        self.assertContains(resposta, '396 kcal')
+
+    def test_importar_alimentos_no_formato_taco(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='latin-1', delete=False) as arquivo:
+            arquivo.write('Número do Alimento;Categoria do alimento;Descrição dos alimentos;Energia (kcal);Energia (kJ);Proteína (g);Lipídeos (g);Carboidrato (g);Fibra Alimentar (g);Cálcio (mg);Ferro (mg);Sódio (mg);Vitamina C (mg)\n')
+            arquivo.write('3;Cereais e derivados;Arroz, tipo 1, cozido;128;534;2,5;0,2;28,1;1,6;4;0,1;1;NA\n')
+            arquivo.write('600;Leguminosas e derivados;Lentilha, cozida;93;390;6,3;0,5;16,3;7,9;16;1,5;1;Tr\n')
+        self.addCleanup(os.remove, arquivo.name)
+        self.totais()
+        saida = io.StringIO()
+        call_command('importar_alimentos', arquivo.name, encoding='latin-1', stdout=saida)
+        self.assertIn('1 alimentos criados e 1 atualizados', saida.getvalue())
+        lentilha = Alimento.objects.get(codigo='600')
+        self.assertEqual((lentilha.nome, lentilha.grupo, lentilha.fibra_g, lentilha.vitamina_c_mg), ('Lentilha, cozida', 'Leguminosas e derivados', 7.9, 0.0))
+        self.assertEqual(Alimento.objects.get(codigo='3').fibra_g, 1.6)
+        # A importação em lote não dispara sinais, mas troca a versão do catálogo
+        self.assertEqual(self.totais()['total']['fibra_g'], 4.0)
+
+
+class GeradorPlanosTests(TransactionTestCase):
+    # Transacional: o modo com pool de processos fecha as conexões antes de criar os processos
+    CATALOGO = [
+        ('1', 'Arroz cozido', 128, 2.5, 28.1, 0.2), ('2', 'Feijão cozido', 76, 4.8, 13.6, 0.5),
+        ('3', 'Peito de frango grelhado', 163, 32.8, 0.0, 2.5), ('4', 'Ovo cozido', 146, 13.3, 0.6, 9.5),
+        ('5', 'Azeite de oliva', 884, 0.0, 0.0, 100.0), ('6', 'Pão francês', 300, 8.0, 58.6, 3.1),
+        ('7', 'Alface', 11, 1.3, 1.7, 0.2), ('8', 'Banana prata', 98, 1.3, 26.0, 0.1),
+        ('9', 'Castanha de caju', 570, 18.5, 29.1, 46.3), ('10', 'Iogurte natural', 51, 4.1, 1.9, 3.0),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        Alimento.objects.bulk_create(
+            Alimento(codigo=codigo, nome=nome, energia_kcal=kcal, proteina_g=proteina, carboidrato_g=carboidrato, lipideos_g=lipideos)
+            for codigo, nome, kcal, proteina, carboidrato, lipideos in self.CATALOGO
+        )
+        self.nutri = criar_nutricionista()
+        self.clientes = [criar_cliente(f'c{indice}@teste.com') for indice in range(4)]
+        Cliente.objects.filter(id=self.clientes[3].id).update(peso=None)
+        for indice, cliente in enumerate(self.clientes):
+            Consulta.objects.create(cliente=cliente, nutricionista=self.nutri, data_horario=local(proxima_segunda(), time(8 + indice)), modalidade='ONLINE')
+
+    def test_metas_diarias(self):
+        # 70 kg, 1,70 m, 30 anos: basal 10*70 + 6,25*170 - 5*30 - 78 = 1534,5
+        metas = gerador_planos.metas_diarias([70], [1.7], [30], ['EMAGRECIMENTO'])[0]
+        self.assertAlmostEqual(metas[0], 1534.5 * 1.4 * 0.8)
+        self.assertAlmostEqual(metas[1], 70 * 1.6)
+        self.assertAlmostEqual(metas[0], metas[1] * 4 + metas[2] * 4 + metas[3] * 9)
+
+    def test_gera_rascunhos_perto_das_metas(self):
+        resultado = gerador_planos.GeradorPlanos().gerar()
+        self.assertEqual((resultado['planos'], resultado['ignorados']), (3, 1))
+        planos = list(PlanoAlimentar.objects.filter(rascunho=True, nutricionista=self.nutri))
+        self.assertEqual(len(planos), 3)
+        meta = gerador_planos.metas_diarias([70], [1.7], [30], ['EMAGRECIMENTO'])[0]
+        for plano, totais in nutrientes.totais_planos(planos).items():
+            self.assertEqual(len(totais['refeicoes']), 4)
+            self.assertLess(abs(totais['total']['energia_kcal'] / meta[0] - 1), 0.25)
+        # O rascunho não aparece para o cliente
+        self.client.force_login(self.clientes[0].usuario)
+        self.assertIsNone(self.client.get(reverse('planos_alimentares_cliente')).context['plano_atual'])
+
+    def test_pool_de_processos_da_o_mesmo_resultado(self):
+        gerador_planos.GeradorPlanos(processos=1, tamanho_lote=2).gerar()
+        sequencial = list(ItemRefeicao.objects.order_by('refeicao__plano_alimentar__cliente_id', 'refeicao__nome', 'id').values_list('refeicao__plano_alimentar__cliente_id', 'alimento_id', 'quantidade_g'))
+        PlanoAlimentar.objects.all().delete()
+        gerador_planos.GeradorPlanos(processos=2, tamanho_lote=2).gerar()
+        paralelo = list(ItemRefeicao.objects.order_by('refeicao__plano_alimentar__cliente_id', 'refeicao__nome', 'id').values_list('refeicao__plano_alimentar__cliente_id', 'alimento_id', 'quantidade_g'))
+        self.assertEqual(paralelo, sequencial)
+
+
+class TransferenciaPlanosTests(TestCase):
+    CSV = (
+        'plano;cliente_email;nutricionista_email;data_criacao;rascunho;observacoes;refeicao;alimentos;quantidades;calorias\n'
+        'A1;Bia@teste.com;nutri@teste.com;2023-05-10;;Sem lactose;Café da Manhã;"Pão\nOvos";1 un, 2 un;350\n'
+        'A1;bia@teste.com;nutri@teste.com;2023-05-10;;Sem lactose;Almoço;Arroz;100 g;480,5\n'
+        'A2;outro@teste.com;nutri@teste.com;;;;Jantar;Sopa;1 prato;\n'
+        'A3;bia@teste.com;nutri@teste.com;;sim;;Jantar;Sopa;1 prato;muitas\n'
+        'A4;bia@teste.com;nutri@teste.com;10/06/2023;sim;;;;;\n'
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente('bia@teste.com')
+
+    def importar(self, conteudo, sufixo, **opcoes):
+        with tempfile.NamedTemporaryFile('w', suffix=sufixo, delete=False, encoding='utf-8') as arquivo:
+            arquivo.write(conteudo)
+        self.addCleanup(os.remove, arquivo.name)
+        saida, erros = io.StringIO(), io.StringIO()
+        call_command('importar_planos', arquivo.name, stdout=saida, stderr=erros, **opcoes)
+        return saida.getvalue(), erros.getvalue()
+
+    def test_importa_csv_agrupando_refeicoes_e_reporta_erros(self):
+        saida, erros = self.importar(self.CSV, '.csv', lote=2)
+        self.assertIn('2 planos e 2 refeições importados', saida)
+        # O campo com quebra de linha ocupa as linhas 2 e 3 do arquivo
+        self.assertIn('Linha 5: cliente outro@teste.com não encontrado', erros)
+        self.assertIn("Linha 6: calorias inválidas: 'muitas'", erros)
+        plano, vazio = PlanoAlimentar.objects.filter(cliente=self.cliente).order_by('id')
+        self.assertEqual((plano.data_criacao.isoformat(), plano.observacoes, plano.rascunho), ('2023-05-10', 'Sem lactose', False))
+        self.assertEqual(list(plano.refeicoes.order_by('id').values_list('nome', 'alimentos', 'calorias')), [('Café da Manhã', 'Pão\nOvos', 350), ('Almoço', 'Arroz', 480)])
+        self.assertEqual((vazio.rascunho, vazio.data_criacao.isoformat(), vazio.refeicoes.count()), (True, '2023-06-10', 0))
+
+    def exportar(self):
+        saida = io.StringIO()
+        call_command('exportar_planos', formato='jsonl', stdout=saida)
+        return saida.getvalue()
+
+    def test_exportacao_jsonl_reimportada_gera_os_mesmos_planos(self):
+        self.importar(self.CSV, '.csv')
+        exportado = self.exportar()
+        linhas = [json.loads(linha) for linha in exportado.splitlines()]
+        self.assertEqual([len(linha['refeicoes']) for linha in linhas], [2, 0])
+        PlanoAlimentar.objects.all().delete()
+        self.importar(exportado, '.jsonl')
+        reimportados = [json.loads(linha) for linha in self.exportar().splitlines()]
+        # Só o id muda
+        self.assertEqual([{**linha, 'plano': None} for linha in reimportados], [{**linha, 'plano': None} for linha in linhas])
+
+    def test_admin_exporta_em_fluxo_e_importa_upload(self):
+        admin = User.objects.create_superuser('admin', 'admin@teste.com', 'senha')
+        self.client.force_login(admin)
+        url_importar = reverse('admin:core_planoalimentar_importar')
+        with tempfile.NamedTemporaryFile('w+b', suffix='.csv') as arquivo:
+            arquivo.write(self.CSV.encode()); arquivo.seek(0)
+            resposta = self.client.post(url_importar, {'arquivo': arquivo})
+        self.assertRedirects(resposta, reverse('admin:core_planoalimentar_changelist'))
+        self.assertEqual(PlanoAlimentar.objects.count(), 2)
+        resposta = self.client.post(reverse('admin:core_planoalimentar_changelist'), {
+            'action': 'exportar_csv', '_selected_action': list(PlanoAlimentar.objects.values_list('id', flat=True)),
+        })
+        self.assertTrue(resposta.streaming)
+        conteudo = b''.join(resposta.streaming_content).decode()
+        self.assertEqual(conteudo.count('bia@teste.com'), 3)
+        self.assertIn('"Pão\nOvos"', conteudo)
+
+
+class ModelosPlanoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.clientes = [criar_cliente(f'c{indice}@teste.com') for indice in range(5)]
+        self.arroz = Alimento.objects.create(codigo='3', nome='Arroz, tipo 1, cozido', energia_kcal=128, proteina_g=2.5, carboidrato_g=28.1, lipideos_g=0.2)
+        self.modelo = ModeloPlano.objects.create(nutricionista=self.nutri, nome='Base 1800 kcal')
+        self.almoco = Refeicao.objects.create(modelo=self.modelo, nome='Almoço', alimentos='Arroz', quantidades='150g')
+        self.jantar = Refeicao.objects.create(modelo=self.modelo, nome='Jantar', alimentos='Sopa', quantidades='1 prato')
+        ItemRefeicao.objects.create(refeicao=self.almoco, alimento=self.arroz, quantidade_g=150)
+
+    def test_aplicar_referencia_as_refeicoes_sem_copiar(self):
+        refeicoes = Refeicao.objects.count()
+        with self.assertNumQueries(3):  # savepoint, INSERT dos planos, release
+            planos = modelos_plano.aplicar_modelo(self.modelo, self.clientes)
+        self.assertEqual(Refeicao.objects.count(), refeicoes)
+        totais = nutrientes.calcular_totais([plano.id for plano in planos])
+        self.assertEqual({plano_id: total['total']['energia_kcal'] for plano_id, total in totais.items()}, {plano.id: 192.0 for plano in planos})
+        self.assertEqual(totais[planos[0].id]['refeicoes'], {self.almoco.id: totais[planos[1].id]['refeicoes'][self.almoco.id]})
+        self.client.force_login(self.clientes[0].usuario)
+        resposta = self.client.get(reverse('planos_alimentares_cliente'))
+        self.assertEqual([refeicao.nome for refeicao in resposta.context['refeicoes']], ['Almoço', 'Jantar'])
+        self.assertEqual(resposta.context['nutrientes_plano']['energia_kcal'], 192.0)
+
+    def test_mudanca_no_modelo_chega_aos_planos(self):
+        plano, = modelos_plano.aplicar_modelo(self.modelo, self.clientes[:1])
+        self.assertEqual(dados_dashboard_cliente(self.clientes[0])['refeicoes']['jantar'].alimentos, 'Sopa')
+        self.jantar.alimentos = 'Omelete'; self.jantar.save()
+        self.assertEqual(dados_dashboard_cliente(self.clientes[0])['refeicoes']['jantar'].alimentos, 'Omelete')
+        ItemRefeicao.objects.create(refeicao=self.jantar, alimento=self.arroz, quantidade_g=100)
+        plano.refresh_from_db()
+        self.assertEqual((plano.versao, nutrientes.totais_plano(plano)['total']['energia_kcal']), (2, 320.0))
+
+    def test_personalizar_copia_com_queries_fixas(self):
+        planos = modelos_plano.aplicar_modelo(self.modelo, self.clientes)
+        outro = ModeloPlano.objects.create(nutricionista=self.nutri, nome='Outro')
+        Refeicao.objects.create(modelo=outro, nome='Ceia', alimentos='Chá', quantidades='1 xícara')
+        modelos_plano.aplicar_modelo(outro, self.clientes[:2])
+        # planos, refeições, itens, INSERT refeições, INSERT itens, UPDATE planos (+ savepoint e release)
+        with self.assertNumQueries(8):
+            self.assertEqual(modelos_plano.personalizar_planos(PlanoAlimentar.objects.all()), 7)
+        self.assertFalse(PlanoAlimentar.objects.filter(modelo__isnull=False).exists())
+        self.assertEqual(Refeicao.objects.filter(plano_alimentar__isnull=False).count(), 5 * 2 + 2)
+        self.jantar.alimentos = 'Omelete'; self.jantar.save()
+        plano = PlanoAlimentar.objects.get(pk=planos[0].pk)
+        self.assertEqual([refeicao.alimentos for refeicao in plano.refeicoes_do_plano().order_by('id')], ['Arroz', 'Sopa'])
+        self.assertEqual(nutrientes.totais_plano(plano)['total']['energia_kcal'], 192.0)
+
+    def test_acao_do_admin_aplica_o_modelo_escolhido(self):
+        admin = User.objects.create_superuser('admin', 'admin@teste.com', 'senha')
+        self.client.force_login(admin)
+        url = reverse('admin:core_cliente_changelist')
+        selecionados = [cliente.id for cliente in self.clientes[:3]]
+        resposta = self.client.post(url, {'action': 'aplicar_modelo_plano', '_selected_action': selecionados})
+        self.assertContains(resposta, 'Base 1800 kcal')
+        resposta = self.client.post(url, {'action': 'aplicar_modelo_plano', '_selected_action': selecionados, 'modelo': self.modelo.id, 'aplicar': '1'})
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(set(PlanoAlimentar.objects.filter(modelo=self.modelo).values_list('cliente_id', flat=True)), set(selecionados))
+
+
+class MetricasNutricionistaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.clientes = [criar_cliente(f'c{indice}@teste.com') for indice in range(3)]
+        self.hoje = timezone.localdate()
+
+    def consulta(self, cliente, dias, hora=8, **kwargs):
+        dados = {'duracao': 60, 'valor': Decimal('150.00'), 'modalidade': 'ONLINE'}
+        dados.update(kwargs)
+        return Consulta.objects.create(cliente=cliente, nutricionista=self.nutri, data_horario=local(self.hoje + timedelta(days=dias), time(hora)), **dados)
+
+    def dia(self, dias):
+        metrica = MetricaDiariaNutricionista.objects.filter(nutricionista=self.nutri, data=self.hoje + timedelta(days=dias)).first()
+        return metrica and tuple(getattr(metrica, campo) for campo in metricas.CAMPOS_DIA)
+
+    def test_mudancas_de_status_atualizam_o_rollup(self):
+        concluida = self.consulta(self.clientes[0], -2)
+        cancelada = self.consulta(self.clientes[1], -2, hora=9)
+        movida = self.consulta(self.clientes[2], -2, hora=10, duracao=30)
+        self.assertEqual(self.dia(-2), (3, 0, 0, 150, 0))
+        concluida.status = Consulta.StatusChoices.CONCLUIDO; concluida.save()
+        cancelada.status = Consulta.StatusChoices.CANCELADO; cancelada.save()
+        adiada = Consulta.objects.only('id', 'data_horario').get(pk=movida.pk)  # campos adiados: o estado anterior vem do banco
+        adiada.data_horario = local(self.hoje - timedelta(days=1), time(10)); adiada.save()
+        self.assertEqual(self.dia(-2), (0, 1, 1, 60, Decimal('150.00')))
+        self.assertEqual(self.dia(-1), (1, 0, 0, 30, 0))
+        self.assertEqual(dict(MetricaClienteNutricionista.objects.values_list('cliente_id', 'consultas')), {self.clientes[0].id: 1, self.clientes[1].id: 0, self.clientes[2].id: 1})
+        Consulta.objects.get(pk=movida.pk).delete()
+        self.assertEqual(self.dia(-1), (0, 0, 0, 0, 0))
+        self.assertEqual(metricas.reconciliar(), 0)
+
+    def test_uma_instrucao_por_tabela_do_rollup(self):
+        with CaptureQueriesContext(connection) as queries:
+            consulta = self.consulta(self.clientes[0], 1)
+        self.assertEqual(len([query for query in queries if 'core_metrica' in query['sql']]), 2)
+        self.assertEqual(self.dia(1), (1, 0, 0, 60, 0))
+        with CaptureQueriesContext(connection) as queries:
+            consulta.status = Consulta.StatusChoices.CANCELADO; consulta.save()
+        self.assertEqual(len([query for query in queries if 'core_metrica' in query['sql']]), 2)
+        self.assertEqual(self.dia(1), (0, 0, 1, 0, 0))
+
+    def test_reconciliar_corrige_alteracoes_em_lote(self):
+        self.consulta(self.clientes[0], -3); self.consulta(self.clientes[1], -3, hora=9)
+        Consulta.objects.update(status=Consulta.StatusChoices.CONCLUIDO)  # sem sinais
+        saida = io.StringIO()
+        call_command('reconciliar_metricas', lote=1, stdout=saida)
+        self.assertIn('1 linhas de métricas corrigidas', saida.getvalue())
+        self.assertEqual(self.dia(-3), (0, 2, 0, 120, Decimal('300.00')))
+        self.assertEqual(metricas.reconciliar(), 0)
+
+    def test_dashboard_le_so_o_rollup(self):
+        self.consulta(self.clientes[0], 0, status=Consulta.StatusChoices.CONCLUIDO)
+        self.consulta(self.clientes[1], -1, status=Consulta.StatusChoices.CANCELADO)
+        self.consulta(self.clientes[1], 2)
+        self.client.force_login(self.nutri.usuario)
+        with CaptureQueriesContext(connection) as queries:
+            resposta = self.client.get(reverse('dashboard_nutri'))
+        self.assertFalse([query['sql'] for query in queries if 'core_consulta' in query['sql']])
+        contexto = resposta.context
+        self.assertEqual((contexto['receita_mes'], contexto['clientes_ativos'], contexto['taxa_cancelamento']), (Decimal('150.00'), 2, 50.0))
+        disponiveis = metricas.minutos_disponiveis(self.nutri, self.hoje - timedelta(days=29), self.hoje)
+        self.assertEqual(contexto['ocupacao'], round(100 * 60 / disponiveis, 1))
+        self.assertEqual([dia['confirmadas'] for dia in contexto['agenda']], [0, 0, 1, 0, 0, 0, 0])
+
+    def test_minutos_disponiveis_aplica_excecoes(self):
+        segunda = proxima_segunda()
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=segunda, hora_inicio=time(9), hora_fim=time(10))
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=segunda + timedelta(days=1))
+        ExcecaoAgenda.objects.create(nutricionista=self.nutri, data=segunda + timedelta(days=5), hora_inicio=time(8), hora_fim=time(10), disponivel=True)
+        self.assertEqual(metricas.minutos_disponiveis(self.nutri, segunda, segunda + timedelta(days=6)), 180 + 0 + 240 * 3 + 120)
+
+    def test_remover_nutricionista_com_consultas(self):
+        self.consulta(self.clientes[0], -1)
+        self.nutri.delete()
+        self.assertFalse(MetricaDiariaNutricionista.objects.exists())
+
+
+class BackendEmailFora(BaseEmailBackend):
+    def send_messages(self, mensagens):
+        raise ConnectionRefusedError('servidor SMTP fora do ar')
+
+
+class JobsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        self.agora = timezone.now().replace(microsecond=0)
+
+    def consulta(self, delta, **kwargs):
+        dados = {'duracao': 60, 'valor': Decimal('150.00'), 'modalidade': 'ONLINE'}
+        dados.update(kwargs)
+        return Consulta.objects.create(cliente=self.cliente, nutricionista=self.nutri, data_horario=self.agora + delta, **dados)
+
+    def test_encerra_so_consultas_ja_terminadas(self):
+        passadas = [self.consulta(timedelta(days=-dias)) for dias in (1, 2, 3)]
+        em_andamento = self.consulta(timedelta(minutes=-30))
+        futura = self.consulta(timedelta(days=1))
+        resultado = jobs.encerrar_consultas_passadas(self.agora, tamanho_lote=2)
+        self.assertEqual(resultado['linhas'], 3)
+        status = dict(Consulta.objects.values_list('id', 'status'))
+        self.assertEqual({status[consulta.id] for consulta in passadas}, {Consulta.StatusChoices.CONCLUIDO})
+        self.assertEqual((status[em_andamento.id], status[futura.id]), (Consulta.StatusChoices.CONFIRMADO,) * 2)
+        self.assertEqual(metricas.reconciliar(), 0)  # o rollup acompanhou o UPDATE em lote
+        self.assertEqual(jobs.encerrar_consultas_passadas(self.agora)['linhas'], 0)
+
+    def test_lembretes_enfileirados_uma_vez_e_enviados(self):
+        proxima = self.consulta(timedelta(hours=2))
+        self.consulta(timedelta(days=3))
+        self.consulta(timedelta(hours=3), status=Consulta.StatusChoices.CANCELADO)
+        self.assertEqual(jobs.enfileirar_lembretes(self.agora)['linhas'], 1)
+        self.assertEqual(jobs.enfileirar_lembretes(self.agora)['linhas'], 0)
+        saida = io.StringIO()
+        call_command('executar_jobs', job=['enviar_notificacoes'], stdout=saida)
+        self.assertIn('enviar_notificacoes: 1 linhas', saida.getvalue())
+        self.assertEqual([mensagem.to for mensagem in mail.outbox], [[self.cliente.usuario.email]])
+        notificacao = Notificacao.objects.get()
+        self.assertEqual((notificacao.consulta_id, notificacao.status, notificacao.tentativas), (proxima.id, Notificacao.StatusChoices.ENVIADA, 1))
+
+    def test_falha_no_envio_volta_para_a_fila_ate_desistir(self):
+        ativa = self.consulta(timedelta(hours=2))
+        cancelada = self.consulta(timedelta(hours=3))
+        jobs.enfileirar_lembretes(self.agora)
+        cancelada.status = Consulta.StatusChoices.CANCELADO; cancelada.save()
+        with override_settings(EMAIL_BACKEND='core.tests.BackendEmailFora'):
+            jobs.enviar_notificacoes(self.agora, max_tentativas=2)
+            pendente = Notificacao.objects.get(consulta=ativa)
+            self.assertEqual((pendente.status, pendente.tentativas), (Notificacao.StatusChoices.PENDENTE, 1))
+            self.assertIn('SMTP fora do ar', pendente.erro)
+            self.assertEqual(jobs.enviar_notificacoes(self.agora)['linhas'], 0)  # ainda esperando a próxima tentativa
+            jobs.enviar_notificacoes(pendente.proxima_tentativa, max_tentativas=2)
+        self.assertEqual(Notificacao.objects.get(consulta=ativa).status, Notificacao.StatusChoices.FALHOU)
+        self.assertEqual(Notificacao.objects.get(consulta=cancelada).status, Notificacao.StatusChoices.DESCARTADA)
+        self.assertEqual(mail.outbox, [])
+
+
+class CalendarioIcsTests(TestCase):
+    def setUp(self):
+        self.nutri = criar_nutricionista()
+        self.cliente = criar_cliente()
+        agora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        dados = {'cliente': self.cliente, 'nutricionista': self.nutri, 'modalidade': 'ONLINE', 'valor': Decimal('150.00')}
+        self.futura = Consulta.objects.create(data_horario=agora + timedelta(days=2), **dados)
+        self.cancelada = Consulta.objects.create(data_horario=agora + timedelta(days=3), status=Consulta.StatusChoices.CANCELADO, **dados)
+        Consulta.objects.create(data_horario=agora - timedelta(days=200), status=Consulta.StatusChoices.CONCLUIDO, **dados)  # fora da janela
+
+    def url(self, usuario):
+        return reverse('calendario_ics', args=[TokenCalendario.objects.get(usuario=usuario).token])
+
+    def baixar(self, url, **cabecalhos):
+        resposta = self.client.get(url, **cabecalhos)
+        corpo = b''.join(resposta.streaming_content).decode() if resposta.status_code == 200 else ''
+        return resposta, corpo
+
+    def test_feed_do_cliente_e_304_enquanto_nada_muda(self):
+        url = self.url(self.cliente.usuario)
+        resposta, corpo = self.baixar(url)
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(resposta['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(corpo.startswith('BEGIN:VCALENDAR\r\n') and corpo.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(corpo.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:consulta-{self.futura.id}@nutrione', corpo)
+        self.assertIn('SUMMARY:Consulta com Ana', corpo)
+        self.assertIn('STATUS:CANCELLED', corpo)
+        self.assertTrue(all(len(linha.encode()) <= 75 for linha in corpo.split('\r\n')))
+
+        with self.assertNumQueries(2):  # token (com os perfis) e agregação da versão
+            nao_mudou, _ = self.baixar(url, HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual((nao_mudou.status_code, nao_mudou['ETag']), (304, resposta['ETag']))
+        self.assertEqual(self.baixar(url, HTTP_IF_MODIFIED_SINCE=resposta['Last-Modified'])[0].status_code, 304)
+
+        self.futura.modalidade = 'PRESENCIAL'; self.futura.save()
+        mudou, corpo = self.baixar(url, HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(mudou.status_code, 200)
+        self.assertIn('Modalidade: Presencial', corpo)
+
+    def test_exclusao_e_nome_novo_mudam_etag_e_last_modified(self):
+        url = self.url(self.cliente.usuario)
+        resposta, _ = self.baixar(url)
+        # O Last-Modified tem resolução de segundos: as mudanças acontecem "depois"
+        depois = timezone.now() + timedelta(seconds=2)
+        with mock.patch('django.utils.timezone.now', return_value=depois):
+            self.nutri.usuario.first_name = 'Carla'; self.nutri.usuario.save()
+        renomeado, corpo = self.baixar(url, HTTP_IF_MODIFIED_SINCE=resposta['Last-Modified'])
+        self.assertEqual(renomeado.status_code, 200)
+        self.assertIn('SUMMARY:Consulta com Carla', corpo)
+        self.assertNotEqual(renomeado['ETag'], resposta['ETag'])
+        with mock.patch('django.utils.timezone.now', return_value=depois + timedelta(seconds=2)):
+            self.cancelada.delete()
+        for cabecalhos in ({'HTTP_IF_MODIFIED_SINCE': renomeado['Last-Modified']}, {'HTTP_IF_NONE_MATCH': renomeado['ETag']}):
+            self.assertEqual(self.baixar(url, **cabecalhos)[0].status_code, 200)
+
+    def test_feed_do_nutricionista_e_token_regenerado(self):
+        url = self.url(self.nutri.usuario)
+        resposta, corpo = self.baixar(url)
+        self.assertIn('SUMMARY:Consulta: Bia', corpo)
+        self.assertEqual(corpo.count('BEGIN:VEVENT'), 2)
+        self.client.force_login(self.nutri.usuario)
+        self.assertRedirects(self.client.post(reverse('regenerar_calendario')), reverse('dashboard_nutri'))
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.baixar(self.url(self.nutri.usuario))[0].status_code, 200)
@@ -0,0 +1,338 @@
+"""Importação e exportação de planos alimentares em CSV ou JSONL, em fluxo.
+
+Cada etapa é um gerador que consome a anterior (leitura -> agrupamento ->
+validação -> lotes), então a memória usada depende do tamanho do lote, não do
+arquivo. Clientes e nutricionistas são resolvidos pelo e-mail com uma query por
+lote, e cada lote é gravado com bulk_create numa transação.
+
+CSV: uma linha por refeição, com as colunas de COLUNAS. Linhas consecutivas com
+o mesmo `plano` (um identificador qualquer do sistema de origem) formam um plano;
+sem essa coluna, agrupa pelo cliente, nutricionista e data. Uma linha sem
+refeição cria o plano vazio.
+JSONL: um plano por linha, com as refeições numa lista em "refeicoes".
+
+A exportação gera os mesmos formatos, pronta para StreamingHttpResponse; planos
+que usam um modelo (core.modelos_plano) saem com as refeições do modelo.
+"""
+import csv
+import json
+import time
+from datetime import date, datetime
+from itertools import groupby, islice
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Lower
+
+from . import dashboard
+from .dados_sinteticos import inserir_em_lote
+from .models import Cliente, Nutricionista, PlanoAlimentar, Refeicao
+
+
+COLUNAS_PLANO = ('plano', 'cliente_email', 'nutricionista_email', 'data_criacao', 'rascunho', 'observacoes')
+COLUNAS_REFEICAO = ('refeicao', 'alimentos', 'quantidades', 'calorias')
+COLUNAS = COLUNAS_PLANO + COLUNAS_REFEICAO
+COLUNAS_OBRIGATORIAS = ('cliente_email', 'nutricionista_email')
+FORMATOS = ('csv', 'jsonl')
+VERDADEIRO = {'1', 'true', 'sim', 's', 'yes', 'y', 'x'}
+FALSO = {'', '0', 'false', 'nao', 'não', 'n', 'no'}
+MAX_ERROS = 100
+
+
+class ArquivoInvalido(ValueError):
+    """O arquivo inteiro não pode ser lido (cabeçalho, formato)."""
+
+
+class LinhaInvalida(ValueError):
+    def __init__(self, linha, mensagem):
+        super().__init__(f'Linha {linha}: {mensagem}')
+        self.linha = linha
+
+
+def formato_do_arquivo(nome, formato=None):
+    formato = (formato or nome.rsplit('.', 1)[-1]).lower()
+    if formato not in FORMATOS:
+        raise ArquivoInvalido(f"Formato desconhecido: use {' ou '.join(FORMATOS)}.")
+    return formato
+
+
+# --- Leitura: geram (número da linha, dados ou LinhaInvalida) ---
+
+def ler_csv(linhas, delimitador=None):
+    """Lê um CSV com cabeçalho de qualquer iterável de linhas (arquivo aberto, upload decodificado)."""
+    linhas = iter(linhas)
+    primeira = next(linhas, '')
+    delimitador = delimitador or (';' if primeira.count(';') > primeira.count(',') else ',')
+    cabecalho = [coluna.strip().lower() for coluna in next(csv.reader([primeira], delimiter=delimitador), [])]
+    faltando = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in cabecalho]
+    if faltando:
+        raise ArquivoInvalido(f"Colunas obrigatórias não encontradas: {', '.join(faltando)}")
+    indices = {coluna: cabecalho.index(coluna) for coluna in COLUNAS if coluna in cabecalho}
+    leitor = csv.reader(linhas, delimiter=delimitador)
+    numero = 2
+    for linha in leitor:
+        if any(celula.strip() for celula in linha):
+            yield numero, {coluna: linha[indice].strip() if indice < len(linha) else '' for coluna, indice in indices.items()}
+        numero = leitor.line_num + 2  # line_num conta as linhas físicas (campos com quebra de linha) depois do cabeçalho
+
+
+def agrupar_csv(linhas):
+    """Junta as linhas consecutivas de um mesmo plano num dicionário com a lista de refeições."""
+    def chave(par):
+        numero, dados = par
+        if isinstance(dados, LinhaInvalida):
+            return ('erro', numero)
+        return dados.get('plano') or (dados['cliente_email'].lower(), dados['nutricionista_email'].lower(), dados.get('data_criacao', ''))
+
+    for _, grupo in groupby(linhas, key=chave):
+        numero, dados = next(grupo)
+        if isinstance(dados, LinhaInvalida):
+            yield numero, dados
+            continue
+        plano = {coluna: dados.get(coluna, '') for coluna in COLUNAS_PLANO}
+        plano['refeicoes'] = []
+        for _, linha in [(numero, dados), *grupo]:
+            if any(linha.get(coluna) for coluna in COLUNAS_REFEICAO):
+                plano['refeicoes'].append({
+                    'nome': linha.get('refeicao', ''), 'alimentos': linha.get('alimentos', ''),
+                    'quantidades': linha.get('quantidades', ''), 'calorias': linha.get('calorias', ''),
+                })
+        yield numero, plano
+
+
+def ler_jsonl(linhas):
+    for numero, texto in enumerate(linhas, start=1):
+        if not texto.strip():
+            continue
+        try:
+            dados = json.loads(texto)
+        except ValueError as erro:
+            yield numero, LinhaInvalida(numero, f'JSON inválido ({erro})')
+            continue
+        if not isinstance(dados, dict):
+            yield numero, LinhaInvalida(numero, 'cada linha deve ser um objeto JSON com um plano')
+            continue
+        yield numero, dados
+
+
+def ler_planos(linhas, formato, delimitador=None):
+    if formato == 'csv':
+        return agrupar_csv(ler_csv(linhas, delimitador))
+    return ler_jsonl(linhas)
+
+
+# --- Validação ---
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def _booleano(valor):
+    if isinstance(valor, bool):
+        return valor
+    texto = _texto(valor).lower()
+    if texto in VERDADEIRO or texto in FALSO:
+        return texto in VERDADEIRO
+    raise ValueError(f'rascunho inválido: {valor!r}')
+
+
+def _data(valor):
+    texto = _texto(valor)
+    if not texto:
+        return None
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f'data_criacao inválida: {texto!r} (use AAAA-MM-DD ou DD/MM/AAAA)')
+
+
+def _refeicao(dados):
+    if not isinstance(dados, dict):
+        raise ValueError('cada refeição deve ser um objeto')
+    nome = _texto(dados.get('nome')); alimentos = _texto(dados.get('alimentos')); quantidades = _texto(dados.get('quantidades'))
+    if not nome or not alimentos or not quantidades:
+        raise ValueError('refeição sem nome, alimentos ou quantidades')
+    if len(nome) > 100 or len(quantidades) > 255:
+        raise ValueError(f'refeição "{nome[:30]}": nome ou quantidades longos demais')
+    calorias = _texto(dados.get('calorias'))
+    try:
+        calorias = round(float(calorias.replace(',', '.'))) if calorias else None
+    except ValueError:
+        raise ValueError(f'calorias inválidas: {calorias!r}')
+    if calorias is not None and calorias < 0:
+        raise ValueError('calorias negativas')
+    return {'nome': nome, 'alimentos': alimentos, 'quantidades': quantidades, 'calorias': calorias}
+
+
+def validar(planos):
+    """Normaliza cada plano lido; os inválidos viram LinhaInvalida e seguem no fluxo."""
+    for numero, dados in planos:
+        if isinstance(dados, LinhaInvalida):
+            yield numero, dados
+            continue
+        try:
+            cliente_email = _texto(dados.get('cliente_email')).lower(); nutricionista_email = _texto(dados.get('nutricionista_email')).lower()
+            if '@' not in cliente_email or '@' not in nutricionista_email:
+                raise ValueError('cliente_email e nutricionista_email são obrigatórios')
+            refeicoes = dados.get('refeicoes') or []
+            if not isinstance(refeicoes, list):
+                raise ValueError('"refeicoes" deve ser uma lista')
+            yield numero, {
+                'cliente_email': cliente_email, 'nutricionista_email': nutricionista_email,
+                'data_criacao': _data(dados.get('data_criacao')), 'rascunho': _booleano(dados.get('rascunho')),
+                'observacoes': _texto(dados.get('observacoes')) or None,
+                'refeicoes': [_refeicao(refeicao) for refeicao in refeicoes],
+            }
+        except ValueError as erro:
+            yield numero, LinhaInvalida(numero, erro)
+
+
+def em_lotes(itens, tamanho):
+    itens = iter(itens)
+    while True:
+        lote = list(islice(itens, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+# --- Gravação ---
+
+class ImportadorPlanos:
+    """Grava os planos validados em lotes; guarda os primeiros MAX_ERROS erros e conta o resto."""
+
+    def __init__(self, tamanho_lote=1000):
+        self.tamanho_lote = tamanho_lote
+        self.erros = []
+        self.total_erros = 0
+
+    def registrar_erro(self, erro):
+        self.total_erros += 1
+        if len(self.erros) < MAX_ERROS:
+            self.erros.append(str(erro))
+
+    def resolver_emails(self, planos):
+        """{e-mail: id} de clientes e de nutricionistas do lote, uma query para cada."""
+        clientes = {plano['cliente_email'] for plano in planos}; nutricionistas = {plano['nutricionista_email'] for plano in planos}
+        return (
+            dict(Cliente.objects.annotate(email=Lower('usuario__email')).filter(email__in=clientes).values_list('email', 'id')),
+            dict(Nutricionista.objects.annotate(email=Lower('usuario__email')).filter(email__in=nutricionistas).values_list('email', 'id')),
+        )
+
+    def gravar(self, lote):
+        clientes, nutricionistas = self.resolver_emails([plano for _, plano in lote])
+        validos = []
+        for numero, plano in lote:
+            if plano['cliente_email'] not in clientes:
+                self.registrar_erro(LinhaInvalida(numero, f"cliente {plano['cliente_email']} não encontrado"))
+            elif plano['nutricionista_email'] not in nutricionistas:
+                self.registrar_erro(LinhaInvalida(numero, f"nutricionista {plano['nutricionista_email']} não encontrado"))
+            else:
+                validos.append(plano)
+        if not validos:
+            return 0, 0
+        objetos = [
+            PlanoAlimentar(
+                cliente_id=clientes[plano['cliente_email']], nutricionista_id=nutricionistas[plano['nutricionista_email']],
+                observacoes=plano['observacoes'], rascunho=plano['rascunho'],
+            ) for plano in validos
+        ]
+        with transaction.atomic():
+            inserir_em_lote(PlanoAlimentar, objetos, self.tamanho_lote)
+            # auto_now_add sobrescreve a data no INSERT; a data de origem entra num UPDATE em lote
+            datados = []
+            for objeto, plano in zip(objetos, validos):
+                if plano['data_criacao']:
+                    objeto.data_criacao = plano['data_criacao']; datados.append(objeto)
+            PlanoAlimentar.objects.bulk_update(datados, ['data_criacao'], batch_size=self.tamanho_lote)
+            refeicoes = [
+                Refeicao(plano_alimentar_id=objeto.id, **refeicao)
+                for objeto, plano in zip(objetos, validos) for refeicao in plano['refeicoes']
+            ]
+            Refeicao.objects.bulk_create(refeicoes, batch_size=self.tamanho_lote)
+            # bulk_create não dispara os sinais que invalidam o dashboard do cliente
+            for cliente_id in {objeto.cliente_id for objeto in objetos if not objeto.rascunho}:
+                dashboard.invalidar_dashboard_cliente(cliente_id)
+        return len(objetos), len(refeicoes)
+
+    def importar(self, planos):
+        """Consome (número, plano) de ler_planos; devolve contagens, erros e planos por segundo."""
+        inicio = time.perf_counter()
+        total_planos = total_refeicoes = 0
+        for lote in em_lotes(validar(planos), self.tamanho_lote):
+            validos = []
+            for numero, plano in lote:
+                if isinstance(plano, LinhaInvalida):
+                    self.registrar_erro(plano)
+                else:
+                    validos.append((numero, plano))
+            if validos:
+                novos, refeicoes = self.gravar(validos)
+                total_planos += novos; total_refeicoes += refeicoes
+        segundos = time.perf_counter() - inicio
+        return {
+            'planos': total_planos, 'refeicoes': total_refeicoes, 'erros': self.total_erros, 'segundos': round(segundos, 3),
+            'planos_por_segundo': round(total_planos / segundos, 1) if segundos else None,
+        }
+
+
+# --- Exportação ---
+
+def planos_para_exportar(planos, tamanho_lote=1000):
+    """Percorre os planos em páginas por id, com as refeições de cada página numa query só."""
+    planos = planos.select_related('cliente__usuario', 'nutricionista__usuario').prefetch_related(
+        Prefetch('refeicoes', queryset=Refeicao.objects.order_by('id')),
+        Prefetch('modelo__refeicoes', queryset=Refeicao.objects.order_by('id')),
+    )
+    ultimo = 0
+    while True:
+        pagina = list(planos.filter(id__gt=ultimo).order_by('id')[:tamanho_lote])
+        if not pagina:
+            return
+        yield from pagina
+        ultimo = pagina[-1].id
+
+
+def _dados_plano(plano):
+    return {
+        'plano': plano.id, 'cliente_email': plano.cliente.usuario.email, 'nutricionista_email': plano.nutricionista.usuario.email,
+        'data_criacao': plano.data_criacao.isoformat() if isinstance(plano.data_criacao, date) else '',
+        'rascunho': plano.rascunho, 'observacoes': plano.observacoes or '',
+    }
+
+
+class _Eco:
+    """'Arquivo' do csv.writer que devolve a linha formatada em vez de guardá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(planos, tamanho_lote=1000):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUNAS)
+    for plano in planos_para_exportar(planos, tamanho_lote):
+        dados = _dados_plano(plano)
+        inicio = [dados[coluna] for coluna in COLUNAS_PLANO]
+        inicio[4] = 'true' if plano.rascunho else 'false'
+        refeicoes = plano.refeicoes_do_plano()
+        if not refeicoes:
+            yield escritor.writerow(inicio + [''] * len(COLUNAS_REFEICAO))
+        for refeicao in refeicoes:
+            yield escritor.writerow(inicio + [refeicao.nome, refeicao.alimentos, refeicao.quantidades, '' if refeicao.calorias is None else refeicao.calorias])
+
+
+def exportar_jsonl(planos, tamanho_lote=1000):
+    for plano in planos_para_exportar(planos, tamanho_lote):
+        dados = _dados_plano(plano)
+        dados['refeicoes'] = [
+            {'nome': refeicao.nome, 'alimentos': refeicao.alimentos, 'quantidades': refeicao.quantidades, 'calorias': refeicao.calorias}
+            for refeicao in plano.refeicoes_do_plano()
+        ]
+        yield json.dumps(dados, ensure_ascii=False) + '\n'
+
+
+def exportar(planos, formato, tamanho_lote=1000):
+    return (exportar_csv if formato == 'csv' else exportar_jsonl)(planos, tamanho_lote)
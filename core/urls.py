@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, views_async
+
+# Com VIEWS_ASYNC (perfil de deploy ASGI) as rotas principais dos endpoints JSON usam as versões async
+views_json = views_async if settings.VIEWS_ASYNC else views
  
 urlpatterns = [
     # Autenticação
@@ -11,11 +15,27 @@ urlpatterns = [
     path('dashboard/nutricionista/', views.dashboard_nutricionista, name='dashboard_nutri'),
     path('cadastro/cliente/', views.cadastro_cliente_perfil, name='cadastro_cliente_perfil'),
     path('dashboard/cliente/', views.dashboard_cliente, name='dashboard_cliente'),
-    path('cliente/perfil/', views.perfil_cliente, name='perfil_cliente'),
+    path('cliente/perfil/', views_json.perfil_cliente, name='perfil_cliente'),
     path('cliente/consultas/', views.consultas_cliente, name='consultas_cliente'),
+    path('cliente/api/consultas/', views.api_consultas_cliente, name='api_consultas_cliente'),
     path('cliente/encontrar-nutri/', views.encontrar_nutricionista, name='encontrar_nutricionista'),
+    path('cliente/api/nutricionistas/', views.api_nutricionistas, name='api_nutricionistas'),
     path('cliente/agendar/<int:nutri_id>/', views.agendar_consulta, name='agendar_consulta'),
-    path('cliente/api/horarios-disponiveis/', views.api_horarios_disponiveis, name='api_horarios_disponiveis'),
+    path('cliente/api/horarios-disponiveis/', views_json.api_horarios_disponiveis, name='api_horarios_disponiveis'),
+    path('cliente/api/reservar-horario/', views.api_reservar_horario, name='api_reservar_horario'),
+    path('cliente/async/perfil/', views_async.perfil_cliente, name='perfil_cliente_async'),
+    path('cliente/async/api/horarios-disponiveis/', views_async.api_horarios_disponiveis, name='api_horarios_disponiveis_async'),
     path('cliente/planos/', views.planos_alimentares_cliente, name='planos_alimentares_cliente'),
+    # Feed iCalendar das consultas (cliente e nutricionista), autenticado pelo token
+    path('calendario/<str:token>.ics', views.calendario_ics, name='calendario_ics'),
+    path('calendario/regenerar/', views.regenerar_calendario, name='regenerar_calendario'),
 ]
- 
\ No newline at end of file
+
+
+# Long-poll dos eventos de agenda: só no perfil ASGI (EVENTOS_LONG_POLL exige VIEWS_ASYNC). No WSGI cada
+# página de agendamento aberta seguraria uma thread do worker por EVENTOS_LONG_POLL_TIMEOUT segundos.
+rotas_eventos = [
+    path('cliente/api/eventos-agenda/', views_async.api_eventos_agenda, name='api_eventos_agenda'),
+]
+if settings.EVENTOS_LONG_POLL:
+    urlpatterns += rotas_eventos
@@ -1,13 +1,17 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import login as auth_login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse 
-from django.views.decorators.http import require_POST 
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST, require_safe
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils import timezone 
-from django.db.models import Q 
-from django.db import IntegrityError, transaction
+from django.db.models import Q, prefetch_related_objects
+from django.db import transaction
 from datetime import datetime, time, timedelta 
-import unicodedata
+from decimal import Decimal, InvalidOperation
 
 from .forms import (
     CustomAuthenticationForm, CustomUserCreationForm, NutricionistaProfileForm,
@@ -15,19 +19,18 @@ from .forms import (
 )
 from .models import (
     Nutricionista, Cliente, User, Consulta,
-    PlanoAlimentar, Refeicao, Especialidade
+    PlanoAlimentar, Refeicao, Especialidade, TokenCalendario
+)
+from . import calendario
+from .agendamento import reservar_consulta, segurar_horario
+from .dashboard import dados_dashboard_cliente
+from .metricas import resumo_nutricionista
+from .nutrientes import totais_plano
+from .paginacao import CursorInvalido, paginar_por_chave
+from .disponibilidade import (
+    MAX_DIAS_INTERVALO, definir_janelas_semanais, horarios_livres,
+    proximos_horarios, serializar_horarios, serializar_intervalo
 )
-
-
-def normalizar_nome_refeicao(nome):
-    if not nome:
-        return ""
-    
-    nfkd_form = unicodedata.normalize('NFKD', nome)
-    nome_sem_acentos = "".join([c for c in nfkd_form if not unicodedata.combining(c)])
-    
-    return nome_sem_acentos.lower().replace(" ", "_").replace("-", "_")
-
 
 
 def login_usuario(request):
@@ -73,12 +76,12 @@ def cadastro_nutricionista(request):
     if request.method == 'POST':
         form = NutricionistaProfileForm(request.POST)
         if form.is_valid():
-            cd = form.cleaned_data; horarios = {}
-            dias = ['segunda','terca','quarta','quinta','sexta','sabado']
-            for dia in dias:
-                if cd[f'{dia}_ativo']:
-                    horarios[dia] = { 'inicio': cd[f'{dia}_inicio'].strftime('%H:%M') if cd[f'{dia}_inicio'] else None, 'fim': cd[f'{dia}_fim'].strftime('%H:%M') if cd[f'{dia}_fim'] else None }
-            nutri, created = Nutricionista.objects.update_or_create( usuario=request.user, defaults={ 'preco_consulta': cd['preco_consulta'], 'duracao_consulta': cd['duracao_consulta'], 'horarios_disponiveis': horarios })
+            cd = form.cleaned_data; janelas = []
+            for numero, (dia, _) in enumerate(form.dias_semana):
+                if cd[f'{dia}_ativo'] and cd[f'{dia}_inicio'] and cd[f'{dia}_fim']:
+                    janelas.append((numero, cd[f'{dia}_inicio'], cd[f'{dia}_fim']))
+            nutri, created = Nutricionista.objects.update_or_create( usuario=request.user, defaults={ 'preco_consulta': cd['preco_consulta'], 'duracao_consulta': cd['duracao_consulta'] })
+            definir_janelas_semanais(nutri, janelas)
             nutri.especialidades.set(cd['especialidades']); user = request.user
             user.user_type = User.UserType.NUTRICIONISTA; user.save()
             nutri.is_approved = False
@@ -89,7 +92,12 @@ def cadastro_nutricionista(request):
  
 @login_required
 def dashboard_nutricionista(request):
-    context = {}
+    try:
+        nutricionista = request.user.perfil_nutricionista
+    except Nutricionista.DoesNotExist:
+        return redirect('cadastro_nutricionista')
+    # Só lê o rollup de core.metricas (e a agenda semanal, para a ocupação), não o histórico de consultas
+    context = {'nutricionista': nutricionista, 'url_calendario': _url_calendario(request), **resumo_nutricionista(nutricionista)}
     return render(request, 'core/dashboard_nutricionista.html', context)
  
 # --- VIEWS DO CLIENTE ---
@@ -110,20 +118,10 @@ def dashboard_cliente(request):
         cliente = request.user.perfil_cliente
     except Cliente.DoesNotExist:
         return redirect('cadastro_cliente_perfil')
-    proxima_consulta = Consulta.objects.filter( cliente=cliente, data_horario__gte=timezone.now(), status=Consulta.StatusChoices.CONFIRMADO ).order_by('data_horario').first()
-    plano_atual = PlanoAlimentar.objects.filter( cliente=cliente ).order_by('-data_criacao').first()
-    
-    refeicoes_dict = {}
-    if plano_atual:
-        refeicoes = plano_atual.refeicoes.all()
-        for refeicao in refeicoes:
-            # --- MUDANÇA AQUI: Usa a nova função de normalização ---
-            chave = normalizar_nome_refeicao(refeicao.nome)
-            refeicoes_dict[chave] = refeicao
-            # --- FIM DA MUDANÇA ---
-            
+    # Próxima consulta, plano e refeições vêm do cache por cliente (core.dashboard)
+    dados = dados_dashboard_cliente(cliente)
     form_update = ClienteProfileUpdateForm(instance=cliente)
-    context = { 'cliente': cliente, 'proxima_consulta': proxima_consulta, 'plano_atual': plano_atual, 'refeicoes': refeicoes_dict, 'form_update': form_update }
+    context = { 'cliente': cliente, 'proxima_consulta': dados['proxima_consulta'], 'plano_atual': dados['plano_atual'], 'refeicoes': dados['refeicoes'], 'form_update': form_update }
     return render(request, 'core/dashboard_cliente.html', context)
  
 @login_required
@@ -145,6 +143,17 @@ def perfil_cliente(request):
         else: return redirect('dashboard_cliente')
     return JsonResponse({'error': 'Método não permitido'}, status=405)
  
+LISTAS_CONSULTAS = {
+    # lista: (filtro de data relativo a agora, ordenação da paginação por chave)
+    'futuras': ('data_horario__gte', ('data_horario', 'id')),
+    'passadas': ('data_horario__lt', ('-data_horario', '-id')),
+}
+
+def _pagina_consultas(cliente, lista, cursor=None, agora=None):
+    filtro, campos = LISTAS_CONSULTAS[lista]
+    consultas = Consulta.objects.filter(cliente=cliente, **{filtro: agora or timezone.now()}).select_related('nutricionista__usuario')
+    return paginar_por_chave(consultas, campos, cursor)
+
 @login_required
 def consultas_cliente(request):
     try:
@@ -152,21 +161,117 @@ def consultas_cliente(request):
     except Cliente.DoesNotExist:
         return redirect('cadastro_cliente_perfil')
     now = timezone.now()
-    consultas_futuras = Consulta.objects.filter( cliente=cliente, data_horario__gte=now ).order_by('data_horario')
-    consultas_passadas = Consulta.objects.filter( cliente=cliente, data_horario__lt=now ).order_by('-data_horario')
-    context = { 'consultas_futuras': consultas_futuras, 'consultas_passadas': consultas_passadas }
+    consultas_futuras, cursor_futuras = _pagina_consultas(cliente, 'futuras', agora=now)
+    consultas_passadas, cursor_passadas = _pagina_consultas(cliente, 'passadas', agora=now)
+    context = { 'consultas_futuras': consultas_futuras, 'consultas_passadas': consultas_passadas, 'cursor_futuras': cursor_futuras, 'cursor_passadas': cursor_passadas, 'url_calendario': _url_calendario(request) }
     return render(request, 'core/consultas_cliente.html', context)
- 
+
 @login_required
-def encontrar_nutricionista(request):
+def api_consultas_cliente(request):
+    cliente = cliente_do_usuario(request.user)
+    if cliente is None:
+        return JsonResponse({'error': 'Perfil não encontrado.'}, status=404)
+    lista = request.GET.get('lista')
+    if lista not in LISTAS_CONSULTAS:
+        return JsonResponse({'error': 'Lista inválida.'}, status=400)
+    try:
+        consultas, proximo_cursor = _pagina_consultas(cliente, lista, request.GET.get('cursor'))
+    except CursorInvalido as erro:
+        return JsonResponse({'error': str(erro)}, status=400)
+    resultados = [{
+        'id': consulta.id, 'data_horario': timezone.localtime(consulta.data_horario).isoformat(),
+        'nutricionista': consulta.nutricionista.usuario.get_full_name(),
+        'modalidade': consulta.modalidade, 'modalidade_display': consulta.get_modalidade_display(),
+        'status': consulta.status, 'status_display': consulta.get_status_display(),
+    } for consulta in consultas]
+    return JsonResponse({'resultados': resultados, 'proximo_cursor': proximo_cursor})
+ 
+def _data_do_get(request, nome):
+    try:
+        return datetime.strptime(request.GET.get(nome, ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def _decimal_do_get(request, nome):
+    try:
+        return Decimal(request.GET.get(nome, '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+LIMITE_PROXIMOS_HORARIOS = 50
+
+def cliente_do_usuario(usuario):
+    # Com o PerfilModelBackend o perfil já vem carregado junto com o usuário: nenhuma consulta extra
+    try:
+        return usuario.perfil_cliente
+    except Cliente.DoesNotExist:
+        return None
+
+def _listar_nutricionistas(request):
+    """Aplica os filtros da busca e retorna (nutricionistas, próximo cursor, ordenado por horário?).
+
+    Usuário e especialidades vêm junto (join + prefetch): o número de consultas é
+    constante, não importa quantos cartões a página tenha.
+    """
     nutricionistas = Nutricionista.objects.filter(is_approved=True)
-    especialidades = Especialidade.objects.all()
     especialidade_id = request.GET.get('especialidade')
     if especialidade_id:
         nutricionistas = nutricionistas.filter(especialidades__id=especialidade_id)
-    context = { 'nutricionistas': nutricionistas, 'especialidades': especialidades, 'filtro_atual': int(especialidade_id) if especialidade_id else None }
+    modalidade = request.GET.get('modalidade')
+    if modalidade == Consulta.ModalidadeChoices.PRESENCIAL:
+        nutricionistas = nutricionistas.filter(atende_presencial=True)
+    elif modalidade == Consulta.ModalidadeChoices.ONLINE:
+        nutricionistas = nutricionistas.filter(atende_online=True)
+    preco_min = _decimal_do_get(request, 'preco_min'); preco_max = _decimal_do_get(request, 'preco_max')
+    if preco_min is not None: nutricionistas = nutricionistas.filter(preco_consulta__gte=preco_min)
+    if preco_max is not None: nutricionistas = nutricionistas.filter(preco_consulta__lte=preco_max)
+    nutricionistas = nutricionistas.select_related('usuario')
+
+    if request.GET.get('ordenar') != 'proximo_horario':
+        nutricionistas, proximo_cursor = paginar_por_chave(nutricionistas.prefetch_related('especialidades'), ('preco_consulta', 'id'), request.GET.get('cursor'))
+        return nutricionistas, proximo_cursor, False
+
+    # --- Busca "primeiro horário livre": calculada de uma vez para todos os candidatos ---
+    data_inicio = max(_data_do_get(request, 'data_inicio') or timezone.localdate(), timezone.localdate())
+    data_fim = _data_do_get(request, 'data_fim') or data_inicio + timedelta(days=13)
+    data_fim = min(max(data_fim, data_inicio), data_inicio + timedelta(days=MAX_DIAS_INTERVALO - 1))
+    candidatos = list(nutricionistas)
+    proximos = proximos_horarios(candidatos, data_inicio, data_fim, cliente=cliente_do_usuario(request.user))
+    for nutri in candidatos:
+        nutri.proximo_horario = proximos.get(nutri.id)
+    nutricionistas = sorted((nutri for nutri in candidatos if nutri.proximo_horario), key=lambda nutri: (nutri.proximo_horario, nutri.preco_consulta, nutri.id))[:LIMITE_PROXIMOS_HORARIOS]
+    prefetch_related_objects(nutricionistas, 'especialidades')
+    return nutricionistas, None, True
+
+@login_required
+def encontrar_nutricionista(request):
+    try:
+        nutricionistas, proximo_cursor, ordenar_por_horario = _listar_nutricionistas(request)
+    except CursorInvalido:
+        return redirect('encontrar_nutricionista')
+    proxima_pagina = None
+    if proximo_cursor:
+        parametros = request.GET.copy(); parametros['cursor'] = proximo_cursor
+        proxima_pagina = parametros.urlencode()
+    filtros = request.GET.copy(); filtros.pop('cursor', None)
+    especialidade_id = request.GET.get('especialidade')
+    context = { 'nutricionistas': nutricionistas, 'especialidades': Especialidade.objects.all(), 'filtro_atual': int(especialidade_id) if especialidade_id else None, 'filtros': filtros, 'ordenar_por_horario': ordenar_por_horario, 'modalidades': Consulta.ModalidadeChoices.choices, 'proxima_pagina': proxima_pagina }
     return render(request, 'core/encontrar_nutricionista.html', context)
 
+@login_required
+def api_nutricionistas(request):
+    try:
+        nutricionistas, proximo_cursor, _ = _listar_nutricionistas(request)
+    except CursorInvalido as erro:
+        return JsonResponse({'error': str(erro)}, status=400)
+    resultados = [{
+        'id': nutri.id, 'nome': nutri.usuario.get_full_name(), 'especialidades': [esp.nome for esp in nutri.especialidades.all()],
+        'preco_consulta': str(nutri.preco_consulta), 'atende_presencial': nutri.atende_presencial, 'atende_online': nutri.atende_online,
+        'proximo_horario': nutri.proximo_horario.isoformat() if getattr(nutri, 'proximo_horario', None) else None,
+        'agendar_url': reverse('agendar_consulta', args=[nutri.id]),
+    } for nutri in nutricionistas]
+    return JsonResponse({'resultados': resultados, 'proximo_cursor': proximo_cursor})
+
 @login_required
 def agendar_consulta(request, nutri_id):
     nutricionista = get_object_or_404(Nutricionista, id=nutri_id, is_approved=True)
@@ -174,46 +279,58 @@ def agendar_consulta(request, nutri_id):
     if request.method == 'POST':
         form = ConsultaForm(request.POST)
         if form.is_valid():
-            try:
-                consulta = form.save(commit=False); consulta.cliente = cliente; consulta.nutricionista = nutricionista
-                consulta.data_horario = form.cleaned_data['data_horario_selecionado']
-                consulta.status = Consulta.StatusChoices.CONFIRMADO; consulta.save() 
+            resultado = reservar_consulta(cliente, nutricionista, form.cleaned_data['data_horario_selecionado'], form.cleaned_data['modalidade'])
+            if resultado.sucesso:
                 return redirect('consultas_cliente')
-            except IntegrityError:
-                form.add_error(None, "Desculpe, este horário acabou de ser agendado. Por favor, escolha outro.")
+            form.add_error(None, resultado.mensagem)
     else: form = ConsultaForm()
-    context = { 'nutricionista': nutricionista, 'form': form, 'today': timezone.now() }
+    # A rota do long-poll de eventos só existe com EVENTOS_LONG_POLL (ver core.urls)
+    context = { 'nutricionista': nutricionista, 'form': form, 'today': timezone.now(), 'eventos_agenda': settings.EVENTOS_LONG_POLL }
     return render(request, 'core/agendar_consulta.html', context)
 
 @login_required
 def api_horarios_disponiveis(request):
-    nutricionista_id = request.GET.get('nutri_id'); data_selecionada_str = request.GET.get('data') 
-    if not nutricionista_id or not data_selecionada_str:
+    nutricionista_id = request.GET.get('nutri_id'); data_selecionada_str = request.GET.get('data')
+    inicio_str = request.GET.get('inicio'); fim_str = request.GET.get('fim')
+    if not nutricionista_id or not (data_selecionada_str or (inicio_str and fim_str)):
         return JsonResponse({'error': 'Faltando parâmetros'}, status=400)
     try:
         nutri = Nutricionista.objects.get(id=nutricionista_id)
-        data_selecionada = datetime.strptime(data_selecionada_str, '%Y-%m-%d').date()
-        dia_semana_num = data_selecionada.weekday(); dias_map = ['segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo']; dia_semana_str = dias_map[dia_semana_num]
-        horarios_dia = nutri.horarios_disponiveis.get(dia_semana_str)
-        if not horarios_dia or not horarios_dia.get('inicio') or not horarios_dia.get('fim'):
-            return JsonResponse({'horarios': []}) 
-        inicio_str = horarios_dia['inicio']; fim_str = horarios_dia['fim']; duracao = nutri.duracao_consulta
-        hora_inicio = datetime.strptime(inicio_str, '%H:%M').time(); hora_fim = datetime.strptime(fim_str, '%H:%M').time()
-        consultas_marcadas = Consulta.objects.filter( nutricionista=nutri, data_horario__date=data_selecionada, status=Consulta.StatusChoices.CONFIRMADO ).values_list('data_horario', flat=True)
-        horarios_ocupados = {consulta.time() for consulta in consultas_marcadas}
-        horarios_disponiveis = []; hora_atual = datetime.combine(data_selecionada, hora_inicio); hora_fim_dt = datetime.combine(data_selecionada, hora_fim)
-        agora = timezone.now()
-        while hora_atual < hora_fim_dt:
-            hora_atual_com_tz = timezone.make_aware(hora_atual, timezone.get_default_timezone())
-            if hora_atual.time() not in horarios_ocupados and hora_atual_com_tz > agora:
-                horarios_disponiveis.append({ 'display': hora_atual.strftime('%H:%M'), 'valor_iso': hora_atual.isoformat() })
-            hora_atual += timedelta(minutes=duracao)
-        return JsonResponse({'horarios': horarios_disponiveis})
+        cliente = cliente_do_usuario(request.user)
+        if data_selecionada_str:
+            data_selecionada = datetime.strptime(data_selecionada_str, '%Y-%m-%d').date()
+            dias = horarios_livres(nutri, data_selecionada, data_selecionada, cliente=cliente)
+            return JsonResponse({'horarios': serializar_horarios(dias[data_selecionada])})
+        # --- Modo intervalo: todos os dias de uma vez, para o calendário do mês ---
+        inicio = datetime.strptime(inicio_str, '%Y-%m-%d').date(); fim = datetime.strptime(fim_str, '%Y-%m-%d').date()
+        if fim < inicio or (fim - inicio).days >= MAX_DIAS_INTERVALO:
+            return JsonResponse({'error': f'Intervalo inválido (máximo de {MAX_DIAS_INTERVALO} dias).'}, status=400)
+        dias = horarios_livres(nutri, inicio, fim, cliente=cliente)
+        return JsonResponse({'inicio': inicio.isoformat(), 'fim': fim.isoformat(), 'duracao': nutri.duracao_consulta, 'dias': serializar_intervalo(dias)})
     except Nutricionista.DoesNotExist:
         return JsonResponse({'error': 'Nutricionista não encontrado'}, status=404)
+    except ValueError:
+        return JsonResponse({'error': 'Data inválida'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@login_required
+@require_POST
+def api_reservar_horario(request):
+    try:
+        cliente = request.user.perfil_cliente
+    except Cliente.DoesNotExist:
+        return JsonResponse({'error': 'Perfil não encontrado.'}, status=404)
+    nutricionista = get_object_or_404(Nutricionista, id=request.POST.get('nutri_id'), is_approved=True)
+    try:
+        data_horario = timezone.make_aware(datetime.fromisoformat(request.POST.get('data_horario', '')), timezone.get_default_timezone())
+    except ValueError:
+        return JsonResponse({'error': 'Horário inválido'}, status=400)
+    resultado = segurar_horario(cliente, nutricionista, data_horario)
+    if not resultado.sucesso:
+        return JsonResponse({'error': resultado.mensagem, 'codigo': resultado.erro}, status=409)
+    return JsonResponse({'expira_em': resultado.reserva.expira_em.isoformat(), 'ttl': settings.RESERVA_HORARIO_TTL})
+
 @login_required
 def planos_alimentares_cliente(request):
     try:
@@ -222,19 +339,54 @@ def planos_alimentares_cliente(request):
         return redirect('cadastro_cliente_perfil')
 
     plano_atual = PlanoAlimentar.objects.filter(
-        cliente=cliente
-    ).order_by('-data_criacao').first()
+        cliente=cliente, rascunho=False
+    ).select_related('nutricionista__usuario', 'modelo').order_by('-data_criacao').first()
     
-    refeicoes = []
+    refeicoes = []; nutrientes_plano = None
     if plano_atual:
-        refeicoes = plano_atual.refeicoes.all().order_by('id') 
+        refeicoes = list(plano_atual.refeicoes_do_plano().order_by('id'))
+        totais = totais_plano(plano_atual)
+        for refeicao in refeicoes:
+            refeicao.nutrientes = totais['refeicoes'].get(refeicao.id)
+        nutrientes_plano = totais['total'] if totais['refeicoes'] else None
 
     form_update = ClienteProfileUpdateForm(instance=cliente)
 
     context = {
         'plano_atual': plano_atual,
         'refeicoes': refeicoes, 
+        'nutrientes_plano': nutrientes_plano,
         'form_update': form_update,
     }
     
-    return render(request, 'core/planos_alimentares_cliente.html', context)
\ No newline at end of file
+    return render(request, 'core/planos_alimentares_cliente.html', context)
+
+
+# --- FEEDS DE CALENDÁRIO (.ics) ---
+
+def _url_calendario(request):
+    token = calendario.token_do_usuario(request.user)
+    return request.build_absolute_uri(reverse('calendario_ics', args=[token.token]))
+
+@require_safe
+def calendario_ics(request, token):
+    # Sem login: o app de calendário se autentica só pelo token do link
+    token = get_object_or_404(TokenCalendario.objects.select_related('usuario__perfil_cliente', 'usuario__perfil_nutricionista'), token=token, usuario__is_active=True)
+    consultas = calendario.consultas_do_feed(token.usuario)
+    etag, ultima_mudanca = calendario.versao_do_feed(consultas, token)
+    # Nada mudou desde a última busca do app: 304 sem gerar o .ics
+    resposta = get_conditional_response(request, etag=etag, last_modified=ultima_mudanca)
+    if resposta is None:
+        resposta = StreamingHttpResponse(calendario.gerar_ics(consultas, token.usuario), content_type='text/calendar; charset=utf-8')
+        resposta['Content-Disposition'] = 'inline; filename="nutrione.ics"'
+    resposta['ETag'] = etag
+    resposta['Last-Modified'] = http_date(ultima_mudanca)
+    resposta['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+@login_required
+@require_POST
+def regenerar_calendario(request):
+    calendario.regenerar_token(request.user)
+    destino = 'dashboard_nutri' if hasattr(request.user, 'perfil_nutricionista') else 'consultas_cliente'
+    return redirect(destino)
@@ -0,0 +1,77 @@
+"""Versões assíncronas (ASGI) dos endpoints JSON mais chamados.
+
+O Django 3.2 não tem ORM assíncrono, e o ASGIHandler executa as views síncronas
+numa única thread compartilhada: uma requisição esperando o Postgres segura todas
+as outras do worker. Aqui cada requisição roda inteira (sessão, autenticação e
+ORM) em uma única ida a um pool de threads limitado (ASYNC_DB_WORKERS), enquanto
+o event loop segue atendendo outras conexões. O limite do pool é também o limite
+de conexões simultâneas que estas views abrem no Postgres.
+
+Isso só vale se a cadeia de middleware inteira for async: um middleware só
+síncrono é executado na thread compartilhada e leva junto todo o resto da
+requisição (inclusive a espera do long-poll). Os middlewares do projeto são
+sync e async (sync_capable/async_capable), e os testes carregam o ASGIHandler
+com todos os opcionais ligados para garantir que nenhum seja adaptado.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from . import eventos, views
+
+
+pool_banco = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_DB_WORKERS', 8), thread_name_prefix='banco-async')
+
+
+def _liberando_conexao(funcao, *args, **kwargs):
+    try:
+        return funcao(*args, **kwargs)
+    finally:
+        # As threads do pool não recebem request_finished: a conexão é tratada aqui, como no fim de uma requisição síncrona
+        close_old_connections()
+
+
+async def no_pool(funcao, *args, **kwargs):
+    """Executa uma função síncrona (ORM) no pool de banco e aguarda o resultado."""
+    return await sync_to_async(_liberando_conexao, thread_sensitive=False, executor=pool_banco)(funcao, *args, **kwargs)
+
+
+def view_no_pool(view):
+    """Transforma uma view síncrona numa view async que a executa no pool de banco."""
+    @wraps(view)
+    async def view_async(request, *args, **kwargs):
+        return await no_pool(view, request, *args, **kwargs)
+    return view_async
+
+
+api_horarios_disponiveis = view_no_pool(views.api_horarios_disponiveis)
+perfil_cliente = view_no_pool(views.perfil_cliente)
+
+
+async def api_eventos_agenda(request):
+    """Long-poll dos eventos de agenda de um nutricionista ("horário ocupado/liberado").
+
+    Sem `desde`, responde na hora só com o cursor atual. Com `desde`, espera até
+    EVENTOS_LONG_POLL_TIMEOUT segundos por eventos posteriores ao cursor; a espera
+    não ocupa thread nenhuma, só o event loop. `recarregar` indica que o cursor se
+    perdeu (histórico descartado ou processo reiniciado) e a grade deve ser recarregada.
+    """
+    if not await no_pool(lambda: request.user.is_authenticated):
+        return redirect_to_login(request.get_full_path())
+    try:
+        canal = eventos.canal_agenda(int(request.GET['nutri_id']))
+        desde = int(request.GET['desde']) if request.GET.get('desde') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Parâmetros inválidos'}, status=400)
+    fila = eventos.barramento()
+    if desde is None:
+        return JsonResponse({'eventos': [], 'ultimo': fila.ultimo(canal)})
+    novos, ultimo = await fila.aguardar(canal, desde, getattr(settings, 'EVENTOS_LONG_POLL_TIMEOUT', 25))
+    if novos is None:
+        return JsonResponse({'recarregar': True, 'eventos': [], 'ultimo': ultimo})
+    return JsonResponse({'eventos': novos, 'ultimo': ultimo})
@@ -0,0 +1,26 @@
+# Perfil de deploy ASGI:  gunicorn -c deploy/gunicorn_asgi.py config.asgi
+# Workers uvicorn (event loop) e as rotas JSON trocadas pelas versões async de core.views_async.
+# Conexões no Postgres por worker: até ASYNC_DB_WORKERS (views async) mais as views síncronas em andamento.
+# O long-poll de eventos de agenda com o BarramentoLocal (padrão) só funciona num processo: os eventos e os
+# cursores são da memória de cada worker. Com mais de um worker e ele, o long-poll é desligado
+# (EVENTOS_LONG_POLL=False) e o resto do site segue normal; para tê-lo com vários workers, configure um
+# EVENTOS_BACKEND compartilhado entre processos.
+import multiprocessing
+import os
+import sys
+
+from decouple import config
+
+os.environ.setdefault('VIEWS_ASYNC', 'True')
+os.environ.setdefault('ASYNC_DB_WORKERS', '8')
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+if workers > 1 and config('EVENTOS_BACKEND', default='core.eventos.BarramentoLocal') == 'core.eventos.BarramentoLocal':
+    # Os workers herdam o ambiente do master, que carrega este arquivo antes de subi-los
+    os.environ['EVENTOS_LONG_POLL'] = 'False'
+    sys.stderr.write(f'EVENTOS_BACKEND=core.eventos.BarramentoLocal com {workers} workers: long-poll de eventos de agenda desligado.\n')
+worker_class = 'uvicorn.workers.UvicornWorker'
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
@@ -0,0 +1,21 @@
+# Perfil de deploy WSGI (síncrono):  gunicorn -c deploy/gunicorn_wsgi.py config.wsgi
+# Cada requisição ocupa uma thread do worker enquanto espera o banco.
+# Com DB_CONN_MAX_AGE cada thread mantém a sua conexão: até WEB_WORKERS x WEB_THREADS conexões abertas no
+# Postgres (ou no PgBouncer, com DB_POOL_MODE=transacao).
+# Sem VIEWS_ASYNC: o long-poll de eventos de agenda seguraria uma thread por página aberta, então a rota
+# e o script da página de agendamento ficam desligados neste perfil.
+import multiprocessing
+import os
+
+from decouple import config
+
+if config('VIEWS_ASYNC', default=False, cast=bool):
+    raise RuntimeError('VIEWS_ASYNC é do perfil ASGI (deploy/gunicorn_asgi.py); no WSGI o long-poll ocuparia as threads dos workers.')
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'